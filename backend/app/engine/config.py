@@ -0,0 +1,27 @@
+"""Engine settings that the API needs without importing the render stack.
+
+Kept free of osmnx/matplotlib imports so routes can use them at startup.
+"""
+
+from pathlib import Path
+
+OUTPUT_DIR = Path(__file__).resolve().parent.parent.parent / "output"
+OUTPUT_DIR.mkdir(exist_ok=True)
+
+FONTS_DIR = Path(__file__).resolve().parent.parent.parent / "fonts"
+
+RESOLUTION_PRESETS = {
+    "instagram": {"name": "Instagram Post", "figsize": (12, 12), "dpi": 300, "pixels": "1080×1080"},
+    "mobile_wallpaper": {"name": "Mobile Wallpaper", "figsize": (10, 16), "dpi": 300, "pixels": "1080×1920"},
+    "hd_wallpaper": {"name": "HD Wallpaper", "figsize": (16, 10), "dpi": 300, "pixels": "1920×1080"},
+    "4k_wallpaper": {"name": "4K Wallpaper", "figsize": (16, 9), "dpi": 300, "pixels": "3840×2160"},
+    "a4_print": {"name": "A4 Print", "figsize": (12, 16), "dpi": 300, "pixels": "2480×3508"},
+    # Too large for one figure: rendered tile by tile (see tiled.py)
+    "a2_print": {"name": "A2 Print", "figsize": (16.54, 23.39), "dpi": 300, "pixels": "4962×7017", "tiled": True},
+    "a1_print": {"name": "A1 Print", "figsize": (23.39, 33.11), "dpi": 300, "pixels": "7017×9933", "tiled": True},
+    "a0_print": {"name": "A0 Print", "figsize": (33.11, 46.81), "dpi": 300, "pixels": "9933×14043", "tiled": True},
+}
+
+# Fetch pool threads are named "<prefix>-<calling thread id>_<n>" so a
+# per-job profiler can find the threads working on its behalf.
+FETCH_THREAD_PREFIX = "poster-fetch"
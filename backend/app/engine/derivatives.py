@@ -0,0 +1,79 @@
+"""Poster image encoding: the full-size PNG plus small WebP previews.
+
+The previews are produced from the same in-memory render as the PNG, so the
+poster is never decoded back from disk. They are named after the PNG as
+``<stem>_w<width>.webp`` and are removed with it by the job store.
+"""
+
+import io
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Tuple
+
+from app.services.result_store import result_store
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (256, 512, 1024)
+WEBP_QUALITY = 82
+
+
+def derivative_path(png_path: Path, width: int) -> Path:
+    return png_path.with_name(f"{png_path.stem}_w{width}.webp")
+
+
+def encode_poster_image(rgba: "np.ndarray", dpi: int) -> Dict[int, bytes]:
+    """Encode the rendered RGBA buffer: the PNG under key 0, WebP previews by width."""
+    from PIL import Image
+
+    # The poster background is opaque, so the alpha channel carries nothing
+    image = Image.fromarray(rgba[..., :3])
+    buf = io.BytesIO()
+    image.save(buf, "PNG", dpi=(dpi, dpi))
+    encoded = {0: buf.getvalue()}
+    try:
+        encoded.update(encode_derivatives(image))
+    except (OSError, ValueError) as e:
+        # Previews are an optimization; the PNG alone is a complete result
+        logger.warning("Could not encode previews: %s", e)
+    return encoded
+
+
+def encode_derivatives(image: "Image.Image") -> Dict[int, bytes]:
+    from PIL import Image
+
+    # Downscale largest-first so each size is resampled from the previous one
+    encoded = {}
+    current = image
+    for width in sorted(DERIVATIVE_WIDTHS, reverse=True):
+        if width >= current.width:
+            continue
+        height = max(1, round(current.height * width / current.width))
+        current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        buf = io.BytesIO()
+        current.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+        encoded[width] = buf.getvalue()
+    return encoded
+
+
+def poster_files(png_path: Path, encoded: Dict[int, bytes]) -> Iterator[Tuple[Path, bytes]]:
+    """(path, bytes) for each output of encode_poster_image."""
+    for width, data in encoded.items():
+        yield (derivative_path(png_path, width) if width else png_path), data
+
+
+def poster_variant(png_path: Path, width: Optional[int]) -> Tuple[Path, str]:
+    """Path and media type to serve for a poster at the requested preview width.
+
+    Falls back to the full PNG when no width is asked for or the preview was
+    never written (e.g. posters smaller than the requested width).
+    """
+    if width is not None:
+        webp = derivative_path(png_path, width)
+        if result_store.exists(webp):
+            return webp, "image/webp"
+    return png_path, "image/png"
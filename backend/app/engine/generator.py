@@ -1,80 +1,147 @@
 import logging
+import math
+import os
 import re
 import threading
 import time
 import uuid
 from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Callable, List, Optional
-
-from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection
 import matplotlib.font_manager as fm
 import numpy as np
 import osmnx as ox
 from shapely.geometry import Point
 
+from app.engine.config import FETCH_THREAD_PREFIX, FONTS_DIR, OUTPUT_DIR, RESOLUTION_PRESETS  # noqa: F401
+from app.engine.derivatives import encode_poster_image, poster_files
+from app.engine.polygons import draw_polygons
+from app.engine.street_ways import fetch_street_ways
+from app.engine.streets import ROAD_CLASSES, ROAD_WIDTHS, CompactStreets, compact_streets
 from app.models.themes import get_render_colors
+from app.services.cache_warmer import cache_warmer
+from app.services.geocode_cache import geocode_cache
+from app.services.map_data_cache import map_data_cache
+from app.services.result_store import result_store
+from app.services.metrics import (
+    CACHE_REQUESTS,
+    OVERPASS_ERRORS,
+    OVERPASS_REQUEST_SECONDS,
+    STAGE_SECONDS,
+    distance_bucket,
+)
 
 logger = logging.getLogger(__name__)
 
-OUTPUT_DIR = Path(__file__).resolve().parent.parent.parent / "output"
-OUTPUT_DIR.mkdir(exist_ok=True)
-
-FONTS_DIR = Path(__file__).resolve().parent.parent.parent / "fonts"
+# Callback receiving (stage name, seconds) for each timed pipeline stage
+StageObserver = Callable[[str, float], None]
 
-RESOLUTION_PRESETS = {
-    "instagram": {"name": "Instagram Post", "figsize": (12, 12), "dpi": 300, "pixels": "1080×1080"},
-    "mobile_wallpaper": {"name": "Mobile Wallpaper", "figsize": (10, 16), "dpi": 300, "pixels": "1080×1920"},
-    "hd_wallpaper": {"name": "HD Wallpaper", "figsize": (16, 10), "dpi": 300, "pixels": "1920×1080"},
-    "4k_wallpaper": {"name": "4K Wallpaper", "figsize": (16, 9), "dpi": 300, "pixels": "3840×2160"},
-    "a4_print": {"name": "A4 Print", "figsize": (12, 16), "dpi": 300, "pixels": "2480×3508"},
-}
+# (CompactStreets, water GeoDataFrame or None, parks GeoDataFrame or None)
+MapData = Tuple[Any, Any, Any]
 
 # Configure OSMnx settings for reliability
 ox.settings.timeout = 180
-ox.settings.use_cache = True
+ox.settings.use_cache = os.environ.get("OSMNX_USE_CACHE", "1") != "0"
 ox.settings.log_console = True
 ox.settings.max_query_area_size = 50 * 1000 * 50 * 1000  # 50km × 50km
 ox.settings.overpass_rate_limit = False
-
-# Overpass mirrors — tried in order; fall back on 504/timeout
+ox.settings.nominatim_url = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+
+# Overpass mirrors — tried in order; fall back on 504/timeout. These are API
+# base URLs: OSMnx appends "/interpreter" itself. Override with a
+# comma-separated OVERPASS_ENDPOINTS (e.g. to point at bench.upstream).
+_DEFAULT_OVERPASS_ENDPOINTS = [
+    "https://overpass-api.de/api",
+    "https://overpass.kumi.systems/api",
+    "https://maps.mail.ru/osm/tools/overpass/api",
+]
 _OVERPASS_ENDPOINTS = [
-    "https://overpass-api.de/api/interpreter",
-    "https://overpass.kumi.systems/api/interpreter",
-    "https://maps.mail.ru/osm/tools/overpass/api/interpreter",
+    url.strip().rstrip("/")
+    for url in os.environ.get("OVERPASS_ENDPOINTS", ",".join(_DEFAULT_OVERPASS_ENDPOINTS)).split(",")
+    if url.strip()
 ]
 
-# Lock to protect ox.settings.overpass_url which is a module-level global.
-# Each call sets the URL then makes an HTTP request — without a lock, concurrent
-# threads would stomp on each other's endpoint setting.
-_overpass_lock = threading.Lock()
+# "ways" fetches street lines straight from Overpass (see street_ways);
+# "graph" builds the OSMnx graph first, with its simplification and caching
+STREET_FETCH_MODE = os.environ.get("STREET_FETCH_MODE", "ways")
+
+_METERS_PER_DEGREE = 111_320.0
+
+class FetchCancelled(Exception):
+    """Raised when a background fetch gives way to foreground work."""
 
 
-def _call_with_overpass_fallback(fn, *args, **kwargs):
-    """Try fn() across multiple Overpass endpoints, falling back on failure."""
+class _OverpassLock:
+    """Serializes Overpass calls, letting foreground callers go first.
+
+    ox.settings.overpass_url is a module-level global: each call sets the URL
+    then makes an HTTP request, so without a lock concurrent threads would
+    stomp on each other's endpoint setting. Background calls (the cache
+    warmer's) wait until no foreground call is waiting, so a user request
+    queues behind at most the one background request already in flight.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._held = False
+        self._foreground_waiting = 0
+
+    @contextmanager
+    def hold(self, background: bool = False) -> Iterator[None]:
+        with self._cond:
+            if not background:
+                self._foreground_waiting += 1
+            try:
+                while self._held or (background and self._foreground_waiting):
+                    self._cond.wait()
+            finally:
+                if not background:
+                    self._foreground_waiting -= 1
+            self._held = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._held = False
+                self._cond.notify_all()
+
+
+_overpass_lock = _OverpassLock()
+
+
+def _call_with_overpass_fallback(fn, *args, yield_to: Optional[Callable[[], bool]] = None, **kwargs):
+    """Try fn() across multiple Overpass endpoints, falling back on failure.
+
+    With `yield_to` the call runs in the background: it waits for foreground
+    calls and raises FetchCancelled instead of starting a request while
+    yield_to() is true.
+    """
     last_error = None
     for endpoint in _OVERPASS_ENDPOINTS:
-        with _overpass_lock:
+        with _overpass_lock.hold(background=yield_to is not None):
+            if yield_to is not None and yield_to():
+                raise FetchCancelled("Foreground work is waiting")
             ox.settings.overpass_url = endpoint
+            t = time.monotonic()
             try:
                 return fn(*args, **kwargs)
             except Exception as e:
                 last_error = e
+                OVERPASS_ERRORS.inc(endpoint=endpoint)
                 logger.warning("Overpass endpoint %s failed: %s — trying next", endpoint, e)
+            finally:
+                OVERPASS_REQUEST_SECONDS.observe(time.monotonic() - t, endpoint=endpoint)
     # All endpoints failed — raise the last error
     raise last_error  # type: ignore[misc]
 
 
-# Module-level geocoding cache: query string -> (lat, lng), LRU via OrderedDict
-_GEOCODE_CACHE_MAX = 1024
-_geocode_cache: OrderedDict[str, tuple[float, float]] = OrderedDict()
-
-
 def _load_font(name: str) -> Optional[fm.FontProperties]:
     """Load a Roboto font variant, returning None if not found."""
     path = FONTS_DIR / name
@@ -99,6 +166,15 @@ def _make_font(font_file: Optional[fm.FontProperties], size: float) -> fm.FontPr
     return fm.FontProperties(family="monospace", size=size)
 
 
+def warm_up() -> None:
+    """Draw a tiny figure with the poster fonts so the first job skips font and Agg setup."""
+    fig = plt.figure(figsize=(1, 1), dpi=50)
+    for font in (_font_bold, _font_regular, _font_light):
+        fig.text(0.5, 0.5, "Cartographix", fontproperties=_make_font(font, 12))
+    fig.canvas.draw()
+    plt.close(fig)
+
+
 def _is_latin(text: str) -> bool:
     """Check if text is predominantly Latin script."""
     if not text:
@@ -106,46 +182,10 @@ def _is_latin(text: str) -> bool:
     return all(ord(c) < 0x250 or not c.isalpha() for c in text)
 
 
-def _get_edge_colors(g, theme_colors: dict) -> list:
-    """Get per-edge colors based on road classification."""
-    colors = []
-    for _u, _v, data in g.edges(data=True):
-        highway = data.get("highway", "unclassified")
-        if isinstance(highway, list):
-            highway = highway[0] if highway else "unclassified"
-        if highway in ("motorway", "motorway_link"):
-            colors.append(theme_colors["road_motorway"])
-        elif highway in ("trunk", "trunk_link", "primary", "primary_link"):
-            colors.append(theme_colors["road_primary"])
-        elif highway in ("secondary", "secondary_link"):
-            colors.append(theme_colors["road_secondary"])
-        elif highway in ("tertiary", "tertiary_link"):
-            colors.append(theme_colors["road_tertiary"])
-        elif highway in ("residential", "living_street", "unclassified"):
-            colors.append(theme_colors["road_residential"])
-        else:
-            colors.append(theme_colors["road_default"])
-    return colors
-
-
-def _get_edge_widths(g) -> list:
-    """Get per-edge widths based on road classification."""
-    widths = []
-    for _u, _v, data in g.edges(data=True):
-        highway = data.get("highway", "unclassified")
-        if isinstance(highway, list):
-            highway = highway[0] if highway else "unclassified"
-        if highway in ("motorway", "motorway_link"):
-            widths.append(1.2)
-        elif highway in ("trunk", "trunk_link", "primary", "primary_link"):
-            widths.append(1.0)
-        elif highway in ("secondary", "secondary_link"):
-            widths.append(0.8)
-        elif highway in ("tertiary", "tertiary_link"):
-            widths.append(0.6)
-        else:
-            widths.append(0.4)
-    return widths
+def _street_style(streets: CompactStreets, theme_colors: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-street RGBA colors and line widths from road classification."""
+    palette = mcolors.to_rgba_array([theme_colors[f"road_{name}"] for name in ROAD_CLASSES])
+    return palette[streets.road_class], ROAD_WIDTHS[streets.road_class]
 
 
 def _create_gradient_fade(ax: plt.Axes, color: str, location: str = "bottom", zorder: int = 10) -> None:
@@ -187,17 +227,9 @@ def _create_gradient_fade(ax: plt.Axes, color: str, location: str = "bottom", zo
     )
 
 
-def _get_crop_limits(g_proj, center_lat_lon: tuple, fig, dist: int) -> tuple:
-    """Compute crop limits in projected coordinates, centered on the city."""
-    lat, lon = center_lat_lon
-    center = ox.projection.project_geometry(
-        Point(lon, lat),
-        crs="EPSG:4326",
-        to_crs=g_proj.graph["crs"],
-    )[0]
-    center_x, center_y = center.x, center.y
-
-    fig_width, fig_height = fig.get_size_inches()
+def _crop_half_extents(figsize: Tuple[float, float], dist: int) -> Tuple[float, float]:
+    """Half-width and half-height in metres of the poster's crop window."""
+    fig_width, fig_height = figsize
     aspect = fig_width / fig_height
 
     half_x = dist
@@ -206,6 +238,19 @@ def _get_crop_limits(g_proj, center_lat_lon: tuple, fig, dist: int) -> tuple:
         half_y = half_x / aspect
     else:
         half_x = half_y * aspect
+    return half_x, half_y
+
+
+def _get_crop_limits(crs, center_lat_lon: tuple, figsize: Tuple[float, float], dist: int) -> tuple:
+    """Compute crop limits in projected coordinates, centered on the city."""
+    lat, lon = center_lat_lon
+    center = ox.projection.project_geometry(
+        Point(lon, lat),
+        crs="EPSG:4326",
+        to_crs=crs,
+    )[0]
+    center_x, center_y = center.x, center.y
+    half_x, half_y = _crop_half_extents(figsize, dist)
 
     return (
         (center_x - half_x, center_x + half_x),
@@ -213,193 +258,313 @@ def _get_crop_limits(g_proj, center_lat_lon: tuple, fig, dist: int) -> tuple:
     )
 
 
-def generate_poster(
-    city: str,
-    country: str,
-    theme: str = "default",
-    distance: int = 3000,
-    output_format: str = "instagram",
-    custom_title: str = "",
-    landmarks: Optional[List[dict]] = None,
-    on_stage: Optional[Callable[[str], None]] = None,
-) -> str:
-    """Generate a styled city map poster and return the path to the PNG file."""
-    def _set_stage(stage: str) -> None:
-        if on_stage:
-            on_stage(stage)
-        logger.info("Stage: %s", stage)
+@contextmanager
+def _timed(observe: Optional[StageObserver], stage: str) -> Iterator[None]:
+    """Report the duration of the with-block to `observe` (if given)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if observe:
+            observe(stage, time.monotonic() - start)
 
-    if distance > 30000:
-        logger.warning("Large distance requested (%d m) for %s — may be slow or fail", distance, city)
 
-    rc = get_render_colors(theme)
+def fetch_distance(distance: int, output_format: str) -> int:
+    """Half-width in metres of the area to fetch for a radius and output format.
 
-    # Geocode the location (with cache for repeat cities)
-    query = f"{city}, {country}" if country else city
-    logger.info("Geocoding: %s", query)
-    _set_stage("geocoding")
-    t0 = time.monotonic()
-    if query in _geocode_cache:
-        _geocode_cache.move_to_end(query)
-        lat, lng = _geocode_cache[query]
-        logger.info("Geocode cache hit for '%s' → (%f, %f)", query, lat, lng)
-    else:
-        try:
-            point = ox.geocode(query)
-        except Exception as e:
-            logger.error("Geocoding failed for '%s': %s", query, e)
-            raise ValueError("City not found — check the spelling or try adding a country")
-        lat, lng = point
-        _geocode_cache[query] = (lat, lng)
-        if len(_geocode_cache) > _GEOCODE_CACHE_MAX:
-            _geocode_cache.popitem(last=False)
-        logger.info("Geocoded %s to (%f, %f)", query, lat, lng)
-    logger.info("Geocoding took %.2fs", time.monotonic() - t0)
-
-    # Fetch data — use from_point with compensated distance (like MapToPoster)
+    Uses a compensated distance like MapToPoster so the cropped poster is
+    covered along its longer side.
+    """
     preset = RESOLUTION_PRESETS.get(output_format, RESOLUTION_PRESETS["instagram"])
-    figsize = preset["figsize"]
-    fig_w, fig_h = figsize
-
+    fig_w, fig_h = preset["figsize"]
     effective_distance = min(distance, 35000)
-    compensated_dist = int(effective_distance * (max(fig_h, fig_w) / min(fig_h, fig_w)) / 4)
+    return int(effective_distance * (max(fig_h, fig_w) / min(fig_h, fig_w)) / 4)
 
-    center_point = (lat, lng)
 
-    logger.info(
-        "Fetching street network for %s (dist=%d, compensated=%d, format=%s)",
-        query, effective_distance, compensated_dist, output_format,
-    )
-    _set_stage("fetching_streets")
-    t1 = time.monotonic()
+def fetch_extent(distance: int, output_format: str) -> Tuple[int, int]:
+    """Half-width and half-height in metres of the area to fetch.
+
+    This is the format's crop window, so nothing is fetched that the poster
+    does not show.
+    """
+    preset = RESOLUTION_PRESETS.get(output_format, RESOLUTION_PRESETS["instagram"])
+    half_x, half_y = _crop_half_extents(preset["figsize"], fetch_distance(distance, output_format))
+    return math.ceil(half_x), math.ceil(half_y)
 
+
+def offset_point(lat: float, lng: float, east_m: float, north_m: float) -> Tuple[float, float]:
+    """Move a point by metres east/north (local equirectangular approximation)."""
+    lat2 = lat + north_m / _METERS_PER_DEGREE
+    lng2 = lng + east_m / (_METERS_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
+    return float(np.clip(lat2, -90, 90)), float((lng2 + 180) % 360 - 180)
+
+
+def fetch_bbox(center_point: Tuple[float, float], extent: Tuple[int, int]) -> Tuple[float, float, float, float]:
+    """(left, bottom, right, top) in degrees of an extent around a point, as OSMnx takes bboxes."""
+    # Per axis with OSMnx's own spherical approximation, as graph_from_point uses
+    left, _, right, _ = ox.utils_geo.bbox_from_point(center_point, extent[0])
+    _, bottom, _, top = ox.utils_geo.bbox_from_point(center_point, extent[1])
+    return float(left), float(bottom), float(right), float(top)
+
+
+def geocode_city(city: str, country: str) -> Tuple[float, float]:
+    """(lat, lng) of a city, via the shared geocode cache. Raises ValueError if not found."""
+    query = f"{city}, {country}" if country else city
+    logger.info("Geocoding: %s", query)
+    cached = geocode_cache.lookup_point(city, country)
+    if cached:
+        CACHE_REQUESTS.inc(cache="geocode", result="hit")
+        logger.info("Geocode cache hit for '%s' → (%f, %f)", query, *cached)
+        return cached
+    CACHE_REQUESTS.inc(cache="geocode", result="miss")
+    try:
+        lat, lng = ox.geocode(query)
+    except Exception as e:
+        logger.error("Geocoding failed for '%s': %s", query, e)
+        raise ValueError("City not found — check the spelling or try adding a country")
+    geocode_cache.store_point(city, country, lat, lng)
+    logger.info("Geocoded %s to (%f, %f)", query, lat, lng)
+    return lat, lng
+
+
+def fetch_map_data(
+    center_point: Tuple[float, float],
+    extent: Tuple[int, int],
+    observe: Optional[StageObserver] = None,
+    yield_to: Optional[Callable[[], bool]] = None,
+) -> MapData:
+    """Fetch streets, water and parks in a rectangle around a point.
+
+    `extent` is the rectangle's half-width and half-height in metres (see
+    fetch_extent). Background callers pass `yield_to`, which returns True
+    while foreground work is waiting (see _call_with_overpass_fallback).
+
+    Returns (CompactStreets, water_gdf, parks_gdf); water and parks are None
+    when their fetch failed. Raises ValueError if the street network cannot be
+    fetched and FetchCancelled if a background fetch gave way.
+    """
     # --- Parallel Overpass fetches ----------------------------------------
     # Streets, water, and parks are independent API calls. We run them
     # concurrently to reduce total wall-clock time. The _overpass_lock inside
     # _call_with_overpass_fallback protects the shared ox.settings.overpass_url
-    # so threads don't stomp each other's endpoint.
+    # so threads don't stomp each other's endpoint, and lets foreground
+    # fetches overtake background ones.
     #
     # Streets is critical (failure = abort). Water/parks are non-fatal.
+    bbox = fetch_bbox(center_point, extent)
 
     def _fetch_streets():
-        return _call_with_overpass_fallback(
-            ox.graph_from_point,
-            center_point,
-            dist=compensated_dist,
-            dist_type="bbox",
-            network_type="all",
-            truncate_by_edge=True,
-        )
+        if STREET_FETCH_MODE == "ways":
+            with _timed(observe, "fetch_streets"):
+                return _call_with_overpass_fallback(fetch_street_ways, bbox, yield_to=yield_to)
+        with _timed(observe, "fetch_streets"):
+            graph = _call_with_overpass_fallback(
+                ox.graph_from_bbox,
+                bbox,
+                network_type="all",
+                truncate_by_edge=True,
+                yield_to=yield_to,
+            )
+        # Keep only coordinates and road classes; the graph is dropped here
+        with _timed(observe, "compact"):
+            return compact_streets(graph)
 
     def _fetch_water():
         try:
-            gdf = _call_with_overpass_fallback(
-                ox.features_from_point,
-                center_point,
-                tags={"natural": ["water", "bay", "strait"], "waterway": "riverbank"},
-                dist=compensated_dist,
-            )
+            with _timed(observe, "fetch_water"):
+                gdf = _call_with_overpass_fallback(
+                    ox.features_from_bbox,
+                    bbox,
+                    tags={"natural": ["water", "bay", "strait"], "waterway": "riverbank"},
+                    yield_to=yield_to,
+                )
             gdf = gdf[gdf.geometry.type.isin(["Polygon", "MultiPolygon"])]
             logger.info("Fetched %d water features", len(gdf))
             return gdf
+        except FetchCancelled:
+            raise
         except Exception as e:
             logger.warning("Water fetch failed (non-fatal): %s", e)
             return None
 
     def _fetch_parks():
         try:
-            gdf = _call_with_overpass_fallback(
-                ox.features_from_point,
-                center_point,
-                tags={"leisure": "park", "landuse": "grass"},
-                dist=compensated_dist,
-            )
+            with _timed(observe, "fetch_parks"):
+                gdf = _call_with_overpass_fallback(
+                    ox.features_from_bbox,
+                    bbox,
+                    tags={"leisure": "park", "landuse": "grass"},
+                    yield_to=yield_to,
+                )
             gdf = gdf[gdf.geometry.type.isin(["Polygon", "MultiPolygon"])]
             logger.info("Fetched %d park features", len(gdf))
             return gdf
+        except FetchCancelled:
+            raise
         except Exception as e:
             logger.warning("Parks fetch failed (non-fatal): %s", e)
             return None
 
-    with ThreadPoolExecutor(max_workers=3) as pool:
+    fetch_prefix = f"{FETCH_THREAD_PREFIX}-{threading.get_ident()}"
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix=fetch_prefix) as pool:
         streets_future: Future = pool.submit(_fetch_streets)
         water_future: Future = pool.submit(_fetch_water)
         parks_future: Future = pool.submit(_fetch_parks)
 
         # Wait for streets (critical)
         try:
-            graph = streets_future.result()
+            streets = streets_future.result()
         except MemoryError:
             raise ValueError("Area too large — try a smaller distance")
+        except FetchCancelled:
+            raise
         except Exception as e:
             logger.error("Street fetch failed: %s", e)
             raise ValueError("Could not fetch street data — try a smaller distance or different city")
 
-        # Wait for water/parks (non-fatal, already caught inside helpers)
+        # Wait for water/parks (non-fatal, already caught inside helpers
+        # except for a cancelled background fetch, which must not be cached)
         water_gdf = water_future.result()
         parks_gdf = parks_future.result()
 
-    logger.info("All fetches took %.2fs", time.monotonic() - t1)
+    return streets, water_gdf, parks_gdf
 
-    # Render poster
-    _set_stage("rendering")
-    t2 = time.monotonic()
-    try:
-        fig, ax = plt.subplots(figsize=figsize, facecolor=rc["bg"])
-        ax.set_facecolor(rc["bg"])
-        ax.set_position((0.0, 0.0, 1.0, 1.0))
 
-        # Project graph to metric CRS
-        g_proj = ox.project_graph(graph)
+def project_map_data(streets, water_gdf, parks_gdf) -> MapData:
+    """Project the streets and feature layers to the streets' UTM zone.
 
-        # Layer 1: Water polygons (projected to match graph CRS)
-        if water_gdf is not None and len(water_gdf) > 0:
-            try:
-                water_proj = ox.projection.project_gdf(water_gdf)
-            except Exception:
-                water_proj = water_gdf.to_crs(g_proj.graph["crs"])
-            water_proj.plot(ax=ax, facecolor=rc["water"], edgecolor="none", zorder=0.5)
+    `streets` may also be an OSMnx graph (e.g. from a benchmark fixture).
+    """
+    if not isinstance(streets, CompactStreets):
+        streets = compact_streets(streets)
+    streets_proj = streets.project()
+    water_proj = None
+    if water_gdf is not None and len(water_gdf) > 0:
+        water_proj = water_gdf.to_crs(streets_proj.crs)
+    parks_proj = None
+    if parks_gdf is not None and len(parks_gdf) > 0:
+        parks_proj = parks_gdf.to_crs(streets_proj.crs)
+    return streets_proj, water_proj, parks_proj
 
-        # Layer 1b: Park polygons (projected)
-        if parks_gdf is not None and len(parks_gdf) > 0:
-            try:
-                parks_proj = ox.projection.project_gdf(parks_gdf)
-            except Exception:
-                parks_proj = parks_gdf.to_crs(g_proj.graph["crs"])
-            parks_proj.plot(ax=ax, facecolor=rc["parks"], edgecolor="none", zorder=0.8)
-
-        # Layer 2: Roads via ox.plot_graph (projected)
-        edge_colors = _get_edge_colors(g_proj, rc)
-        edge_widths = _get_edge_widths(g_proj)
-
-        crop_xlim, crop_ylim = _get_crop_limits(g_proj, center_point, fig, compensated_dist)
-
-        ox.plot_graph(
-            g_proj,
-            ax=ax,
-            bgcolor=rc["bg"],
-            node_size=0,
-            edge_color=edge_colors,
-            edge_linewidth=edge_widths,
-            show=False,
-            close=False,
+
+def _add_typography(
+    ax: plt.Axes,
+    rc: dict,
+    figsize: Tuple[float, float],
+    city: str,
+    country: str,
+    custom_title: str,
+    lat: float,
+    lng: float,
+) -> None:
+    """Draw the title block and attribution."""
+    fig_w, fig_h = figsize
+    scale_factor = min(fig_w, fig_h) / 12.0
+    text_color = rc["text"]
+    base_main = 60
+    base_sub = 22
+    base_coords = 14
+    base_attr = 8
+
+    font_sub = _make_font(_font_light, base_sub * scale_factor)
+    font_coords = _make_font(_font_regular, base_coords * scale_factor)
+    font_attr = _make_font(_font_light, base_attr * scale_factor)
+
+    # City name formatting
+    display_city = custom_title if custom_title else city
+    if _is_latin(display_city):
+        spaced_city = "  ".join(list(display_city.upper()))
+    else:
+        spaced_city = display_city
+
+    # Dynamic font size for long names
+    adjusted_main = base_main * scale_factor
+    char_count = len(display_city)
+    if char_count > 10:
+        length_factor = 10 / char_count
+        adjusted_main = max(adjusted_main * length_factor, 10 * scale_factor)
+
+    font_main = _make_font(_font_bold, adjusted_main)
+
+    # City name at y=0.14
+    ax.text(0.5, 0.14, spaced_city, transform=ax.transAxes,
+            color=text_color, ha="center", fontproperties=font_main, zorder=11)
+
+    # Separator line
+    ax.plot([0.4, 0.6], [0.125, 0.125], transform=ax.transAxes,
+            color=text_color, linewidth=1 * scale_factor, zorder=11)
+
+    # Country name at y=0.10
+    country_text = country.upper() if country else ""
+    if country_text:
+        ax.text(0.5, 0.10, country_text, transform=ax.transAxes,
+                color=text_color, ha="center", fontproperties=font_sub, zorder=11)
+
+    # Coordinates at y=0.07
+    coords = f"{lat:.4f}° N / {lng:.4f}° E" if lat >= 0 else f"{abs(lat):.4f}° S / {lng:.4f}° E"
+    if lng < 0:
+        coords = coords.replace("E", "W")
+    ax.text(0.5, 0.07, coords, transform=ax.transAxes,
+            color=text_color, alpha=0.7, ha="center", fontproperties=font_coords, zorder=11)
+
+    # Attribution
+    ax.text(0.98, 0.02, "© OpenStreetMap contributors", transform=ax.transAxes,
+            color=text_color, alpha=0.5, ha="right", va="bottom",
+            fontproperties=font_attr, zorder=11)
+
+
+def draw_poster(
+    ax: plt.Axes,
+    streets: CompactStreets,
+    water_proj,
+    parks_proj,
+    center_point: Tuple[float, float],
+    rc: dict,
+    figsize: Tuple[float, float],
+    fetch_dist: int,
+    city: str,
+    country: str,
+    custom_title: str = "",
+    landmarks: Optional[List[dict]] = None,
+    observe: Optional[StageObserver] = None,
+) -> None:
+    """Add every poster layer to `ax`, which must span a poster of `figsize` inches.
+
+    Reports the classification, plotting, gradient and typography stages.
+    """
+    lat, lng = center_point
+    with _timed(observe, "classification"):
+        street_colors, street_widths = _street_style(streets, rc)
+
+    with _timed(observe, "plotting"):
+        # Layer 1: Water polygons
+        draw_polygons(ax, water_proj, rc["water"], zorder=0.5)
+
+        # Layer 1b: Park polygons
+        draw_polygons(ax, parks_proj, rc["parks"], zorder=0.8)
+
+        # Layer 2: Roads, one line per street
+        crop_xlim, crop_ylim = _get_crop_limits(streets.crs, center_point, figsize, fetch_dist)
+        ax.add_collection(
+            LineCollection(streets.segments(), colors=street_colors, linewidths=street_widths, zorder=1),
+            autolim=False,
         )
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.get_xaxis().set_visible(False)
+        ax.get_yaxis().set_visible(False)
 
         ax.set_aspect("equal", adjustable="box")
         ax.set_xlim(crop_xlim)
         ax.set_ylim(crop_ylim)
 
-        # Layer 3: Gradient fades (uses data coordinates, not transAxes)
-        _create_gradient_fade(ax, rc["gradient_color"], location="bottom", zorder=10)
-        _create_gradient_fade(ax, rc["gradient_color"], location="top", zorder=10)
-
-        # Render landmark pins — project lat/lng to the graph's CRS
+        # Render landmark pins — project lat/lng to the streets' CRS
         if landmarks:
             for lm in landmarks:
                 proj_point = ox.projection.project_geometry(
                     Point(lm["lon"], lm["lat"]),
                     crs="EPSG:4326",
-                    to_crs=g_proj.graph["crs"],
+                    to_crs=streets.crs,
                 )[0]
                 ax.plot(
                     proj_point.x, proj_point.y, "o",
@@ -411,72 +576,70 @@ def generate_poster(
                     clip_on=True,
                 )
 
-        # Typography
-        scale_factor = min(fig_w, fig_h) / 12.0
-        text_color = rc["text"]
-        base_main = 60
-        base_sub = 22
-        base_coords = 14
-        base_attr = 8
-
-        font_sub = _make_font(_font_light, base_sub * scale_factor)
-        font_coords = _make_font(_font_regular, base_coords * scale_factor)
-        font_attr = _make_font(_font_light, base_attr * scale_factor)
-
-        # City name formatting
-        display_city = custom_title if custom_title else city
-        if _is_latin(display_city):
-            spaced_city = "  ".join(list(display_city.upper()))
+    # Layer 3: Gradient fades (uses data coordinates, not transAxes)
+    with _timed(observe, "gradient"):
+        _create_gradient_fade(ax, rc["gradient_color"], location="bottom", zorder=10)
+        _create_gradient_fade(ax, rc["gradient_color"], location="top", zorder=10)
+
+    with _timed(observe, "typography"):
+        _add_typography(ax, rc, figsize, city, country, custom_title, lat, lng)
+
+
+def render_poster_image(
+    streets,
+    water_gdf,
+    parks_gdf,
+    center_point: Tuple[float, float],
+    city: str,
+    country: str,
+    theme: str = "default",
+    output_format: str = "instagram",
+    fetch_dist: int = 0,
+    custom_title: str = "",
+    landmarks: Optional[List[dict]] = None,
+    observe: Optional[StageObserver] = None,
+    projected: bool = False,
+) -> np.ndarray:
+    """Render fetched map data to an RGBA pixel array (height x width x 4).
+
+    Pass ``projected=True`` when the layers already come from
+    ``project_map_data``, e.g. to render several themes from one fetch.
+    `observe(stage, seconds)` is called for each render stage: projection,
+    classification, plotting, gradient, typography and savefig.
+    """
+    rc = get_render_colors(theme)
+    preset = RESOLUTION_PRESETS.get(output_format, RESOLUTION_PRESETS["instagram"])
+    figsize = preset["figsize"]
+    try:
+        fig, ax = plt.subplots(figsize=figsize, facecolor=rc["bg"])
+        ax.set_facecolor(rc["bg"])
+        ax.set_position((0.0, 0.0, 1.0, 1.0))
+
+        if projected:
+            streets_proj, water_proj, parks_proj = streets, water_gdf, parks_gdf
         else:
-            spaced_city = display_city
-
-        # Dynamic font size for long names
-        adjusted_main = base_main * scale_factor
-        char_count = len(display_city)
-        if char_count > 10:
-            length_factor = 10 / char_count
-            adjusted_main = max(adjusted_main * length_factor, 10 * scale_factor)
-
-        font_main = _make_font(_font_bold, adjusted_main)
-
-        # City name at y=0.14
-        ax.text(0.5, 0.14, spaced_city, transform=ax.transAxes,
-                color=text_color, ha="center", fontproperties=font_main, zorder=11)
-
-        # Separator line
-        ax.plot([0.4, 0.6], [0.125, 0.125], transform=ax.transAxes,
-                color=text_color, linewidth=1 * scale_factor, zorder=11)
-
-        # Country name at y=0.10
-        country_text = country.upper() if country else ""
-        if country_text:
-            ax.text(0.5, 0.10, country_text, transform=ax.transAxes,
-                    color=text_color, ha="center", fontproperties=font_sub, zorder=11)
-
-        # Coordinates at y=0.07
-        coords = f"{lat:.4f}° N / {lng:.4f}° E" if lat >= 0 else f"{abs(lat):.4f}° S / {lng:.4f}° E"
-        if lng < 0:
-            coords = coords.replace("E", "W")
-        ax.text(0.5, 0.07, coords, transform=ax.transAxes,
-                color=text_color, alpha=0.7, ha="center", fontproperties=font_coords, zorder=11)
-
-        # Attribution
-        ax.text(0.98, 0.02, "© OpenStreetMap contributors", transform=ax.transAxes,
-                color=text_color, alpha=0.5, ha="right", va="bottom",
-                fontproperties=font_attr, zorder=11)
-
-        # Save to file
-        safe_city = re.sub(r"[^a-zA-Z0-9_-]", "_", city.lower().strip())[:80]
-        filename = f"{safe_city}_{theme}_{uuid.uuid4().hex[:8]}.png"
-        output_path = OUTPUT_DIR / filename
-        fig.savefig(
-            str(output_path),
-            dpi=preset["dpi"],
-            facecolor=rc["bg"],
-            bbox_inches="tight",
-            pad_inches=0.05,
+            with _timed(observe, "projection"):
+                streets_proj, water_proj, parks_proj = project_map_data(streets, water_gdf, parks_gdf)
+
+        draw_poster(
+            ax, streets_proj, water_proj, parks_proj, center_point, rc, figsize, fetch_dist,
+            city, country, custom_title, landmarks, observe,
         )
-        plt.close(fig)
+
+        with _timed(observe, "savefig"):
+            # Draw into the Agg buffer only; callers encode from the pixels
+            # rather than having matplotlib write a PNG that is then read back
+            with open(os.devnull, "wb") as sink:
+                fig.savefig(
+                    sink,
+                    format="rgba",
+                    dpi=preset["dpi"],
+                    facecolor=rc["bg"],
+                    bbox_inches="tight",
+                    pad_inches=0.05,
+                )
+            rgba = np.asarray(fig.canvas.buffer_rgba())
+            plt.close(fig)
     except ValueError:
         raise
     except MemoryError:
@@ -484,7 +647,189 @@ def generate_poster(
     except Exception as e:
         logger.exception("Rendering failed: %s", e)
         raise ValueError("Poster rendering failed — please try again")
+    return rgba
+
+
+def render_poster(
+    streets,
+    water_gdf,
+    parks_gdf,
+    center_point: Tuple[float, float],
+    output_path: Path,
+    city: str,
+    country: str,
+    theme: str = "default",
+    output_format: str = "instagram",
+    fetch_dist: int = 0,
+    custom_title: str = "",
+    landmarks: Optional[List[dict]] = None,
+    observe: Optional[StageObserver] = None,
+    projected: bool = False,
+    keep_in_memory: bool = False,
+) -> str:
+    """Render fetched map data to a PNG poster (plus WebP previews) at output_path.
+
+    With ``keep_in_memory`` the files go to the result store, which writes
+    them to output_path later. Reports the stages of ``render_poster_image``
+    and then encode to `observe`. Tiled print formats are rendered by
+    ``render_tiled_poster`` instead (reported as the tiles stage), and their
+    PNG is always written straight to disk.
+    """
+    preset = RESOLUTION_PRESETS.get(output_format, RESOLUTION_PRESETS["instagram"])
+    if preset.get("tiled"):
+        from app.engine.tiled import render_tiled_poster
+
+        layers = (streets, water_gdf, parks_gdf)
+        if not projected:
+            with _timed(observe, "projection"):
+                layers = project_map_data(*layers)
+        with _timed(observe, "tiles"):
+            previews = render_tiled_poster(
+                layers,
+                center_point,
+                output_path,
+                city=city,
+                country=country,
+                theme=theme,
+                output_format=output_format,
+                fetch_dist=fetch_dist,
+                custom_title=custom_title,
+                landmarks=landmarks,
+            )
+        _store_poster_files(output_path, previews, keep_in_memory)
+        return str(output_path)
+
+    rgba = render_poster_image(
+        streets,
+        water_gdf,
+        parks_gdf,
+        center_point,
+        city=city,
+        country=country,
+        theme=theme,
+        output_format=output_format,
+        fetch_dist=fetch_dist,
+        custom_title=custom_title,
+        landmarks=landmarks,
+        observe=observe,
+        projected=projected,
+    )
+    with _timed(observe, "encode"):
+        encoded = encode_poster_image(rgba, preset["dpi"])
+        _store_poster_files(output_path, encoded, keep_in_memory)
+    return str(output_path)
+
+
+def _store_poster_files(output_path: Path, encoded: Dict[int, bytes], keep_in_memory: bool) -> None:
+    try:
+        for path, data in poster_files(output_path, encoded):
+            if keep_in_memory:
+                result_store.put(path, data)
+            else:
+                path.write_bytes(data)
+    except OSError as e:
+        logger.exception("Writing poster failed: %s", e)
+        raise ValueError("Poster rendering failed — please try again")
+
+
+def generate_poster(
+    city: str,
+    country: str,
+    theme: str = "default",
+    distance: int = 3000,
+    output_format: str = "instagram",
+    custom_title: str = "",
+    landmarks: Optional[List[dict]] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    offset_east_m: float = 0.0,
+    offset_north_m: float = 0.0,
+) -> str:
+    """Generate a styled city map poster and return the path to the PNG file.
+
+    With explicit ``lat``/``lon`` the city is not geocoded; city and country
+    are then only used for the poster's labels.
+    """
+    def _set_stage(stage: str) -> None:
+        if on_stage:
+            on_stage(stage)
+        logger.info("Stage: %s", stage)
+
+    metric_labels = {"output_format": output_format, "distance_bucket": distance_bucket(distance)}
+
+    def _observe(stage: str, seconds: float) -> None:
+        STAGE_SECONDS.observe(seconds, stage=stage, **metric_labels)
+
+    if distance > 30000:
+        logger.warning("Large distance requested (%d m) for %s — may be slow or fail", distance, city)
+
+    query = f"{city}, {country}" if country else city
+    if lat is not None and lon is not None:
+        lng = lon
+        logger.info("Using given coordinates for %s: (%f, %f)", query, lat, lng)
+    else:
+        # Geocode the location (with the shared persistent cache for repeat cities)
+        _set_stage("geocoding")
+        t0 = time.monotonic()
+        lat, lng = geocode_city(city, country)
+        _observe("geocoding", time.monotonic() - t0)
+        logger.info("Geocoding took %.2fs", time.monotonic() - t0)
+
+    if offset_east_m or offset_north_m:
+        lat, lng = offset_point(lat, lng, offset_east_m, offset_north_m)
+        logger.info("Center shifted by (%.0f m E, %.0f m N) to (%f, %f)", offset_east_m, offset_north_m, lat, lng)
+
+    center_point = (lat, lng)
+    compensated_dist = fetch_distance(distance, output_format)
+    extent = fetch_extent(distance, output_format)
+
+    cache_warmer.record(city, country, center_point, extent)
+    layers = map_data_cache.get(center_point, extent)
+    if layers is not None:
+        CACHE_REQUESTS.inc(cache="data", result="hit")
+        logger.info("Map data cache hit for %s (extent=%dx%d)", query, *extent)
+    else:
+        CACHE_REQUESTS.inc(cache="data", result="miss")
+        logger.info(
+            "Fetching street network for %s (dist=%d, extent=%dx%d, format=%s)",
+            query, min(distance, 35000), *extent, output_format,
+        )
+        _set_stage("fetching_streets")
+        t1 = time.monotonic()
+        streets, water_gdf, parks_gdf = fetch_map_data(center_point, extent, observe=_observe)
+        _observe("fetch", time.monotonic() - t1)
+        logger.info("All fetches took %.2fs", time.monotonic() - t1)
+        with _timed(_observe, "projection"):
+            layers = project_map_data(streets, water_gdf, parks_gdf)
+        # Writing the file is left to a background thread
+        map_data_cache.put(center_point, extent, layers, wait=False)
+
+    # Render poster
+    _set_stage("rendering")
+    t2 = time.monotonic()
+    safe_city = re.sub(r"[^a-zA-Z0-9_-]", "_", city.lower().strip())[:80]
+    filename = f"{safe_city}_{theme}_{uuid.uuid4().hex[:8]}.png"
+    streets_proj, water_proj, parks_proj = layers
+    output_path = render_poster(
+        streets_proj,
+        water_proj,
+        parks_proj,
+        center_point,
+        OUTPUT_DIR / filename,
+        city=city,
+        country=country,
+        theme=theme,
+        output_format=output_format,
+        fetch_dist=compensated_dist,
+        custom_title=custom_title,
+        landmarks=landmarks,
+        observe=_observe,
+        projected=True,
+        keep_in_memory=True,
+    )
+    _observe("rendering", time.monotonic() - t2)
     logger.info("Rendering took %.2fs", time.monotonic() - t2)
 
     logger.info("Poster saved to %s", output_path)
-    return str(output_path)
+    return output_path
@@ -0,0 +1,68 @@
+"""Bulk drawing of the polygon layers (water, parks).
+
+``GeoDataFrame.plot`` builds one matplotlib patch per polygon and walks every
+MultiPolygon part in Python. Here a whole layer's rings are extracted with
+shapely's vectorized functions into one coordinate array and drawn as a
+single compound path, so the cost is dominated by numpy and Agg.
+"""
+
+import os
+from typing import Optional
+
+import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+
+# Union each layer before drawing. Only matters where one polygon covers a
+# hole of another (the hole would otherwise stay empty); costs a union per render.
+MERGE_POLYGONS = os.environ.get("MERGE_POLYGONS", "0") == "1"
+
+
+def polygon_path(geometries, merge: bool = False) -> Optional[Path]:
+    """One compound path with every ring of the given (Multi)Polygons, or None if empty.
+
+    Exteriors are oriented counter-clockwise and holes clockwise, so Agg's
+    nonzero fill keeps holes open while overlapping polygons simply add up.
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    geoms = geoms[~shapely.is_missing(geoms)]
+    geoms = geoms[~shapely.is_empty(geoms)]
+    if merge and len(geoms):
+        geoms = np.array([shapely.union_all(shapely.make_valid(geoms))], dtype=object)
+    parts = shapely.get_parts(geoms)
+    parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+    if not len(parts):
+        return None
+    rings = shapely.get_rings(shapely.orient_polygons(parts))
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+    # Rings are stored closed (last point repeats the first): that point closes the path
+    new_ring = np.empty(len(ring_index), dtype=bool)
+    new_ring[0] = True
+    np.not_equal(ring_index[1:], ring_index[:-1], out=new_ring[1:])
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    codes[new_ring] = Path.MOVETO
+    codes[np.roll(new_ring, -1)] = Path.CLOSEPOLY
+    return Path(coords, codes)
+
+
+def draw_polygons(ax: plt.Axes, gdf, color: str, zorder: float, merge: bool = MERGE_POLYGONS) -> None:
+    """Fill a GeoDataFrame's polygons on `ax` as a single path.
+
+    `gdf` may also be a path already built by polygon_path.
+    """
+    if isinstance(gdf, Path):
+        path = gdf
+    elif gdf is None or gdf.empty:
+        return
+    else:
+        path = polygon_path(gdf.geometry, merge=merge)
+    if path is None:
+        return
+    # Not add_patch: updating the data limits walks a coded path segment by
+    # segment in Python, and the poster sets its limits explicitly anyway
+    ax.add_collection(
+        PathCollection([path], facecolors=color, edgecolors="none", linewidths=0, zorder=zorder),
+        autolim=False,
+    )
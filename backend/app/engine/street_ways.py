@@ -0,0 +1,107 @@
+"""Topology-free street fetch for rendering.
+
+A poster only draws street lines, so instead of building an OSMnx graph
+(nodes, edges, simplification, truncation) this asks Overpass for the
+matching ways with their coordinates inline (``out geom``) and parses the
+XML response as it streams in, straight into ``CompactStreets``. Each OSM
+way becomes one street; no graph is ever built.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Tuple
+
+import numpy as np
+import osmnx as ox
+import requests
+
+from app.engine.streets import CompactStreets, from_coords, road_class
+
+logger = logging.getLogger(__name__)
+
+# The ways OSMnx fetches for network_type="all"
+_HIGHWAY_FILTER = (
+    '["highway"]["area"!~"yes"]'
+    '["highway"!~"abandoned|construction|no|planned|platform|proposed|raceway|razed"]'
+)
+# Coordinates are output for this much more than the bbox on every side, so
+# ways crossing its edge keep the segment that crosses it
+_OUTPUT_MARGIN = 0.05
+
+
+def street_ways_query(bbox: Tuple[float, float, float, float], timeout: int) -> str:
+    """Overpass QL for the street ways in a (left, bottom, right, top) bbox."""
+    left, bottom, right, top = bbox
+    pad_x = (right - left) * _OUTPUT_MARGIN
+    pad_y = (top - bottom) * _OUTPUT_MARGIN
+    return (
+        f"[out:xml][timeout:{timeout}];"
+        f"way{_HIGHWAY_FILTER}({bottom:.6f},{left:.6f},{top:.6f},{right:.6f});"
+        f"out geom({bottom - pad_y:.6f},{left - pad_x:.6f},{top + pad_y:.6f},{right + pad_x:.6f}) qt;"
+    )
+
+
+def parse_street_ways(stream) -> CompactStreets:
+    """Read an Overpass XML response of ways with geometry into CompactStreets.
+
+    Nodes outside the output bbox come without coordinates; a way is split
+    into one street per run of consecutive nodes that have them. Raises
+    ValueError for an Overpass runtime error or an empty result.
+    """
+    xs, ys = array("d"), array("d")
+    offsets = array("q", [0])
+    classes = array("B")
+    root = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "way":
+            highway = next((t.get("v") for t in elem.iter("tag") if t.get("k") == "highway"), "unclassified")
+            count = 0
+            for nd in [*elem.iter("nd"), None]:
+                lat = nd.get("lat") if nd is not None else None
+                if lat is not None:
+                    xs.append(float(nd.get("lon")))
+                    ys.append(float(lat))
+                    count += 1
+                    continue
+                # A node without coordinates, or the end of the way, closes the run
+                if count >= 2:
+                    offsets.append(len(xs))
+                    classes.append(road_class(highway))
+                elif count:
+                    del xs[-1], ys[-1]
+                count = 0
+            # Parsed ways are not needed again: keep the tree from growing
+            root.clear()
+        elif elem.tag == "remark" and "error" in (elem.text or ""):
+            raise ValueError(f"Overpass error: {elem.text.strip()}")
+    if len(classes) == 0:
+        raise ValueError("Found no streets in the requested area")
+    xy = np.column_stack((np.frombuffer(xs), np.frombuffer(ys)))
+    return from_coords(
+        "EPSG:4326", xy, np.frombuffer(offsets, dtype=np.int64).copy(), np.frombuffer(classes, dtype=np.uint8).copy()
+    )
+
+
+def fetch_street_ways(bbox: Tuple[float, float, float, float]) -> CompactStreets:
+    """Fetch the streets in a bbox from the current ``ox.settings.overpass_url``.
+
+    Raises requests.RequestException on HTTP errors (including a 504 from a
+    busy mirror) and ValueError as parse_street_ways does.
+    """
+    url = f"{ox.settings.overpass_url.rstrip('/')}/interpreter"
+    query = street_ways_query(bbox, ox.settings.timeout)
+    headers = {"User-Agent": ox.settings.http_user_agent, "Referer": ox.settings.http_referer}
+    with requests.post(
+        url, data={"data": query}, headers=headers, timeout=ox.settings.timeout, stream=True,
+        **ox.settings.requests_kwargs,
+    ) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        streets = parse_street_ways(response.raw)
+    logger.info("Fetched %d street ways (%d points) from %s", len(streets), len(streets.coords), url)
+    return streets
@@ -0,0 +1,150 @@
+"""Compact, array-backed street network.
+
+A poster only needs each street's line coordinates and road class, while the
+OSMnx MultiDiGraph carries attribute dicts for every node and edge plus a
+shapely geometry per edge. Streets are fetched straight into this form (see
+street_ways), or a fetched graph is converted right away and dropped;
+projection, the map data cache and the renderer all work on
+``CompactStreets``:
+
+- ``coords``: float32 (x, y) points relative to a float64 ``origin`` (float32
+  alone would round UTM coordinates to a metre),
+- ``offsets``: CSR offsets, street ``i`` being ``coords[offsets[i]:offsets[i + 1]]``,
+- ``road_class``: uint8 index into ``ROAD_CLASSES`` per street.
+"""
+
+from dataclasses import dataclass
+from typing import Any, List, Tuple
+
+import numpy as np
+import shapely
+
+# Drawn in theme colors "road_<class>"
+ROAD_CLASSES = ("motorway", "primary", "secondary", "tertiary", "residential", "default")
+# Line width in points per road class
+ROAD_WIDTHS = np.array([1.2, 1.0, 0.8, 0.6, 0.4, 0.4])
+
+_HIGHWAY_CLASS = {
+    "motorway": 0, "motorway_link": 0,
+    "trunk": 1, "trunk_link": 1, "primary": 1, "primary_link": 1,
+    "secondary": 2, "secondary_link": 2,
+    "tertiary": 3, "tertiary_link": 3,
+    "residential": 4, "living_street": 4, "unclassified": 4,
+}
+_DEFAULT_CLASS = ROAD_CLASSES.index("default")
+
+
+def road_class(highway: Any) -> int:
+    """Road class index for an OSM highway tag (OSMnx gives a list for merged ways)."""
+    if isinstance(highway, list):
+        highway = highway[0] if highway else "unclassified"
+    return _HIGHWAY_CLASS.get(highway, _DEFAULT_CLASS)
+
+
+@dataclass
+class CompactStreets:
+    crs: Any
+    origin: Tuple[float, float]
+    coords: np.ndarray
+    offsets: np.ndarray
+    road_class: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.road_class)
+
+    @property
+    def nbytes(self) -> int:
+        return self.coords.nbytes + self.offsets.nbytes + self.road_class.nbytes
+
+    def absolute_coords(self) -> np.ndarray:
+        if self.coords.dtype == np.float64 and self.origin == (0.0, 0.0):
+            # Already absolute (the tile renderer maps them so): no copy
+            return self.coords
+        return self.coords.astype(np.float64) + self.origin
+
+    def segments(self) -> List[np.ndarray]:
+        """One (n, 2) float64 array per street, as LineCollection takes them."""
+        return np.split(self.absolute_coords(), self.offsets[1:-1])
+
+    def project(self, to_crs: Any = None) -> "CompactStreets":
+        """The same streets in `to_crs`, by default the UTM zone OSMnx would pick."""
+        import geopandas as gpd
+        from pyproj import Transformer
+
+        xy = self.absolute_coords()
+        if to_crs is None:
+            if len(xy):
+                corners = shapely.points(np.array([xy.min(axis=0), xy.max(axis=0)]))
+            else:
+                corners = shapely.points([self.origin])
+            to_crs = gpd.GeoSeries(corners, crs=self.crs).estimate_utm_crs()
+        transformer = Transformer.from_crs(self.crs, to_crs, always_xy=True)
+        x, y = transformer.transform(xy[:, 0], xy[:, 1])
+        return from_coords(to_crs, np.column_stack((x, y)), self.offsets, self.road_class)
+
+
+def from_coords(crs: Any, xy: np.ndarray, offsets: np.ndarray, classes: np.ndarray) -> CompactStreets:
+    """CompactStreets from absolute float64 (x, y) points in `crs`."""
+    origin = tuple(float(v) for v in (xy.min(axis=0) + xy.max(axis=0)) / 2) if len(xy) else (0.0, 0.0)
+    return CompactStreets(
+        crs=crs,
+        origin=origin,
+        coords=(xy - origin).astype(np.float32),
+        offsets=offsets,
+        road_class=classes,
+    )
+
+
+def _edge_identity(u: Any, v: Any, data: dict) -> tuple:
+    """Key shared by an edge and its reverse-direction twin.
+
+    OSMnx adds two-way streets in both directions, with the same way id and
+    length and the geometry reversed.
+    """
+    osmid = data.get("osmid")
+    if isinstance(osmid, list):
+        osmid = tuple(osmid)
+    return (u, v) if u <= v else (v, u), osmid, data.get("length")
+
+
+def compact_streets(graph) -> CompactStreets:
+    """Convert an OSMnx graph, in its own CRS, keeping edge order for drawing.
+
+    Each two-way street is kept once, in the direction first seen.
+    """
+    node_x = dict(graph.nodes(data="x"))
+    node_y = dict(graph.nodes(data="y"))
+    seen = set()
+    edges = []
+    for u, v, data in graph.edges(data=True):
+        identity = _edge_identity(u, v, data)
+        if identity not in seen:
+            seen.add(identity)
+            edges.append((u, v, data))
+
+    count = len(edges)
+    geometries = np.empty(count, dtype=object)
+    ends = np.empty((count, 4))
+    classes = np.empty(count, dtype=np.uint8)
+    for i, (u, v, data) in enumerate(edges):
+        geometries[i] = data.get("geometry")
+        ends[i] = node_x[u], node_y[u], node_x[v], node_y[v]
+        classes[i] = road_class(data.get("highway", "unclassified"))
+
+    # Edges without a geometry are straight lines between their nodes
+    has_geometry = ~shapely.is_missing(geometries)
+    geom_xy, geom_index = shapely.get_coordinates(geometries[has_geometry], return_index=True)
+    counts = np.full(count, 2, dtype=np.int64)
+    counts[has_geometry] = np.bincount(geom_index, minlength=int(has_geometry.sum()))
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    xy = np.empty((offsets[-1], 2))
+    starts = offsets[:-1]
+    geom_starts = starts[has_geometry]
+    first_point = np.concatenate(([0], np.cumsum(counts[has_geometry])[:-1])) if len(geom_starts) else geom_starts
+    xy[geom_starts[geom_index] + np.arange(len(geom_xy)) - first_point[geom_index]] = geom_xy
+    straight = starts[~has_geometry]
+    xy[straight] = ends[~has_geometry, :2]
+    xy[straight + 1] = ends[~has_geometry, 2:]
+    return from_coords(graph.graph["crs"], xy, offsets, classes)
@@ -0,0 +1,334 @@
+"""Tiled rendering for print formats too large to draw as one figure.
+
+The poster is cut into ``TILE_SIZE`` pixel tiles, drawn by one process pool
+shared by every job. A worker builds a job's artists once on a tile-sized
+figure and draws one tile at a time by moving the axes under that small
+canvas. The pixels go into an RGB canvas memory-mapped from a temporary
+file, and the parent encodes each finished row of tiles into the PNG while
+later rows still render. Peak memory therefore depends on the tile size and
+worker count, not on the poster size.
+
+The street and polygon coordinates reach the workers as ``.npy`` files
+written once per job and memory-mapped, so all workers share one copy of
+them through the page cache instead of each unpickling its own.
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.engine.config import RESOLUTION_PRESETS
+from app.engine.derivatives import DERIVATIVE_WIDTHS, encode_derivatives
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 2048  # px
+# Each tile is drawn with this margin and cropped: Agg clips paths to the
+# canvas before simplifying them, which alters shapes close to its edges
+_TILE_BLEED = 32  # px
+TILE_WORKERS = int(os.environ.get("TILE_WORKERS", str(os.cpu_count() or 1)))
+_PNG_BAND_ROWS = 256  # rows filtered and compressed at a time
+_IDAT_BYTES = 1024 * 1024  # compressed bytes per IDAT chunk
+
+
+def poster_pixels(output_format: str) -> Tuple[int, int]:
+    """(width, height) in pixels of a poster in the given format."""
+    preset = RESOLUTION_PRESETS[output_format]
+    fig_w, fig_h = preset["figsize"]
+    return round(fig_w * preset["dpi"]), round(fig_h * preset["dpi"])
+
+
+def _canvas_rows(path: Path, width: int, y0: int, rows: int, writable: bool = False) -> np.memmap:
+    """Rows of the on-disk RGB canvas, mapped only for as long as they are used.
+
+    Mapped pages count as resident memory, so nothing maps the whole canvas.
+    """
+    return np.memmap(
+        path, dtype=np.uint8, mode="r+" if writable else "r", offset=y0 * width * 3, shape=(rows, width, 3)
+    )
+
+
+class PngStream:
+    """Write an 8-bit RGB PNG row band by row band.
+
+    Rows use the "Up" filter, which numpy computes for a whole band at once,
+    and compressed data is emitted in IDAT chunks as it accumulates.
+    """
+
+    def __init__(self, f: BinaryIO, width: int, height: int, dpi: int) -> None:
+        self._f = f
+        self._compressor = zlib.compressobj(6)
+        self._pending = bytearray()
+        self._previous = np.zeros(width * 3, dtype=np.uint8)
+        f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        ppm = int(dpi / 0.0254 + 0.5)
+        self._chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+
+    def _chunk(self, tag: bytes, data: bytes) -> None:
+        self._f.write(struct.pack(">I", len(data)) + tag)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _emit(self, compressed: bytes, final: bool = False) -> None:
+        self._pending += compressed
+        while len(self._pending) >= _IDAT_BYTES or (final and self._pending):
+            self._chunk(b"IDAT", bytes(self._pending[:_IDAT_BYTES]))
+            del self._pending[:_IDAT_BYTES]
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Append a (rows, width, 3) uint8 band below the rows written so far."""
+        for start in range(0, len(rows), _PNG_BAND_ROWS):
+            band = rows[start:start + _PNG_BAND_ROWS].reshape(-1, self._previous.size)
+            filtered = np.empty((len(band), band.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 0] = 2  # Up
+            # uint8 arithmetic wraps modulo 256, as the filter requires
+            np.subtract(band[0], self._previous, out=filtered[0, 1:])
+            np.subtract(band[1:], band[:-1], out=filtered[1:, 1:])
+            self._previous = band[-1].copy()
+            self._emit(self._compressor.compress(filtered))
+
+    def close(self) -> None:
+        self._emit(self._compressor.flush(), final=True)
+        self._chunk(b"IEND", b"")
+
+
+def _write_layers(job_dir: Path, layers, center_point: Tuple[float, float], options: dict) -> None:
+    """Store projected map data for the workers: arrays as .npy, the rest pickled."""
+    from app.engine.polygons import MERGE_POLYGONS, polygon_path
+
+    streets, water_proj, parks_proj = layers
+    np.save(job_dir / "street_xy.npy", streets.absolute_coords())
+    np.save(job_dir / "street_offsets.npy", streets.offsets)
+    np.save(job_dir / "street_class.npy", streets.road_class)
+    for name, gdf in (("water", water_proj), ("parks", parks_proj)):
+        path = None if gdf is None or gdf.empty else polygon_path(gdf.geometry, merge=MERGE_POLYGONS)
+        if path is not None:
+            np.save(job_dir / f"{name}_vertices.npy", path.vertices)
+            np.save(job_dir / f"{name}_codes.npy", path.codes)
+    with open(job_dir / "job.pickle", "wb") as f:
+        pickle.dump((streets.crs, center_point, options), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_layers(job_dir: Path):
+    """The layers stored by _write_layers, with every array memory-mapped."""
+    from matplotlib.path import Path as MplPath
+
+    from app.engine.streets import CompactStreets
+
+    def load(name: str) -> np.ndarray:
+        return np.load(job_dir / f"{name}.npy", mmap_mode="r")
+
+    with open(job_dir / "job.pickle", "rb") as f:
+        crs, center_point, options = pickle.load(f)
+    # Absolute float64 coordinates, so drawing slices them without copying
+    streets = CompactStreets(crs, (0.0, 0.0), load("street_xy"), load("street_offsets"), load("street_class"))
+    polygons = [
+        MplPath(load(f"{name}_vertices"), load(f"{name}_codes"))
+        if (job_dir / f"{name}_vertices.npy").exists() else None
+        for name in ("water", "parks")
+    ]
+    return (streets, *polygons), center_point, options
+
+
+def _warm_worker() -> None:
+    # Import the engine when the pool starts rather than on a job's first tile
+    import app.engine.generator  # noqa: F401
+
+
+# Per worker process: the figure of the job it last drew a tile for. A
+# worker switches jobs rarely, as each job's tiles are queued together; the
+# last job's figure (and its mapped files) are kept until the next one.
+_worker: dict = {}
+
+
+def _job_figure(job_dir: Path):
+    """The figure and axes for a job, built on the first of its tiles in this worker."""
+    if _worker.get("job_dir") == job_dir:
+        return _worker["fig"], _worker["ax"]
+
+    import matplotlib.pyplot as plt
+
+    from app.engine.generator import draw_poster
+    from app.models.themes import get_render_colors
+
+    if "fig" in _worker:
+        plt.close(_worker.pop("fig"))
+    _worker.clear()
+    (streets, water, parks), center_point, options = _load_layers(job_dir)
+    preset = RESOLUTION_PRESETS[options["output_format"]]
+    dpi = preset["dpi"]
+    rc = get_render_colors(options["theme"])
+
+    # Half a pixel of slack: Agg truncates the canvas size to whole pixels
+    size = (TILE_SIZE + 2 * _TILE_BLEED + 0.5) / dpi
+    fig = plt.figure(figsize=(size, size), dpi=dpi, facecolor=rc["bg"])
+    ax = fig.add_axes((0.0, 0.0, 1.0, 1.0))
+    ax.set_facecolor(rc["bg"])
+    draw_poster(
+        ax, streets, water, parks, center_point, rc, preset["figsize"], options["fetch_dist"],
+        options["city"], options["country"], options["custom_title"], options["landmarks"],
+    )
+    # The crop limits already have the poster's aspect ratio
+    ax.set_aspect("auto")
+    # Images are resampled over their whole clip box: limit the gradient
+    # fades to the tile canvas instead of the poster-sized axes
+    for image in ax.images:
+        image.set_clip_box(fig.bbox)
+    _worker.update(job_dir=job_dir, fig=fig, ax=ax)
+    return fig, ax
+
+
+def _render_tile(job_dir: Path, width: int, height: int, x0: int, y0: int) -> None:
+    """Draw the tile whose top-left pixel is (x0, y0) into the job's canvas."""
+    fig, ax = _job_figure(job_dir)
+    fig_w, fig_h = fig.bbox.size
+    # Place the poster-sized axes so that pixel (x0, y0) lands just inside the
+    # bleed margin; Agg flips y against the (fractional) figure height.
+    ax.set_position((
+        (_TILE_BLEED - x0) / fig_w,
+        (fig_h - _TILE_BLEED + y0 - height) / fig_h,
+        width / fig_w,
+        height / fig_h,
+    ))
+    fig.canvas.draw()
+    rgba = np.asarray(fig.canvas.buffer_rgba())
+    w, h = min(TILE_SIZE, width - x0), min(TILE_SIZE, height - y0)
+    band = _canvas_rows(job_dir / "canvas.rgb", width, y0, h, writable=True)
+    band[:, x0:x0 + w] = rgba[_TILE_BLEED:_TILE_BLEED + h, _TILE_BLEED:_TILE_BLEED + w, :3]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _tile_pool() -> ProcessPoolExecutor:
+    """The worker pool shared by all jobs, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the server process runs other threads
+            _pool = ProcessPoolExecutor(
+                max_workers=TILE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next job starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_tile_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _preview_source(canvas_path: Path, width: int, height: int):
+    """The canvas box-reduced band by band to just over the largest preview width."""
+    from PIL import Image
+
+    factor = max(1, (width - 1) // max(DERIVATIVE_WIDTHS))
+    band = factor * 64
+    parts = [
+        np.asarray(Image.fromarray(np.array(_canvas_rows(canvas_path, width, y, min(band, height - y)))).reduce(factor))
+        for y in range(0, height, band)
+    ]
+    return Image.fromarray(np.concatenate(parts))
+
+
+def render_tiled_poster(
+    layers,
+    center_point: Tuple[float, float],
+    output_path: Path,
+    city: str,
+    country: str,
+    theme: str,
+    output_format: str,
+    fetch_dist: int,
+    custom_title: str = "",
+    landmarks: Optional[List[dict]] = None,
+) -> Dict[int, bytes]:
+    """Render projected map data tile by tile, writing the PNG straight to output_path.
+
+    Returns the encoded WebP previews by width, as encode_poster_image does
+    (without the PNG, which is already on disk).
+    """
+    preset = RESOLUTION_PRESETS[output_format]
+    width, height = poster_pixels(output_format)
+    options = {
+        "theme": theme, "output_format": output_format, "fetch_dist": fetch_dist, "city": city,
+        "country": country, "custom_title": custom_title, "landmarks": landmarks,
+    }
+    tmp_png = output_path.with_name(f".{output_path.name}.tmp")
+    try:
+        with tempfile.TemporaryDirectory(prefix="poster-tiles-") as work_dir:
+            job_dir = Path(work_dir)
+            canvas_path = job_dir / "canvas.rgb"
+            _write_layers(job_dir, layers, center_point, options)
+            with open(canvas_path, "wb") as f:
+                f.truncate(height * width * 3)
+
+            rows = range(0, height, TILE_SIZE)
+            columns = range(0, width, TILE_SIZE)
+            logger.info(
+                "Rendering %dx%d poster as %d tiles on %d shared workers",
+                width, height, len(rows) * len(columns), TILE_WORKERS,
+            )
+            pool = _tile_pool()
+            pending: List[List[Future]] = []
+            try:
+                pending = [
+                    [pool.submit(_render_tile, job_dir, width, height, x0, y0) for x0 in columns] for y0 in rows
+                ]
+                with open(tmp_png, "wb") as f:
+                    png = PngStream(f, width, height, preset["dpi"])
+                    for y0, row in zip(rows, pending):
+                        for future in row:
+                            future.result()
+                        png.write_rows(_canvas_rows(canvas_path, width, y0, min(TILE_SIZE, height - y0)))
+                    png.close()
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                raise
+            finally:
+                # Other jobs share the pool: only drop this job's remaining tiles
+                for row in pending:
+                    for future in row:
+                        future.cancel()
+            tmp_png.replace(output_path)
+
+            try:
+                encoded = encode_derivatives(_preview_source(canvas_path, width, height))
+            except (OSError, ValueError) as e:
+                # Previews are an optimization; the PNG alone is a complete result
+                logger.warning("Could not encode previews: %s", e)
+                encoded = {}
+    except MemoryError:
+        tmp_png.unlink(missing_ok=True)
+        raise ValueError("Area too large — try a smaller distance")
+    except Exception as e:
+        tmp_png.unlink(missing_ok=True)
+        logger.exception("Tiled rendering failed: %s", e)
+        raise ValueError("Poster rendering failed — please try again")
+    return encoded
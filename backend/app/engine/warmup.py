@@ -0,0 +1,43 @@
+"""Load the render engine in the background after startup.
+
+Importing osmnx, geopandas, shapely and matplotlib takes seconds, so the
+API starts without them and answers /api/health straight away. This thread
+imports the engine and draws a throwaway figure with the poster fonts;
+/api/ready reports 503 until it has finished. A job that arrives earlier
+simply waits for the import.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _warm() -> None:
+    start = time.monotonic()
+    try:
+        from app.engine import generator
+
+        generator.warm_up()
+    except Exception:
+        # Stay not-ready: the same error would fail every job
+        logger.exception("Engine warmup failed")
+        return
+    _ready.set()
+    logger.info("Engine ready in %.1fs", time.monotonic() - start)
+
+
+def start_warmup() -> None:
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_warm, name="engine-warmup", daemon=True)
+        _thread.start()
+
+
+def engine_ready() -> bool:
+    return _ready.is_set()
@@ -1,23 +1,52 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
+from app.engine.warmup import start_warmup
+from app.routes.api import generation_idle
 from app.routes.api import router as api_router
+from app.routes.gallery import router as gallery_router
+from app.routes.geocode import nominatim
 from app.routes.geocode import router as geocode_router
+from app.routes.metrics import router as metrics_router
+from app.services.cache_warmer import cache_warmer
+from app.services.email_queue import email_queue
+from app.services.gazetteer import gazetteer
+from app.services.result_store import result_store
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_warmup()
+    gazetteer.open()
+    email_queue.start()
+    cache_warmer.start(is_idle=generation_idle)
+    yield
+    await nominatim.aclose()
+    cache_warmer.stop()
+    email_queue.stop()
+    from app.engine.tiled import shutdown_tile_pool
+
+    shutdown_tile_pool()
+    result_store.spill_all()
+    gazetteer.close()
+
+
 app = FastAPI(
     title="Cartographix API",
     description="Generate beautiful city map posters",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -29,7 +58,9 @@ app.add_middleware(
 
 # Mount API routes
 app.include_router(api_router)
+app.include_router(gallery_router)
 app.include_router(geocode_router)
+app.include_router(metrics_router)
 
 # Mount frontend static files (after API routes so API takes priority)
 frontend_dist = Path(__file__).resolve().parent.parent.parent / "frontend" / "dist"
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, EmailStr, Field, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
 
 
 class LandmarkItem(BaseModel):
@@ -17,6 +17,13 @@ class GenerateRequest(BaseModel):
     output_format: str = Field(default="instagram")
     custom_title: str = Field(default="", max_length=100)
     landmarks: List[LandmarkItem] = Field(default_factory=list, max_length=5)
+    profile: bool = False  # admin-only: capture a sampling profile of the job
+    # Map center; when given, geocoding is skipped and city/country only label the poster
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    # Shift of the map center in meters (east/north), applied after geocoding
+    offset_east_m: float = Field(default=0, ge=-20000, le=20000)
+    offset_north_m: float = Field(default=0, ge=-20000, le=20000)
 
     @field_validator("email", mode="before")
     @classmethod
@@ -25,6 +32,12 @@ class GenerateRequest(BaseModel):
             return None
         return v
 
+    @model_validator(mode="after")
+    def lat_lon_together(self) -> "GenerateRequest":
+        if (self.lat is None) != (self.lon is None):
+            raise ValueError("lat and lon must be given together")
+        return self
+
 
 class GenerateResponse(BaseModel):
     job_id: str
@@ -41,6 +54,18 @@ class StatusResponse(BaseModel):
     stage: Optional[str] = None
     error_message: Optional[str] = None
     share_id: Optional[str] = None
+    email_status: Optional[str] = None
+    version: int = 1
+    profile_url: Optional[str] = None
+
+
+class StatusBatchRequest(BaseModel):
+    job_ids: List[str] = Field(..., min_length=1, max_length=100)
+
+
+class StatusBatchResponse(BaseModel):
+    jobs: List[StatusResponse]
+    missing: List[str] = Field(default_factory=list)
 
 
 class ShareRequest(BaseModel):
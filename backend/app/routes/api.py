@@ -2,27 +2,42 @@ import asyncio
 import logging
 import os
 import re
+import secrets
 import threading
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from fastapi.responses import FileResponse
 
-from app.engine.generator import generate_poster, OUTPUT_DIR
+from app.engine.config import FETCH_THREAD_PREFIX, OUTPUT_DIR
+from app.engine.derivatives import DERIVATIVE_WIDTHS, poster_variant
+from app.engine.warmup import engine_ready
 from app.models.schemas import (
     ErrorResponse,
     GenerateRequest,
     GenerateResponse,
     HealthResponse,
+    StatusBatchRequest,
+    StatusBatchResponse,
     StatusResponse,
     ThemeItem,
     ThemesResponse,
 )
 from app.models.themes import THEMES
-from app.services.email import send_poster_email
-from app.services.job_store import job_store
+from app.services.email_queue import email_queue
+from app.services.http_cache import etag_matches
+from app.services.job_store import Job, job_store
+from app.services.metrics import (
+    GENERATION_SLOTS,
+    GENERATION_SLOTS_IN_USE,
+    JOBS_QUEUED,
+    JOBS_TOTAL,
+)
+from app.services.profiler import SamplingProfiler
 from app.services.rate_limiter import rate_limiter, ip_rate_limiter
+from app.services.result_store import result_store
+from app.services.signed_urls import verify_download
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +45,22 @@ router = APIRouter(prefix="/api")
 
 MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "3"))
 GENERATION_TIMEOUT = int(os.environ.get("GENERATION_TIMEOUT", "600"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+MAX_STATUS_WAIT = 30  # seconds a long-polling status request may be held open
+POSTER_MAX_AGE = 2 * 3600  # seconds; completed jobs are kept for 2 hours
 _generation_semaphore = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+GENERATION_SLOTS.set(MAX_CONCURRENT_JOBS)
+
+ALLOWED_OUTPUT_FORMATS = [
+    "instagram", "mobile_wallpaper", "hd_wallpaper", "4k_wallpaper", "a4_print", "a2_print", "a1_print", "a0_print",
+]
+
+def generate_poster(**kwargs):
+    """Run the poster engine, importing it on first use (it is slow to import)."""
+    from app.engine.generator import generate_poster as _generate_poster
+
+    return _generate_poster(**kwargs)
 
-ALLOWED_OUTPUT_FORMATS = ["instagram", "mobile_wallpaper", "hd_wallpaper", "4k_wallpaper", "a4_print"]
 
 def _safe_filename(city: str, theme: str) -> str:
     """Sanitize user input for use in Content-Disposition filename."""
@@ -40,16 +68,43 @@ def _safe_filename(city: str, theme: str) -> str:
     return f"{safe_city}_{theme}_poster.png"
 
 
+def _is_admin(request: Request) -> bool:
+    """Check the X-Admin-Token header against ADMIN_TOKEN (disabled when unset)."""
+    token = request.headers.get("x-admin-token", "")
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
 def _process_job(job_id: str) -> None:
-    """Background task to generate a poster and optionally send email."""
+    """Background task to generate a poster, profiling it if requested."""
     job = job_store.get(job_id)
     if not job:
         return
+    if not job.profile:
+        _run_job(job)
+        return
+
+    ident = threading.get_ident()
+    profiler = SamplingProfiler(ident, thread_name_prefix=f"{FETCH_THREAD_PREFIX}-{ident}_")
+    profiler.start()
+    try:
+        _run_job(job)
+    finally:
+        profiler.stop()
+        try:
+            profile_path = profiler.write_collapsed(OUTPUT_DIR / f"{job.job_id}_profile.txt")
+            job.update(profile_path=str(profile_path))
+        except OSError as e:
+            logger.error("Could not write profile for job %s: %s", job.job_id, e)
+
+
+def _run_job(job: Job) -> None:
+    """Generate a poster and optionally send email."""
+    job_id = job.job_id
 
     def _update_stage(stage: str) -> None:
-        job.stage = stage
+        job.update(stage=stage)
 
-    job.status = "processing"
+    job.update(status="processing")
     try:
         result_path = generate_poster(
             city=job.city,
@@ -59,13 +114,18 @@ def _process_job(job_id: str) -> None:
             output_format=job.output_format,
             custom_title=job.custom_title,
             landmarks=job.landmarks,
+            lat=job.lat,
+            lon=job.lon,
+            offset_east_m=job.offset_east_m,
+            offset_north_m=job.offset_north_m,
             on_stage=_update_stage,
         )
-        job.result_path = result_path
+        job.update(result_path=result_path)
 
         if job.email:
-            _update_stage("sending_email")
-            send_poster_email(
+            # Delivered by the email queue's own workers; the render slot is freed now
+            queued = email_queue.enqueue(
+                job.job_id,
                 job.email,
                 job.city,
                 result_path,
@@ -74,22 +134,34 @@ def _process_job(job_id: str) -> None:
                 custom_title=job.custom_title,
                 output_format=job.output_format,
                 landmarks=job.landmarks,
+                expires_at=job.expires_at,
             )
+            job.update(email_status="queued" if queued else "failed")
 
-        _update_stage("done")
-        job.status = "completed"
+        job.update(stage="done", status="completed")
+        JOBS_TOTAL.inc(status="completed")
         logger.info("Job %s completed: %s", job_id, result_path)
 
     except Exception as e:
-        job.status = "failed"
-        job.error = str(e)
+        job.update(status="failed", error=str(e))
+        JOBS_TOTAL.inc(status="failed")
         logger.error("Job %s failed: %s", job_id, e)
 
 
+def generation_idle() -> bool:
+    """True when no job is generating or waiting for a slot (used by the cache warmer)."""
+    return GENERATION_SLOTS_IN_USE.value() == 0 and JOBS_QUEUED.value() == 0
+
+
 def _run_with_semaphore(job_id: str, semaphore: asyncio.Semaphore, loop: asyncio.AbstractEventLoop) -> None:
     """Acquire semaphore, run job with timeout, release."""
+    JOBS_QUEUED.inc()
     future = asyncio.run_coroutine_threadsafe(semaphore.acquire(), loop)
-    future.result()  # block until slot available
+    try:
+        future.result()  # block until slot available
+    finally:
+        JOBS_QUEUED.dec()
+    GENERATION_SLOTS_IN_USE.inc()
     try:
         worker = threading.Thread(target=_process_job, args=(job_id,), daemon=True)
         worker.start()
@@ -97,10 +169,14 @@ def _run_with_semaphore(job_id: str, semaphore: asyncio.Semaphore, loop: asyncio
         if worker.is_alive():
             job = job_store.get(job_id)
             if job and job.status == "processing":
-                job.status = "failed"
-                job.error = f"Generation timed out after {GENERATION_TIMEOUT} seconds"
+                job.update(
+                    status="failed",
+                    error=f"Generation timed out after {GENERATION_TIMEOUT} seconds",
+                )
+                JOBS_TOTAL.inc(status="timed_out")
                 logger.error("Job %s timed out after %ds", job_id, GENERATION_TIMEOUT)
     finally:
+        GENERATION_SLOTS_IN_USE.dec()
         loop.call_soon_threadsafe(semaphore.release)
 
 
@@ -110,12 +186,18 @@ def _run_with_semaphore(job_id: str, semaphore: asyncio.Semaphore, loop: asyncio
     responses={422: {"model": ErrorResponse}, 429: {"model": ErrorResponse}},
 )
 async def generate(req: GenerateRequest, request: Request) -> GenerateResponse:
+    if req.profile and not _is_admin(request):
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "forbidden", "detail": "Profiling requires a valid admin token"},
+        )
+
     # Rate limit by IP
     client_ip = (
         request.headers.get("x-forwarded-for", "").split(",")[0].strip()
         or (request.client.host if request.client else "unknown")
     )
-    if not ip_rate_limiter.is_allowed(client_ip):
+    if not await ip_rate_limiter.check(client_ip):
         raise HTTPException(
             status_code=429,
             detail={"error": "rate_limited", "detail": "Too many requests. Please try again later."},
@@ -136,7 +218,7 @@ async def generate(req: GenerateRequest, request: Request) -> GenerateResponse:
         )
 
     # Rate limit by email
-    if req.email and not rate_limiter.is_allowed(req.email):
+    if req.email and not await rate_limiter.check(req.email):
         raise HTTPException(
             status_code=429,
             detail={"error": "rate_limited", "detail": "Maximum 3 requests per email per 24 hours"},
@@ -161,6 +243,11 @@ async def generate(req: GenerateRequest, request: Request) -> GenerateResponse:
             output_format=req.output_format,
             custom_title=req.custom_title,
             landmarks=landmarks_dicts,
+            profile=req.profile,
+            lat=req.lat,
+            lon=req.lon,
+            offset_east_m=req.offset_east_m,
+            offset_north_m=req.offset_north_m,
         )
     except RuntimeError:
         raise HTTPException(
@@ -185,18 +272,7 @@ async def generate(req: GenerateRequest, request: Request) -> GenerateResponse:
     )
 
 
-@router.get(
-    "/status/{job_id}",
-    response_model=StatusResponse,
-    responses={404: {"model": ErrorResponse}},
-)
-async def get_status(job_id: str) -> StatusResponse:
-    job = job_store.get(job_id)
-    if not job:
-        raise HTTPException(
-            status_code=404,
-            detail={"error": "not_found", "detail": f"Job {job_id} not found"},
-        )
+def _status_response(job: Job) -> StatusResponse:
     poster_url = f"/api/poster/{job.job_id}" if job.status == "completed" and job.result_path else None
     return StatusResponse(
         job_id=job.job_id,
@@ -207,12 +283,84 @@ async def get_status(job_id: str) -> StatusResponse:
         stage=job.stage,
         error_message=job.error,
         share_id=job.share_id,
+        email_status=job.email_status,
+        version=job.version,
+        profile_url=f"/api/poster/{job.job_id}/profile" if job.profile_path else None,
     )
 
 
+@router.get(
+    "/status/{job_id}",
+    response_model=StatusResponse,
+    responses={304: {"description": "Job unchanged"}, 404: {"model": ErrorResponse}},
+)
+async def get_status(
+    job_id: str,
+    request: Request,
+    response: Response,
+    wait: float = Query(default=0, ge=0, le=MAX_STATUS_WAIT),
+    since: int | None = Query(default=None, ge=0),
+) -> StatusResponse | Response:
+    """Return job status.
+
+    Responses carry an ETag derived from the job's version. A matching
+    If-None-Match (or `since` equal to the current version) yields 304; with
+    `wait > 0` the request is held until the version changes or the wait expires.
+    """
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": "not_found", "detail": f"Job {job_id} not found"},
+        )
+
+    if_none_match = request.headers.get("if-none-match", "")
+
+    def _unchanged(j: Job) -> bool:
+        if since is not None:
+            return j.version == since
+        return bool(if_none_match) and etag_matches(if_none_match, j.etag)
+
+    if wait and _unchanged(job) and job.status not in ("completed", "failed"):
+        job = await job_store.wait_for_change(job_id, job.version, wait)
+        if not job:
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "not_found", "detail": f"Job {job_id} not found"},
+            )
+
+    headers = {"ETag": job.etag, "Cache-Control": "no-cache"}
+    if _unchanged(job):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return _status_response(job)
+
+
+@router.post("/status/batch", response_model=StatusBatchResponse)
+async def get_status_batch(req: StatusBatchRequest) -> StatusBatchResponse:
+    """Return status for many jobs in one call; unknown ids are listed in `missing`."""
+    jobs: List[StatusResponse] = []
+    missing: List[str] = []
+    for job_id in dict.fromkeys(req.job_ids):
+        job = job_store.get(job_id)
+        if job:
+            jobs.append(_status_response(job))
+        else:
+            missing.append(job_id)
+    return StatusBatchResponse(jobs=jobs, missing=missing)
+
+
 @router.get("/poster/{job_id}")
-async def get_poster(job_id: str) -> FileResponse:
-    """Serve the generated poster PNG for a completed job."""
+async def get_poster(
+    job_id: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="Preview width in pixels (WebP)"),
+) -> Response:
+    """Serve the generated poster PNG for a completed job, or a WebP preview with ?w=."""
+    if w is not None and w not in DERIVATIVE_WIDTHS:
+        raise HTTPException(
+            status_code=400, detail=f"w must be one of {', '.join(map(str, DERIVATIVE_WIDTHS))}"
+        )
     job = job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
@@ -221,12 +369,59 @@ async def get_poster(job_id: str) -> FileResponse:
     file_path = Path(job.result_path)
     if not file_path.resolve().is_relative_to(OUTPUT_DIR):
         raise HTTPException(status_code=403, detail="Access denied")
-    if not file_path.exists():
+    file_path, media_type = poster_variant(file_path, w)
+    filename = _safe_filename(job.city, job.theme)
+    if media_type != "image/png":
+        filename = filename.replace(".png", f"_{w}.webp")
+    # Finished posters never change; cache for as long as the job is kept
+    response = await result_store.response(
+        request,
+        file_path,
+        media_type=media_type,
+        filename=filename,
+        cache_control=f"public, max-age={POSTER_MAX_AGE}, immutable",
+        content_disposition_type="attachment" if w is None else "inline",
+    )
+    if response is None:
         raise HTTPException(status_code=404, detail="Poster file not found")
+    return response
+
+
+@router.get("/download/{name}")
+async def download_poster(
+    name: str, request: Request, expires: int = Query(...), sig: str = Query(...)
+) -> Response:
+    """Serve a poster file through an expiring signed link (used by large-poster emails)."""
+    if not re.fullmatch(r"[A-Za-z0-9_-]+\.png", name) or not verify_download(name, expires, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    stem = name.rsplit("_", 1)[0]
+    response = await result_store.response(
+        request,
+        OUTPUT_DIR / name,
+        media_type="image/png",
+        filename=f"{stem}_poster.png",
+        cache_control=f"private, max-age={POSTER_MAX_AGE}",
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Poster file not found")
+    return response
+
+
+@router.get("/poster/{job_id}/profile")
+async def get_profile(job_id: str, request: Request) -> FileResponse:
+    """Serve the collapsed-stack profile captured for a job (admin only)."""
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Access denied")
+    job = job_store.get(job_id)
+    if not job or not job.profile_path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    file_path = Path(job.profile_path)
+    if not file_path.resolve().is_relative_to(OUTPUT_DIR) or not file_path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
     return FileResponse(
         path=str(file_path),
-        media_type="image/png",
-        filename=_safe_filename(job.city, job.theme),
+        media_type="text/plain",
+        filename=f"{job.job_id}_profile.txt",
     )
 
 
@@ -247,3 +442,12 @@ async def get_themes() -> ThemesResponse:
 @router.get("/health", response_model=HealthResponse)
 async def health() -> HealthResponse:
     return HealthResponse(status="ok", version="1.0.0")
+
+
+@router.get("/ready", response_model=HealthResponse, responses={503: {"model": HealthResponse}})
+async def ready(response: Response) -> HealthResponse:
+    """Readiness: 200 once the render engine is loaded, 503 while it is still warming up."""
+    if not engine_ready():
+        response.status_code = 503
+        return HealthResponse(status="starting", version="1.0.0")
+    return HealthResponse(status="ok", version="1.0.0")
@@ -1,18 +1,22 @@
 import re
 from pathlib import Path
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 
-from app.engine.generator import OUTPUT_DIR
+from app.engine.derivatives import DERIVATIVE_WIDTHS, poster_variant
+from app.engine.config import OUTPUT_DIR
 from app.models.schemas import (
     ShareRequest,
     ShareResponse,
 )
 from app.services.job_store import job_store
+from app.services.result_store import result_store
 
 router = APIRouter(prefix="/api")
 
+SHARE_MAX_AGE = 365 * 86400  # share ids always point at the same image
+
 
 def _safe_filename(city: str, theme: str) -> str:
     """Sanitize user input for use in Content-Disposition filename."""
@@ -40,8 +44,16 @@ async def share_poster(job_id: str, req: ShareRequest) -> ShareResponse:
 
 
 @router.get("/share/{share_id}")
-async def get_shared_poster(share_id: str) -> FileResponse:
-    """Get shared poster image by share_id."""
+async def get_shared_poster(
+    share_id: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="Preview width in pixels (WebP)"),
+) -> Response:
+    """Get shared poster image by share_id, or a WebP preview with ?w=."""
+    if w is not None and w not in DERIVATIVE_WIDTHS:
+        raise HTTPException(
+            status_code=400, detail=f"w must be one of {', '.join(map(str, DERIVATIVE_WIDTHS))}"
+        )
     job = job_store.get_by_share_id(share_id)
     if not job or not job.result_path:
         raise HTTPException(status_code=404, detail="Shared poster not found")
@@ -49,11 +61,19 @@ async def get_shared_poster(share_id: str) -> FileResponse:
     file_path = Path(job.result_path)
     if not file_path.resolve().is_relative_to(OUTPUT_DIR):
         raise HTTPException(status_code=403, detail="Access denied")
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Poster file not found")
 
-    return FileResponse(
-        path=str(file_path),
-        media_type="image/png",
-        filename=_safe_filename(job.city, job.theme),
+    file_path, media_type = poster_variant(file_path, w)
+    filename = _safe_filename(job.city, job.theme)
+    if media_type != "image/png":
+        filename = filename.replace(".png", f"_{w}.webp")
+    response = await result_store.response(
+        request,
+        file_path,
+        media_type=media_type,
+        filename=filename,
+        cache_control=f"public, max-age={SHARE_MAX_AGE}, immutable",
+        content_disposition_type="attachment" if w is None else "inline",
     )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Poster file not found")
+    return response
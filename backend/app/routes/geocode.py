@@ -1,19 +1,25 @@
-import time
+import os
 from typing import List
 
 import httpx
-from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 
+from app.services.gazetteer import gazetteer
+from app.services.geocode_cache import SETTLEMENT_TYPES, geocode_cache
+from app.services.metrics import CACHE_REQUESTS
+from app.services.nominatim import NominatimClient
 from app.services.rate_limiter import geocode_rate_limiter
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(prefix="/api")
 
-_last_request_time: float = 0.0
-
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
 USER_AGENT = "Cartographix/1.0"
 
+# Shared by every request; enforces Nominatim's 1 request/second policy
+nominatim = NominatimClient(NOMINATIM_URL, USER_AGENT)
+
 
 class GeocodeSuggestion(BaseModel):
     display_name: str
@@ -24,39 +30,49 @@ class GeocodeSuggestion(BaseModel):
 
 
 @router.get("/geocode", response_model=List[GeocodeSuggestion])
-async def geocode(request: Request, q: str = Query(..., min_length=2)) -> List[GeocodeSuggestion]:
-    global _last_request_time
-
+async def geocode(
+    request: Request, response: Response, q: str = Query(..., min_length=2)
+) -> List[GeocodeSuggestion]:
     client_ip = (
         request.headers.get("x-forwarded-for", "").split(",")[0].strip()
         or (request.client.host if request.client else "unknown")
     )
-    if not geocode_rate_limiter.is_allowed(client_ip):
+    if not await geocode_rate_limiter.check(client_ip):
         raise HTTPException(status_code=429, detail="Too many requests. Please try again later.")
 
-    # Rate limit: max 1 request/second to Nominatim
-    now = time.monotonic()
-    elapsed = now - _last_request_time
-    if elapsed < 1.0:
-        import asyncio
-        await asyncio.sleep(1.0 - elapsed)
-
-    _last_request_time = time.monotonic()
+    local = gazetteer.suggest(q)
+    if local is not None:
+        CACHE_REQUESTS.inc(cache="gazetteer", result="hit")
+        return [GeocodeSuggestion(**p) for p in local]
+    CACHE_REQUESTS.inc(cache="gazetteer", result="miss")
+
+    # SQLite reads and writes may wait on disk or a lock: keep them off the event loop
+    cached = await run_in_threadpool(geocode_cache.suggest, q)
+    if cached is not None:
+        CACHE_REQUESTS.inc(cache="geocode_suggest", result="hit")
+        return [
+            GeocodeSuggestion(
+                display_name=p["display_name"], city=p["city"], country=p["country"], lat=p["lat"], lon=p["lon"]
+            )
+            for p in cached
+        ]
+    CACHE_REQUESTS.inc(cache="geocode_suggest", result="miss")
 
+    # Key on IP and user agent so users behind one NAT rarely supersede each other
+    client_key = f"{client_ip}|{request.headers.get('user-agent', '')}"
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get(
-                NOMINATIM_URL,
-                params={"q": q, "format": "json", "limit": 5, "addressdetails": 1, "accept-language": "en"},
-                headers={"User-Agent": USER_AGENT, "Accept-Language": "en"},
-            )
-            resp.raise_for_status()
-    except httpx.HTTPError:
+        items = await nominatim.search(q, client_key)
+    except (httpx.HTTPError, ValueError):
         raise HTTPException(status_code=502, detail="Geocoding service unavailable")
+    if items is None:
+        # The client has already typed a longer query; its answer supersedes this one
+        response.headers["X-Superseded"] = "1"
+        return []
 
     results: List[GeocodeSuggestion] = []
+    settlements: List[bool] = []
     seen: set[str] = set()
-    for item in resp.json():
+    for item in items:
         addr = item.get("address", {})
         city = (
             addr.get("city")
@@ -82,5 +98,9 @@ async def geocode(request: Request, q: str = Query(..., min_length=2)) -> List[G
                 lon=float(item.get("lon", 0)),
             )
         )
+        # A POI or suburb result carries its own point, not the city's
+        settlements.append(item.get("addresstype") in SETTLEMENT_TYPES)
 
+    places = [{**r.model_dump(), "settlement": s} for r, s in zip(results, settlements)]
+    await run_in_threadpool(geocode_cache.store_suggestions, q, places)
     return results
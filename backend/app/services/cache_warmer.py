@@ -0,0 +1,219 @@
+"""Background prefetching of map data for popular requests.
+
+Every generation records its (center, fetch extent) in a small SQLite table
+with an exponentially decaying score. While no poster is being generated,
+a warmer thread takes the top ``CACHE_WARM_TOP_N`` entries and fetches any
+whose map data is missing or older than ``CACHE_WARM_REFRESH`` into the map
+data cache, so those requests skip the fetch stage. A user job that arrives
+meanwhile waits for at most the one Overpass request in flight: the rest of
+the prefetch is dropped.
+
+Prefetches are limited to ``CACHE_WARM_BUDGET`` Overpass requests per hour,
+shared by all worker processes. ``CACHE_WARM_TOP_N=0`` disables the warmer.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from app.services.geocode_cache import CACHE_DIR
+from app.services.map_data_cache import data_key, map_data_cache
+from app.services.metrics import CACHE_WARM_FETCHES
+from app.services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_DB = Path(os.environ.get("POPULARITY_DB", CACHE_DIR / "popularity.sqlite3"))
+CACHE_WARM_TOP_N = int(os.environ.get("CACHE_WARM_TOP_N", "30"))
+CACHE_WARM_BUDGET = int(os.environ.get("CACHE_WARM_BUDGET", "30"))  # Overpass requests per hour
+CACHE_WARM_REFRESH = int(os.environ.get("CACHE_WARM_REFRESH", str(24 * 3600)))  # seconds
+CACHE_WARM_INTERVAL = 30.0  # seconds between idle checks
+HALF_LIFE = 3 * 86400  # seconds for a request's weight to halve
+MIN_SCORE = 2.0  # a single request is not worth prefetching
+MAX_TRACKED = 1000
+_REQUESTS_PER_FETCH = 3  # streets, water, parks
+
+# (key, city, country, lat, lon, (half_width, half_height), score)
+PopularEntry = Tuple[str, str, str, float, float, Tuple[int, int], float]
+
+
+def _decayed(score: float, updated_at: float, now: float) -> float:
+    return score * 0.5 ** (max(0.0, now - updated_at) / HALF_LIFE)
+
+
+class Popularity:
+    """Decaying request counts per (center, fetch extent), shared across processes."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Tables from before rectangular fetches count requests per radius;
+            # their scores cannot be mapped to extents and simply start over
+            if "dist" in {row[1] for row in conn.execute("PRAGMA table_info(popularity)")}:
+                conn.execute("DROP TABLE popularity")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS popularity (
+                    key TEXT PRIMARY KEY,
+                    city TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    half_width INTEGER NOT NULL,
+                    half_height INTEGER NOT NULL,
+                    score REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def record(self, city: str, country: str, center: Tuple[float, float], extent: Tuple[int, int]) -> None:
+        key = data_key(center, extent)
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = db.execute("SELECT score, updated_at FROM popularity WHERE key = ?", (key,)).fetchone()
+                    score = (_decayed(*row, now) if row else 0.0) + 1.0
+                    db.execute(
+                        "INSERT OR REPLACE INTO popularity VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, city, country, center[0], center[1], int(extent[0]), int(extent[1]), score, now),
+                    )
+                    db.execute("COMMIT")
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            logger.warning("Could not record request popularity: %s", e)
+
+    def top(self, n: int) -> List[PopularEntry]:
+        """The `n` highest-scoring entries (by decayed score), trimming the table as it goes."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT key, city, country, lat, lon, half_width, half_height, score, updated_at FROM popularity"
+            ).fetchall()
+            entries = sorted(
+                ((k, c, co, la, lo, (w, h), _decayed(s, u, now)) for k, c, co, la, lo, w, h, s, u in rows),
+                key=lambda e: e[6],
+                reverse=True,
+            )
+            stale = [(e[0],) for e in entries[MAX_TRACKED:]]
+            if stale:
+                db.executemany("DELETE FROM popularity WHERE key = ?", stale)
+        return entries[:n]
+
+
+class CacheWarmer:
+    def __init__(
+        self,
+        popularity: Popularity,
+        top_n: int,
+        budget: int,
+        refresh_after: float,
+        interval: float = CACHE_WARM_INTERVAL,
+    ) -> None:
+        self.popularity = popularity
+        self.top_n = top_n
+        self.refresh_after = refresh_after
+        self.interval = interval
+        self._budget = RateLimiter(
+            "cache_warm", max_requests=max(1, budget // _REQUESTS_PER_FETCH), window_seconds=3600
+        )
+        self._is_idle: Callable[[], bool] = lambda: True
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, city: str, country: str, center: Tuple[float, float], extent: Tuple[int, int]) -> None:
+        if self.top_n > 0:
+            self.popularity.record(city, country, center, extent)
+
+    def _next_stale(self) -> Optional[PopularEntry]:
+        for entry in self.popularity.top(self.top_n):
+            if entry[6] < MIN_SCORE:
+                break
+            age = map_data_cache.age((entry[3], entry[4]), entry[5])
+            if age is None or age > self.refresh_after:
+                return entry
+        return None
+
+    def warm_once(self) -> bool:
+        """Prefetch the most popular missing/stale entry; returns True if one was fetched."""
+        try:
+            entry = self._next_stale()
+        except sqlite3.Error as e:
+            logger.warning("Popularity store unavailable: %s", e)
+            return False
+        if entry is None or not self._budget.is_allowed("overpass"):
+            return False
+
+        from app.engine.generator import FetchCancelled, fetch_map_data, project_map_data
+
+        _, city, country, lat, lon, extent, score = entry
+        start = time.monotonic()
+        try:
+            # Overpass requests give way to user jobs, and the prefetch stops
+            # before its next request once a job is waiting or running
+            layers = project_map_data(
+                *fetch_map_data((lat, lon), extent, yield_to=lambda: self._stopping.is_set() or not self._is_idle())
+            )
+        except FetchCancelled:
+            CACHE_WARM_FETCHES.inc(result="cancelled")
+            logger.info("Prefetch for %s, %s stopped for a user request", city, country)
+            return False
+        except Exception as e:
+            CACHE_WARM_FETCHES.inc(result="failed")
+            logger.warning("Prefetch for %s, %s (%dx%d m) failed: %s", city, country, *extent, e)
+            return False
+        map_data_cache.put((lat, lon), extent, layers)
+        CACHE_WARM_FETCHES.inc(result="fetched")
+        logger.info(
+            "Prefetched map data for %s, %s (%dx%d m, score %.1f) in %.1fs",
+            city, country, *extent, score, time.monotonic() - start,
+        )
+        return True
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            # Keep going while idle so a backlog drains between user requests
+            while self._is_idle() and not self._stopping.is_set() and self.warm_once():
+                pass
+
+    def start(self, is_idle: Callable[[], bool]) -> None:
+        """Start the warmer thread; `is_idle()` gates each prefetch."""
+        if self.top_n <= 0 or self._thread is not None:
+            return
+        self._is_idle = is_idle
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+cache_warmer = CacheWarmer(
+    Popularity(POPULARITY_DB),
+    top_n=CACHE_WARM_TOP_N,
+    budget=CACHE_WARM_BUDGET,
+    refresh_after=CACHE_WARM_REFRESH,
+)
@@ -1,9 +1,16 @@
 import html
+import io
+import json
 import os
 import base64
 import logging
+import time
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
+
+import httpx
+
+from app.services.result_store import result_store
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +31,18 @@ for _p in _TEMPLATE_PATHS:
 if _template_html is None:
     logger.warning("React Email template not found, email will use fallback")
 
+RESEND_API_URL = "https://api.resend.com/emails"
+PUBLIC_URL = os.environ.get("PUBLIC_URL", "https://cartographix.radman.dev").rstrip("/")
+# Posters whose email variant is larger than this are sent as a download link
+EMAIL_ATTACHMENT_MAX_BYTES = int(os.environ.get("EMAIL_ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+DOWNLOAD_LINK_TTL = 2 * 3600  # seconds; only used when the poster's deletion time is unknown
+# A download link is not sent when the poster is deleted sooner than this
+MIN_LINK_LIFETIME = 15 * 60  # seconds
+_B64_CHUNK = 3 * 64 * 1024  # multiple of 3 so base64 chunks concatenate cleanly
+# Larger posters (A1/A0 prints) are not decoded for an attachment; they are
+# far over the attachment limit anyway and go out as a download link
+_MAX_VARIANT_PIXELS = 40_000_000
+
 # Inline styles matching the React Email template's detail rows
 _ROW_LABEL_STYLE = "font-size:13px;color:#a1a1aa;"
 _ROW_VALUE_STYLE = "font-size:13px;color:#18181b;font-weight:500;text-align:right;"
@@ -36,6 +55,9 @@ _FORMAT_LABELS = {
     "hd_wallpaper": "HD Wallpaper (1920\u00d71080)",
     "4k_wallpaper": "4K Wallpaper (3840\u00d72160)",
     "a4_print": "A4 Print (2480\u00d73508)",
+    "a2_print": "A2 Print (4962\u00d77017)",
+    "a1_print": "A1 Print (7017\u00d79933)",
+    "a0_print": "A0 Print (9933\u00d714043)",
 }
 
 
@@ -88,14 +110,22 @@ def _build_email_plain(
     output_format: str = "",
     distance: int = 0,
     landmarks: Optional[List[dict]] = None,
+    download_url: str = "",
+    link_validity: str = "",
 ) -> str:
     """Build a plain-text version of the email for multipart/alternative."""
     theme_display = theme.replace("_", " ").title() if theme else "Default"
+    if download_url:
+        delivery = (
+            f"is ready to download as a high-resolution PNG (the link is valid for {link_validity}):\n"
+            f"{download_url}"
+        )
+    else:
+        delivery = "is attached to this email as a PNG."
     lines = [
         "Your poster is ready",
         "",
-        f"Your custom map poster of {city} has been generated and is attached "
-        "to this email as a high-resolution PNG.",
+        f"Your custom map poster of {city} has been generated and {delivery}",
         "",
         f"City: {city}",
         f"Theme: {theme_display}",
@@ -127,16 +157,32 @@ def _build_email_html(
     output_format: str = "",
     distance: int = 0,
     landmarks: Optional[List[dict]] = None,
+    download_url: str = "",
+    link_validity: str = "",
 ) -> str:
     """Render the email HTML by replacing placeholders in the React Email template."""
     theme_display = theme.replace("_", " ").title() if theme else "Default"
     details_html = _build_details_rows(
         city, theme_display, custom_title, output_format, distance, landmarks
     )
+    if download_url:
+        delivery_html = (
+            f'and is ready to download as a high-resolution PNG: '
+            f'<a href="{html.escape(download_url)}">download your poster</a> '
+            f"(the link is valid for {html.escape(link_validity)})."
+        )
+    else:
+        delivery_html = "and is attached to this email as a PNG."
 
     if _template_html is not None:
+        rendered = _template_html
+        if "{{delivery}}" in rendered:
+            rendered = rendered.replace("{{delivery}}", delivery_html)
+        elif download_url:
+            # Template built before the delivery placeholder existed
+            details_html = f'<p style="font-size:14px;">{delivery_html}</p>' + details_html
         return (
-            _template_html
+            rendered
             .replace("{{city}}", html.escape(city))
             .replace("{{theme}}", html.escape(theme_display))
             .replace("{{details_rows}}", details_html)
@@ -148,13 +194,90 @@ def _build_email_html(
 <html><body style="font-family:sans-serif;padding:40px;background:#f0f0f0;">
 <div style="max-width:500px;margin:0 auto;background:#fff;border-radius:8px;padding:32px;">
 <h1 style="color:#18181b;">Your poster is ready</h1>
-<p>Your map poster of <strong>{safe_city}</strong> ({html.escape(theme_display)} theme) is attached.</p>
+<p>Your map poster of <strong>{safe_city}</strong> ({html.escape(theme_display)} theme) has been generated {delivery_html}</p>
 <hr/>
 <p style="font-size:12px;color:#aaa;">Made by <a href="https://radman.dev">Radman</a></p>
 </div></body></html>"""
 
 
-def send_poster_email(
+class EmailNotConfigured(RuntimeError):
+    """Raised when RESEND_API_KEY is missing, so sending can never succeed."""
+
+
+class EmailRejected(RuntimeError):
+    """Raised when Resend refuses the message itself; retrying will not help."""
+
+
+class PosterExpiring(RuntimeError):
+    """Raised when the poster is deleted too soon for a download link to be useful."""
+
+
+def _link_validity(seconds: float) -> str:
+    """"1 hour and 25 minutes"-style duration, rounded down to the minute."""
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if minutes or not hours:
+        parts.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
+    return " and ".join(parts)
+
+
+def email_variant(png_path: Path) -> Path:
+    """Return a smaller copy of the poster for attaching (palette PNG), kept in the result store.
+
+    Falls back to the original when quantizing does not make it smaller or
+    the poster is too large to decode for attaching.
+    """
+    variant = png_path.with_name(f"{png_path.stem}_email.png")
+    if result_store.exists(variant):
+        return variant
+    from PIL import Image
+
+    with result_store.open(png_path) as f, Image.open(f) as im:
+        if im.width * im.height > _MAX_VARIANT_PIXELS:
+            return png_path
+        quantized = im.convert("RGB").quantize(
+            256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.FLOYDSTEINBERG
+        )
+    buf = io.BytesIO()
+    quantized.save(buf, "PNG", optimize=True)
+    if buf.tell() >= result_store.size(png_path):
+        return png_path
+    result_store.put(variant, buf.getvalue())
+    return variant
+
+
+def _resend_body(message: dict, attachment: Optional[Tuple[str, Path]]) -> Tuple[int, Iterator[bytes]]:
+    """JSON request body for Resend with the attachment base64-encoded on the fly.
+
+    Returns the exact Content-Length and an iterator over the body, so the
+    file is never held in memory in full (neither raw nor encoded).
+    """
+    if attachment is None:
+        body = json.dumps(message).encode("utf-8")
+        return len(body), iter([body])
+
+    filename, path = attachment
+    marker = "\x00attachment-content\x00"
+    text = json.dumps({**message, "attachments": [{"filename": filename, "content": marker}]})
+    prefix, suffix = (part.encode("utf-8") for part in text.split(json.dumps(marker)))
+    prefix += b'"'
+    suffix = b'"' + suffix
+    size = result_store.size(path)
+    length = len(prefix) + 4 * ((size + 2) // 3) + len(suffix)
+
+    def chunks() -> Iterator[bytes]:
+        yield prefix
+        with result_store.open(path) as f:
+            while chunk := f.read(_B64_CHUNK):
+                yield base64.b64encode(chunk)
+        yield suffix
+
+    return length, chunks()
+
+
+def deliver_poster_email(
     to_email: str,
     city: str,
     png_path: str,
@@ -163,51 +286,96 @@ def send_poster_email(
     custom_title: str = "",
     output_format: str = "",
     landmarks: Optional[List[dict]] = None,
-) -> bool:
-    """Send the generated poster PNG as an email attachment via Resend."""
+    expires_at: Optional[float] = None,
+) -> None:
+    """Email the poster via Resend: attached if small enough, otherwise as a signed link.
+
+    A link is valid until `expires_at`, when the poster is deleted. Raises
+    EmailNotConfigured without an API key, EmailRejected when Resend refuses
+    the message, PosterExpiring if the link would be valid for less than
+    MIN_LINK_LIFETIME, OSError if the PNG is gone, and httpx errors on
+    transient delivery failures.
+    """
     api_key = os.environ.get("RESEND_API_KEY")
     if not api_key:
-        logger.warning("RESEND_API_KEY not set, skipping email to %s", to_email)
-        return False
+        raise EmailNotConfigured("RESEND_API_KEY not set")
+
+    from app.services.signed_urls import signed_download_path
+
+    file_path = Path(png_path)
+    variant = email_variant(file_path)
+
+    city_slug = city.lower().replace(" ", "_")
+    theme_slug = theme.lower().replace(" ", "_") if theme else "default"
+    filename = f"{city_slug}_{theme_slug}_poster.png"
+
+    attachment: Optional[Tuple[str, Path]] = None
+    download_url = ""
+    link_validity = ""
+    if result_store.size(variant) <= EMAIL_ATTACHMENT_MAX_BYTES:
+        attachment = (filename, variant)
+    else:
+        ttl = int(expires_at - time.time()) if expires_at is not None else DOWNLOAD_LINK_TTL
+        if ttl < MIN_LINK_LIFETIME:
+            raise PosterExpiring(f"poster is deleted in {max(ttl, 0)}s")
+        download_url = PUBLIC_URL + signed_download_path(file_path.name, ttl)
+        link_validity = _link_validity(ttl)
+
+    message = {
+        "from": "Cartographix By Radman <Cartographix@mail.radman.dev>",
+        "reply_to": "rad@radman.dev",
+        "to": [to_email],
+        "subject": "Your Cartographix map poster is ready",
+        "html": _build_email_html(
+            city, theme, custom_title, output_format, distance, landmarks, download_url, link_validity
+        ),
+        "text": _build_email_plain(
+            city, theme, custom_title, output_format, distance, landmarks, download_url, link_validity
+        ),
+        "headers": {
+            "X-Entity-Ref-ID": filename,
+        },
+    }
+    length, body = _resend_body(message, attachment)
+    resp = httpx.post(
+        RESEND_API_URL,
+        content=body,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Content-Length": str(length),
+        },
+        timeout=60.0,
+    )
+    if 400 <= resp.status_code < 500 and resp.status_code != 429:
+        raise EmailRejected(f"Resend rejected the email ({resp.status_code}): {resp.text[:200]}")
+    resp.raise_for_status()
+    logger.info(
+        "Email sent to %s for city %s (%s, %d bytes)",
+        to_email, city, "attachment" if attachment else "download link", length,
+    )
+
 
+def send_poster_email(
+    to_email: str,
+    city: str,
+    png_path: str,
+    theme: str = "",
+    distance: int = 0,
+    custom_title: str = "",
+    output_format: str = "",
+    landmarks: Optional[List[dict]] = None,
+    expires_at: Optional[float] = None,
+) -> bool:
+    """Send the poster email once; returns False instead of raising on failure."""
     try:
-        import resend
-
-        resend.api_key = api_key
-
-        file_path = Path(png_path)
-        file_content = file_path.read_bytes()
-        encoded_content = base64.b64encode(file_content).decode("utf-8")
-
-        city_slug = city.lower().replace(" ", "_")
-        theme_slug = theme.lower().replace(" ", "_") if theme else "default"
-        filename = f"{city_slug}_{theme_slug}_poster.png"
-
-        resend.Emails.send(
-            {
-                "from": "Cartographix By Radman <Cartographix@mail.radman.dev>",
-                "reply_to": "rad@radman.dev",
-                "to": [to_email],
-                "subject": "Your Cartographix map poster is ready",
-                "html": _build_email_html(
-                    city, theme, custom_title, output_format, distance, landmarks
-                ),
-                "text": _build_email_plain(
-                    city, theme, custom_title, output_format, distance, landmarks
-                ),
-                "headers": {
-                    "X-Entity-Ref-ID": filename,
-                },
-                "attachments": [
-                    {
-                        "filename": filename,
-                        "content": encoded_content,
-                    }
-                ],
-            }
+        deliver_poster_email(
+            to_email, city, png_path, theme, distance, custom_title, output_format, landmarks, expires_at
         )
-        logger.info("Email sent to %s for city %s", to_email, city)
         return True
+    except EmailNotConfigured:
+        logger.warning("RESEND_API_KEY not set, skipping email to %s", to_email)
+        return False
     except Exception as e:
         logger.error("Failed to send email to %s: %s", to_email, e)
         return False
@@ -0,0 +1,238 @@
+"""Persistent outbound queue for poster emails.
+
+Jobs enqueue their email once the PNG is written and release their render
+slot immediately; a small pool of worker threads delivers the queue with
+exponential backoff. The queue is a SQLite table, so pending emails survive
+restarts and several processes can share it (rows are claimed atomically).
+
+Retries stop once an email is older than ``EMAIL_MAX_AGE``, which is kept
+inside the two-hour window before the job store deletes the poster file.
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.services.email import EmailNotConfigured, EmailRejected, PosterExpiring, deliver_poster_email
+from app.services.geocode_cache import CACHE_DIR
+from app.services.job_store import job_store
+from app.services.metrics import EMAILS_TOTAL, STAGE_SECONDS, distance_bucket
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_PATH = Path(os.environ.get("EMAIL_QUEUE_PATH", CACHE_DIR / "email_queue.sqlite3"))
+EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", "2"))
+EMAIL_MAX_AGE = 90 * 60  # seconds; must stay below the job store's 2h retention
+BACKOFF_BASE = 30.0  # seconds before the first retry; x4 per attempt
+BACKOFF_MAX = 20 * 60
+CLAIM_LEASE = 5 * 60  # a row stuck in "sending" this long is retried (crashed worker)
+_POLL_INTERVAL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_email (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbound_email_due ON outbound_email(status, next_attempt_at);
+"""
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 4 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class EmailQueue:
+    def __init__(self, path: Path, workers: int = 2) -> None:
+        self.path = path
+        self.workers = workers
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; SQLite serializes writers across threads and processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def enqueue(
+        self,
+        job_id: str,
+        to_email: str,
+        city: str,
+        png_path: str,
+        theme: str = "",
+        distance: int = 0,
+        custom_title: str = "",
+        output_format: str = "",
+        landmarks: Optional[List[dict]] = None,
+        expires_at: Optional[float] = None,
+    ) -> bool:
+        """Queue a poster email; returns False if the queue could not be written.
+
+        `expires_at` is when the poster will be deleted (Job.expires_at);
+        a download link in the email is valid until then.
+        """
+        payload = {
+            "city": city,
+            "png_path": png_path,
+            "theme": theme,
+            "distance": distance,
+            "custom_title": custom_title,
+            "output_format": output_format,
+            "landmarks": landmarks or [],
+            "expires_at": expires_at,
+        }
+        now = time.time()
+        try:
+            self._db().execute(
+                "INSERT INTO outbound_email (job_id, to_email, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, to_email, json.dumps(payload), now, now),
+            )
+        except sqlite3.Error as e:
+            logger.error("Could not queue email for job %s: %s", job_id, e)
+            return False
+        self._wake.set()
+        return True
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        return self._db().execute(
+            """
+            UPDATE outbound_email SET status = 'sending', claimed_at = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM outbound_email
+                WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND claimed_at < ?)
+                ORDER BY next_attempt_at LIMIT 1
+            )
+            RETURNING *
+            """,
+            (now, now, now - CLAIM_LEASE),
+        ).fetchone()
+
+    def _finish(self, row: sqlite3.Row, status: str, error: str = "", retry_at: float = 0.0) -> None:
+        self._db().execute(
+            "UPDATE outbound_email SET status = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            (status, error[:500], retry_at, row["id"]),
+        )
+        EMAILS_TOTAL.inc(status="retry" if status == "pending" else status)
+        job = job_store.get(row["job_id"])
+        if job:
+            job.update(email_status={"pending": "retrying"}.get(status, status))
+
+    def _deliver(self, row: sqlite3.Row) -> None:
+        payload = json.loads(row["payload"])
+        try:
+            with STAGE_SECONDS.time(
+                stage="email_send",
+                output_format=payload["output_format"],
+                distance_bucket=distance_bucket(payload["distance"]),
+            ):
+                deliver_poster_email(row["to_email"], **payload)
+        except EmailNotConfigured:
+            logger.warning("RESEND_API_KEY not set, skipping email to %s", row["to_email"])
+            self._finish(row, "skipped")
+            return
+        except OSError as e:
+            logger.error("Poster for job %s is gone, dropping email: %s", row["job_id"], e)
+            self._finish(row, "failed", str(e))
+            return
+        except EmailRejected as e:
+            logger.error("Email to %s rejected, not retrying: %s", row["to_email"], e)
+            self._finish(row, "failed", str(e))
+            return
+        except PosterExpiring as e:
+            logger.warning("Not emailing %s a link that would expire too soon: %s", row["to_email"], e)
+            self._finish(row, "failed", str(e))
+            return
+        except Exception as e:
+            retry_at = time.time() + _backoff(row["attempts"])
+            if retry_at - row["created_at"] > EMAIL_MAX_AGE:
+                logger.error("Giving up on email to %s after %d attempts: %s", row["to_email"], row["attempts"], e)
+                self._finish(row, "failed", str(e))
+            else:
+                logger.warning(
+                    "Email to %s failed (attempt %d), retrying in %.0fs: %s",
+                    row["to_email"], row["attempts"], retry_at - time.time(), e,
+                )
+                self._finish(row, "pending", str(e), retry_at)
+            return
+        self._finish(row, "sent")
+
+    def _idle_wait(self) -> float:
+        """Seconds until the next retry is due, capped at the poll interval."""
+        try:
+            due = self._db().execute(
+                "SELECT MIN(next_attempt_at) FROM outbound_email WHERE status = 'pending'"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            due = None
+        if due is None:
+            return _POLL_INTERVAL
+        return min(_POLL_INTERVAL, max(0.05, due - time.time()))
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.warning("Email queue unavailable: %s", e)
+                row = None
+            if row is None:
+                self._wake.wait(self._idle_wait())
+                self._wake.clear()
+                continue
+            try:
+                self._deliver(row)
+            except sqlite3.Error as e:
+                # The claim lease expires and another attempt picks the row up again
+                logger.warning("Could not record email outcome for job %s: %s", row["job_id"], e)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        try:
+            self._db().execute(
+                "DELETE FROM outbound_email WHERE status IN ('sent', 'failed', 'skipped') AND created_at < ?",
+                (time.time() - 86400,),
+            )
+        except sqlite3.Error as e:
+            logger.warning("Could not prune the email queue: %s", e)
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"email-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+email_queue = EmailQueue(EMAIL_QUEUE_PATH, workers=EMAIL_WORKERS)
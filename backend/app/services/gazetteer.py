@@ -0,0 +1,247 @@
+"""Offline world-cities gazetteer for autocomplete.
+
+A compact binary index built from GeoNames by ``scripts/build_gazetteer.py``
+and memory-mapped at startup. Prefix queries are answered locally by binary
+search over a sorted key table, ranked by population, so Nominatim is only
+needed for places the gazetteer does not know.
+
+File layout (little-endian):
+
+- header: magic, version, section counts and offsets
+- places: one fixed-size record per city (lat, lon, population, name, country)
+- countries: display and normalized name per country
+- keys: (key string, place) sorted by key, then by descending population
+- top: for every key prefix up to ``TOP_PREFIX_LEN`` characters, the ``TOP_K`` most
+  populous places, so one- to three-letter queries need no range scan
+- strings: length-prefixed UTF-8 strings referenced by offset
+"""
+
+import heapq
+import logging
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.geocode_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = Path(
+    os.environ.get("GAZETTEER_PATH", Path(__file__).resolve().parents[2] / "data" / "gazetteer.bin")
+)
+
+MAGIC = b"CGZ1"
+VERSION = 1
+TOP_K = 8
+TOP_PREFIX_LEN = 3
+MAX_SCAN = 20_000  # key entries examined for one longer-prefix query
+
+_HEADER = struct.Struct("<4sIIIIIIIIIII")
+_PLACE = struct.Struct("<ffIIH2x")  # lat, lon, population, name offset, country index
+_COUNTRY = struct.Struct("<II")  # display offset, normalized offset
+_KEY = struct.Struct("<II")  # key offset, place index
+_TOP = struct.Struct("<I" + "I" * TOP_K)  # prefix offset, place indexes
+_NO_PLACE = 0xFFFFFFFF
+_STRLEN = struct.Struct("<H")
+
+
+class _Strings:
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self._offsets: Dict[str, int] = {}
+
+    def add(self, text: str) -> int:
+        offset = self._offsets.get(text)
+        if offset is None:
+            raw = text.encode("utf-8")[:0xFFFF]
+            offset = self._offsets[text] = len(self.data)
+            self.data += _STRLEN.pack(len(raw)) + raw
+        return offset
+
+
+def write_index(places: Iterable[Tuple[str, str, float, float, int, Iterable[str]]], path: Path) -> int:
+    """Build the index from (name, country, lat, lon, population, alt_names) rows.
+
+    Returns the number of places written.
+    """
+    strings = _Strings()
+    countries: Dict[str, int] = {}
+    country_rows: List[Tuple[int, int]] = []
+    place_rows: List[bytes] = []
+    populations: List[int] = []
+    keys: List[Tuple[str, int]] = []
+
+    for name, country, lat, lon, population, alt_names in places:
+        if country not in countries:
+            countries[country] = len(country_rows)
+            country_rows.append((strings.add(country), strings.add(normalize(country))))
+        index = len(place_rows)
+        place_rows.append(_PLACE.pack(lat, lon, population, strings.add(name), countries[country]))
+        populations.append(population)
+        for key in {normalize(n) for n in (name, *alt_names)}:
+            if key:
+                keys.append((key, index))
+
+    keys.sort(key=lambda k: (k[0].encode("utf-8"), -populations[k[1]]))
+
+    top: Dict[str, set] = {}
+    for key, index in keys:
+        for n in range(1, min(len(key), TOP_PREFIX_LEN) + 1):
+            top.setdefault(key[:n], set()).add(index)
+    top_rows = []
+    for prefix in sorted(top, key=lambda p: p.encode("utf-8")):
+        best = heapq.nsmallest(TOP_K, top[prefix], key=lambda i: (-populations[i], i))
+        best += [_NO_PLACE] * (TOP_K - len(best))
+        top_rows.append(_TOP.pack(strings.add(prefix), *best))
+
+    sections = [
+        b"".join(place_rows),
+        b"".join(_COUNTRY.pack(*row) for row in country_rows),
+        b"".join(_KEY.pack(strings.add(key), index) for key, index in keys),
+        b"".join(top_rows),
+        bytes(strings.data),
+    ]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(
+            MAGIC, VERSION, len(place_rows), len(country_rows), len(keys), len(top_rows), TOP_K, *offsets
+        ))
+        for section in sections:
+            f.write(section)
+    tmp.replace(path)
+    return len(place_rows)
+
+
+class _KeyView:
+    """Sequence of key bytes over the mmapped key table, for bisect."""
+
+    def __init__(self, gazetteer: "Gazetteer", offset: int, count: int, record: struct.Struct) -> None:
+        self._g = gazetteer
+        self._offset = offset
+        self._count = count
+        self._record = record
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        string_offset = self._record.unpack_from(self._g._mm, self._offset + i * self._record.size)[0]
+        return self._g._raw_string(string_offset)
+
+
+class Gazetteer:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._mm: Optional[mmap.mmap] = None
+        self._tried = False
+
+    def open(self) -> bool:
+        """Map the index file; returns False (once logged) if it is missing or invalid."""
+        if self._mm is not None or self._tried:
+            return self._mm is not None
+        self._tried = True
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            logger.info("No gazetteer at %s; autocomplete will use Nominatim only", self.path)
+            return False
+        header = _HEADER.unpack_from(mm, 0)
+        if header[0] != MAGIC or header[1] != VERSION or header[6] != TOP_K:
+            logger.warning("Ignoring gazetteer %s: unsupported format", self.path)
+            mm.close()
+            return False
+        (_, _, self._n_places, n_countries, self._n_keys, self._n_top, _,
+         self._places_off, countries_off, self._keys_off, self._top_off, self._strings_off) = header
+        self._mm = mm
+        self._keys = _KeyView(self, self._keys_off, self._n_keys, _KEY)
+        self._top = _KeyView(self, self._top_off, self._n_top, _TOP)
+        self._countries = [
+            (self._string(d), self._string(n))
+            for d, n in _COUNTRY.iter_unpack(mm[countries_off:countries_off + n_countries * _COUNTRY.size])
+        ]
+        logger.info("Loaded gazetteer: %d places, %d keys", self._n_places, self._n_keys)
+        return True
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._tried = False
+
+    def _raw_string(self, offset: int) -> bytes:
+        start = self._strings_off + offset
+        (length,) = _STRLEN.unpack_from(self._mm, start)
+        return self._mm[start + 2:start + 2 + length]
+
+    def _string(self, offset: int) -> str:
+        return self._raw_string(offset).decode("utf-8")
+
+    def _place(self, index: int) -> Tuple[float, float, int, int, int]:
+        return _PLACE.unpack_from(self._mm, self._places_off + index * _PLACE.size)
+
+    def _prefix_range(self, view: _KeyView, prefix: bytes) -> Tuple[int, int]:
+        lo = bisect_left(view, prefix)
+        # Every key starting with the prefix sorts below prefix + 0xff (not valid UTF-8)
+        hi = bisect_left(view, prefix + b"\xff", lo)
+        return lo, hi
+
+    def suggest(self, query: str, limit: int = 5) -> Optional[List[Dict]]:
+        """Return up to ``limit`` places whose name starts with the query, most populous first.
+
+        "name, country" narrows by a country-name prefix. Returns None when the
+        gazetteer is unavailable or nothing matches.
+        """
+        if not self.open():
+            return None
+        name, _, country = normalize(query).partition(",")
+        name, country = name.strip(), country.strip()
+        prefix = name.encode("utf-8")
+        if not prefix:
+            return None
+
+        if len(name) <= TOP_PREFIX_LEN and not country:
+            lo, hi = self._prefix_range(self._top, prefix)
+            if lo >= hi or self._top[lo] != prefix:
+                return None
+            indexes = _TOP.unpack_from(self._mm, self._top_off + lo * _TOP.size)[1:]
+            ranked = [i for i in indexes if i != _NO_PLACE][:limit]
+        else:
+            lo, hi = self._prefix_range(self._keys, prefix)
+            candidates: Dict[int, int] = {}
+            for i in range(lo, min(hi, lo + MAX_SCAN)):
+                index = _KEY.unpack_from(self._mm, self._keys_off + i * _KEY.size)[1]
+                if index in candidates:
+                    continue
+                _, _, population, _, country_index = self._place(index)
+                if country and not self._countries[country_index][1].startswith(country):
+                    continue
+                candidates[index] = population
+            ranked = heapq.nlargest(limit, candidates, key=candidates.__getitem__)
+
+        results = []
+        for index in ranked:
+            lat, lon, _, name_offset, country_index = self._place(index)
+            city = self._string(name_offset)
+            country_name = self._countries[country_index][0]
+            results.append({
+                "display_name": f"{city}, {country_name}",
+                "city": city,
+                "country": country_name,
+                "lat": round(lat, 5),
+                "lon": round(lon, 5),
+            })
+        return results or None
+
+
+gazetteer = Gazetteer(GAZETTEER_PATH)
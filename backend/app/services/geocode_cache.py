@@ -0,0 +1,242 @@
+"""Persistent geocode cache shared by autocomplete and poster generation.
+
+Backed by SQLite so it survives restarts and can be shared by several worker
+processes. Two tables:
+
+- ``places``: every place we have learned about (from Nominatim suggestions or
+  forward geocoding), keyed by normalized "city|country" and indexed on the
+  normalized city name. The B-tree index doubles as a prefix index, so once
+  "paris" has been seen, "par" and "pari" are answered locally. Only
+  settlement results (a city, town or village itself, not a POI or suburb
+  whose address is in it) set a place's point for forward geocoding.
+- ``queries``: exact normalized query -> ordered place keys, so a repeated
+  query returns exactly what Nominatim returned the first time.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", Path(__file__).resolve().parents[2] / "cache"))
+GEOCODE_CACHE_PATH = Path(os.environ.get("GEOCODE_CACHE_PATH", CACHE_DIR / "geocode.sqlite3"))
+
+MAX_PLACES = 200_000
+QUERY_TTL = 30 * 86400  # seconds before an exact-query entry is refetched
+_TRIM_EVERY = 500  # inserts between size checks
+
+# Nominatim address types whose coordinates stand for the city itself
+SETTLEMENT_TYPES = frozenset({"city", "town", "village", "municipality"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_key TEXT PRIMARY KEY,
+    name_norm TEXT NOT NULL,
+    country_norm TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    city TEXT NOT NULL,
+    country TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    settlement INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS places_name ON places(name_norm);
+CREATE TABLE IF NOT EXISTS queries (
+    query_norm TEXT PRIMARY KEY,
+    place_keys TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation (keeping commas), collapse spaces."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^\w\s,]", " ", text)
+    text = re.sub(r"\s*,\s*", ", ", text)
+    return re.sub(r"\s+", " ", text).strip(" ,")
+
+
+def _place_key(city: str, country: str) -> str:
+    return f"{normalize(city)}|{normalize(country)}"
+
+
+def _split_query(query_norm: str) -> Tuple[str, str]:
+    """Split "city, country" into its name and country parts."""
+    name, _, rest = query_norm.partition(",")
+    return name.strip(), rest.strip()
+
+
+class GeocodeCache:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inserts = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(places)")}
+            if "settlement" not in columns:
+                # Caches from before the column existed: their points are unvetted
+                conn.execute("ALTER TABLE places ADD COLUMN settlement INTEGER NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    def _places(self, keys: List[str]) -> List[Dict]:
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        rows = self._db().execute(
+            f"SELECT * FROM places WHERE place_key IN ({placeholders})", keys
+        ).fetchall()
+        by_key = {r["place_key"]: r for r in rows}
+        return [dict(by_key[k]) for k in keys if k in by_key]
+
+    def _touch(self, keys: List[str]) -> None:
+        self._db().executemany("UPDATE places SET hits = hits + 1 WHERE place_key = ?", [(k,) for k in keys])
+
+    def _upsert_places(self, places: List[Dict]) -> List[str]:
+        now = time.time()
+        keys = []
+        for p in places:
+            key = _place_key(p["city"], p["country"])
+            keys.append(key)
+            self._db().execute(
+                """
+                INSERT INTO places
+                    (place_key, name_norm, country_norm, display_name, city, country, lat, lon, settlement, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(place_key) DO UPDATE SET
+                    display_name = excluded.display_name, lat = excluded.lat, lon = excluded.lon,
+                    settlement = excluded.settlement, updated_at = excluded.updated_at
+                WHERE excluded.settlement >= places.settlement
+                """,
+                (key, normalize(p["city"]), normalize(p["country"]), p.get("display_name") or p["city"],
+                 p["city"], p["country"], float(p["lat"]), float(p["lon"]), int(bool(p.get("settlement"))), now),
+            )
+        self._inserts += len(places)
+        if self._inserts >= _TRIM_EVERY:
+            self._inserts = 0
+            self._trim()
+        return keys
+
+    def _trim(self) -> None:
+        count = self._db().execute("SELECT COUNT(*) FROM places").fetchone()[0]
+        if count > MAX_PLACES:
+            self._db().execute(
+                "DELETE FROM places WHERE place_key IN "
+                "(SELECT place_key FROM places ORDER BY hits ASC, updated_at ASC LIMIT ?)",
+                (count - MAX_PLACES,),
+            )
+        self._db().execute("DELETE FROM queries WHERE created_at < ?", (time.time() - QUERY_TTL,))
+
+    # --- Autocomplete ---------------------------------------------------
+
+    def suggest(self, query: str, limit: int = 5) -> Optional[List[Dict]]:
+        """Return cached suggestions for a query, or None if it must go upstream.
+
+        Tries the exact query first, then a prefix match on known place names
+        (optionally narrowed by a country prefix after a comma).
+        """
+        query_norm = normalize(query)
+        if not query_norm:
+            return None
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT place_keys, created_at FROM queries WHERE query_norm = ?", (query_norm,)
+                ).fetchone()
+                if row and time.time() - row["created_at"] < QUERY_TTL:
+                    places = self._places(json.loads(row["place_keys"]))[:limit]
+                    self._touch([p["place_key"] for p in places])
+                    self._db().commit()
+                    return places
+
+                name, country = _split_query(query_norm)
+                if not name:
+                    return None
+                rows = self._db().execute(
+                    """
+                    SELECT * FROM places
+                    WHERE name_norm >= ? AND name_norm < ? AND country_norm >= ? AND country_norm < ?
+                    ORDER BY hits DESC, length(name_norm) ASC
+                    LIMIT ?
+                    """,
+                    (name, name + "\uffff", country, country + "\uffff", limit),
+                ).fetchall()
+                return [dict(r) for r in rows] or None
+        except sqlite3.Error as e:
+            logger.warning("Geocode cache lookup failed: %s", e)
+            return None
+
+    def store_suggestions(self, query: str, places: List[Dict]) -> None:
+        """Record upstream suggestions for a query.
+
+        Places are dicts with city, country, lat, lon, display_name and
+        settlement (true when lat/lon are the city's own). A non-settlement
+        result never moves the point of a place already stored as one.
+        """
+        try:
+            with self._lock:
+                keys = self._upsert_places([p for p in places if p.get("city")])
+                self._db().execute(
+                    "INSERT OR REPLACE INTO queries (query_norm, place_keys, created_at) VALUES (?, ?, ?)",
+                    (normalize(query), json.dumps(keys), time.time()),
+                )
+                self._db().commit()
+        except sqlite3.Error as e:
+            logger.warning("Geocode cache write failed: %s", e)
+
+    # --- Forward geocoding ----------------------------------------------
+
+    def lookup_point(self, city: str, country: str) -> Optional[Tuple[float, float]]:
+        """Return (lat, lon) for a city/country if a settlement result for it is known."""
+        query = f"{city}, {country}" if country else city
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT place_key, lat, lon FROM places WHERE place_key = ? AND settlement",
+                    (_place_key(city, country),),
+                ).fetchone()
+                if row is None:
+                    q = self._db().execute(
+                        "SELECT place_keys FROM queries WHERE query_norm = ?", (normalize(query),)
+                    ).fetchone()
+                    keys = json.loads(q["place_keys"]) if q else []
+                    places = self._places(keys[:1])
+                    row = places[0] if places and places[0]["settlement"] else None
+                if row is None:
+                    return None
+                self._touch([row["place_key"]])
+                self._db().commit()
+                return float(row["lat"]), float(row["lon"])
+        except sqlite3.Error as e:
+            logger.warning("Geocode cache lookup failed: %s", e)
+            return None
+
+    def store_point(self, city: str, country: str, lat: float, lon: float) -> None:
+        """Record a forward-geocoding result."""
+        query = f"{city}, {country}" if country else city
+        place = {"city": city, "country": country, "lat": lat, "lon": lon, "display_name": query, "settlement": True}
+        self.store_suggestions(query, [place])
+
+
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH)
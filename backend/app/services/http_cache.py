@@ -0,0 +1,196 @@
+"""Conditional and range requests for poster downloads.
+
+Poster files never change once written, so they get strong ETags derived
+from a hash of their content, are answered with 304 when the client already
+has them, and support single byte ranges (for resumed downloads and edge
+caches that fetch in slices). Content can be served from a file or from
+memory with identical headers.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+_HASH_CACHE_SIZE = 2048
+_CHUNK = 256 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+# (path, mtime_ns, size) -> etag; hashing a poster once is enough
+_etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_etags_lock = threading.Lock()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag (weak comparison)."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def file_etag(path: Path, stat: Optional[os.stat_result] = None) -> str:
+    """Strong ETag from a hash of the file's content (memoized per path/mtime/size)."""
+    stat = stat or path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()}"'
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > _HASH_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=" range into inclusive (start, end).
+
+    Returns None when the header should be ignored (malformed, or several
+    ranges, which RFC 9110 allows answering with the full body). An
+    unsatisfiable range comes back with start >= size.
+    """
+    match = _RANGE_RE.fullmatch(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return size, size
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _read_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def content_etag(data: bytes) -> str:
+    """Strong ETag for in-memory content; equals file_etag() of the same bytes on disk."""
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def _conditional(
+    request: Request, etag: str, size: int, headers: Dict[str, str]
+) -> Tuple[Optional[Response], Optional[Tuple[int, int]]]:
+    """Handle If-None-Match and Range for a representation.
+
+    Returns a finished response (304/416) or the byte range to send, if any.
+    """
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers), None
+
+    range_header = request.headers.get("range", "")
+    if_range = request.headers.get("if-range", "")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None and byte_range[0] >= size:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}), None
+        return None, byte_range
+    return None, None
+
+
+def _partial_headers(headers: Dict[str, str], byte_range: Tuple[int, int], size: int) -> Dict[str, str]:
+    start, end = byte_range
+    return {
+        **headers,
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+    }
+
+
+async def cached_file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    filename: str,
+    cache_control: str,
+    content_disposition_type: str = "attachment",
+) -> Response:
+    """Serve an immutable file with ETag/304, Cache-Control and byte-range support."""
+    stat = path.stat()
+    etag = await run_in_threadpool(file_etag, path, stat)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    response, byte_range = _conditional(request, etag, stat.st_size, headers)
+    if response is not None:
+        return response
+    if byte_range is not None:
+        response = StreamingResponse(
+            _read_range(path, *byte_range),
+            status_code=206,
+            media_type=media_type,
+            headers=_partial_headers(headers, byte_range, stat.st_size),
+        )
+        response.headers["Content-Disposition"] = f'{content_disposition_type}; filename="{filename}"'
+        return response
+
+    return FileResponse(
+        path=str(path),
+        media_type=media_type,
+        filename=filename,
+        headers=headers,
+        stat_result=stat,
+        content_disposition_type=content_disposition_type,
+    )
+
+
+def cached_bytes_response(
+    request: Request,
+    data: bytes,
+    etag: str,
+    media_type: str,
+    filename: str,
+    cache_control: str,
+    content_disposition_type: str = "attachment",
+) -> Response:
+    """Like cached_file_response, for content held in memory."""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'{content_disposition_type}; filename="{filename}"',
+    }
+    response, byte_range = _conditional(request, etag, len(data), headers)
+    if response is not None:
+        return response
+    if byte_range is not None:
+        start, end = byte_range
+        return Response(
+            data[start:end + 1],
+            status_code=206,
+            media_type=media_type,
+            headers=_partial_headers(headers, byte_range, len(data)),
+        )
+    return Response(data, media_type=media_type, headers=headers)
@@ -1,12 +1,17 @@
+import asyncio
 import logging
+import threading
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.services.result_store import result_store
 
 logger = logging.getLogger(__name__)
 
 MAX_JOBS = 500
+JOB_RETENTION = timedelta(hours=2)  # completed/failed jobs and their files are deleted after this
 
 
 class Job:
@@ -20,6 +25,11 @@ class Job:
         output_format: str = "instagram",
         custom_title: str = "",
         landmarks: Optional[List[dict]] = None,
+        profile: bool = False,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        offset_east_m: float = 0.0,
+        offset_north_m: float = 0.0,
     ) -> None:
         self.job_id: str = uuid.uuid4().hex
         self.city: str = city
@@ -30,12 +40,54 @@ class Job:
         self.output_format: str = output_format
         self.custom_title: str = custom_title
         self.landmarks: List[dict] = landmarks or []
+        self.lat: Optional[float] = lat
+        self.lon: Optional[float] = lon
+        self.offset_east_m: float = offset_east_m
+        self.offset_north_m: float = offset_north_m
         self.status: str = "queued"
         self.stage: Optional[str] = None
         self.result_path: Optional[str] = None
         self.error: Optional[str] = None
         self.share_id: Optional[str] = None
+        self.email_status: Optional[str] = None  # queued, retrying, sent, failed, skipped
+        self.profile: bool = profile
+        self.profile_path: Optional[str] = None
         self.created_at: str = datetime.utcnow().isoformat()
+        self.version: int = 1
+        # Long-polling requests, woken on their own loop when the version changes
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._waiters_lock = threading.Lock()
+
+    def update(self, **changes: object) -> None:
+        """Set client-visible fields and bump the version if anything changed."""
+        changed = False
+        for name, value in changes.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self.version += 1
+            self.notify_waiters()
+
+    def notify_waiters(self) -> None:
+        """Wake every long-poll waiting on this job; safe from any thread."""
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # the loop has closed
+                pass
+
+    @property
+    def expires_at(self) -> float:
+        """Unix time after which a finished job and its poster may be deleted."""
+        created = datetime.fromisoformat(self.created_at).replace(tzinfo=timezone.utc)
+        return (created + JOB_RETENTION).timestamp()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.job_id[:8]}-{self.version}"'
 
 
 class JobStore:
@@ -55,8 +107,8 @@ class JobStore:
             except (ValueError, TypeError):
                 continue
             age = now - created
-            # Remove completed/failed jobs after 2 hours
-            if job.status in ("completed", "failed") and age > timedelta(hours=2):
+            # Remove completed/failed jobs after JOB_RETENTION
+            if job.status in ("completed", "failed") and age > JOB_RETENTION:
                 to_remove.append(job_id)
             # Remove any job after 6 hours regardless of status
             elif age > timedelta(hours=6):
@@ -65,13 +117,20 @@ class JobStore:
         for job_id in to_remove:
             job = self._jobs.pop(job_id, None)
             if job:
+                # Long-polls return None for the removed job instead of timing out
+                job.notify_waiters()
                 # Clean up share index
                 if job.share_id and job.share_id in self._share_index:
                     del self._share_index[job.share_id]
-                # Delete output file from disk
+                # Delete output files from disk, including variants derived from the poster
+                paths = [Path(p) for p in (job.result_path, job.profile_path) if p]
                 if job.result_path:
+                    result = Path(job.result_path)
+                    result_store.discard(result, variants=True)
+                    paths += result.parent.glob(f"{result.stem}_*")
+                for path in paths:
                     try:
-                        Path(job.result_path).unlink(missing_ok=True)
+                        path.unlink(missing_ok=True)
                     except OSError:
                         pass
                 logger.debug("Cleaned up job %s (age: %s)", job_id, now - datetime.fromisoformat(job.created_at) if job.created_at else "unknown")
@@ -89,6 +148,11 @@ class JobStore:
         output_format: str = "instagram",
         custom_title: str = "",
         landmarks: Optional[List[dict]] = None,
+        profile: bool = False,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        offset_east_m: float = 0.0,
+        offset_north_m: float = 0.0,
     ) -> Job:
         self.cleanup()
         if len(self._jobs) >= MAX_JOBS:
@@ -102,6 +166,11 @@ class JobStore:
             output_format=output_format,
             custom_title=custom_title,
             landmarks=landmarks,
+            profile=profile,
+            lat=lat,
+            lon=lon,
+            offset_east_m=offset_east_m,
+            offset_north_m=offset_north_m,
         )
         self._jobs[job.job_id] = job
         return job
@@ -109,6 +178,30 @@ class JobStore:
     def get(self, job_id: str) -> Optional[Job]:
         return self._jobs.get(job_id)
 
+    async def wait_for_change(self, job_id: str, version: int, timeout: float) -> Optional[Job]:
+        """Long-poll helper: return the job once its version differs from `version`.
+
+        Jobs are updated from worker threads; Job.update wakes the waiter
+        through its event loop. Returns the job (changed or not) when the
+        timeout expires, or None if it disappeared in the meantime.
+        """
+        job = self._jobs.get(job_id)
+        if not job or job.version != version:
+            return job
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with job._waiters_lock:
+            job._waiters.add(waiter)
+        try:
+            # Checked again after registering, so an update in between is not missed
+            if job.version == version:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with job._waiters_lock:
+                job._waiters.discard(waiter)
+        return self._jobs.get(job_id)
+
     def share(self, job_id: str) -> Optional[str]:
         """Generate a share_id for a completed job. Returns share_id."""
         job = self._jobs.get(job_id)
@@ -117,7 +210,7 @@ class JobStore:
         if job.share_id:
             return job.share_id
         share_id = uuid.uuid4().hex[:12]
-        job.share_id = share_id
+        job.update(share_id=share_id)
         self._share_index[share_id] = job_id
         return share_id
 
@@ -0,0 +1,131 @@
+"""Cache of fetched and projected map data, keyed by center point and fetch extent.
+
+Entries are pickled to ``MAP_DATA_CACHE_DIR`` so they survive restarts and
+are shared by worker processes; the most recently used few are also kept in
+memory. A hit skips both the Overpass fetch and the projection stage. The
+cache warmer keeps entries for popular requests fresh (see cache_warmer).
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from app.services.geocode_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+MAP_DATA_CACHE_DIR = Path(os.environ.get("MAP_DATA_CACHE_DIR", CACHE_DIR / "map_data"))
+MAP_DATA_CACHE_MB = int(os.environ.get("MAP_DATA_CACHE_MB", "2048"))
+MAP_DATA_TTL = 3 * 86400  # seconds an entry may be served; OSM edits are rarely urgent
+_FORMAT = 3  # bumped when the pickled layers change; older files are never read
+_MEMORY_ENTRIES = 2  # a megacity's layers still run to tens of MB
+
+
+def data_key(center: Tuple[float, float], extent: Tuple[int, int]) -> str:
+    # ~1 m of rounding so repeated geocodes of a city land on the same key
+    return f"{center[0]:.5f},{center[1]:.5f},{int(extent[0])}x{int(extent[1])}"
+
+
+class MapDataCache:
+    def __init__(self, directory: Path, max_bytes: int, ttl: float = MAP_DATA_TTL) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha1(f'{_FORMAT}:{key}'.encode()).hexdigest()}.pickle"
+
+    def age(self, center: Tuple[float, float], extent: Tuple[int, int]) -> Optional[float]:
+        """Seconds since the entry was stored, or None if there is none."""
+        try:
+            return max(0.0, time.time() - self._path(data_key(center, extent)).stat().st_mtime)
+        except OSError:
+            return None
+
+    def get(self, center: Tuple[float, float], extent: Tuple[int, int]) -> Optional[Any]:
+        """Projected (streets, water, parks) for the request, or None."""
+        key = data_key(center, extent)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                return entry[1]
+        path = self._path(key)
+        try:
+            stored_at = path.stat().st_mtime
+            if now - stored_at > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning("Unreadable map data cache entry %s: %s", path.name, e)
+            path.unlink(missing_ok=True)
+            return None
+        self._remember(key, stored_at, data)
+        return data
+
+    def put(self, center: Tuple[float, float], extent: Tuple[int, int], data: Any, wait: bool = True) -> None:
+        """Store projected map data; with wait=False the file is written by a background thread.
+
+        The data is always pickled in the calling thread: rendering touches
+        pandas' internal caches, so it must not be pickled concurrently.
+        """
+        key = data_key(center, extent)
+        self._remember(key, time.time(), data)
+        try:
+            payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning("Could not pickle map data for %s: %s", key, e)
+            return
+        if wait:
+            self._write(key, payload)
+        else:
+            threading.Thread(target=self._write, args=(key, payload), name="map-data-store", daemon=True).start()
+
+    def _write(self, key: str, payload: bytes) -> None:
+        path = self._path(key)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp.write_bytes(payload)
+            tmp.replace(path)
+        except OSError as e:
+            logger.warning("Could not store map data for %s: %s", key, e)
+            tmp.unlink(missing_ok=True)
+            return
+        self._trim()
+
+    def _remember(self, key: str, stored_at: float, data: Any) -> None:
+        with self._lock:
+            self._memory[key] = (stored_at, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > _MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _trim(self) -> None:
+        """Drop the least recently written entries beyond the size limit."""
+        try:
+            entries = [(p.stat(), p) for p in self.directory.glob("*.pickle")]
+        except OSError:
+            return
+        total = sum(st.st_size for st, _ in entries)
+        for st, path in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+
+
+map_data_cache = MapDataCache(MAP_DATA_CACHE_DIR, max_bytes=MAP_DATA_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,181 @@
+"""Shared, pooled Nominatim client for autocomplete.
+
+All upstream searches go through one dispatcher task that sends at most one
+request per ``min_interval`` (Nominatim's usage policy is 1 req/s) over a
+single pooled ``httpx.AsyncClient``, so TLS connections are reused.
+
+Before a query reaches the dispatcher:
+
+- identical queries (after normalization) that are already queued or in
+  flight share the same upstream request;
+- when a client submits a query that extends its previous still-queued query
+  ("par" -> "pari"), the client stops waiting on the older one and gets
+  ``None`` for it. A queued query nobody is waiting on any more is dropped
+  without using an upstream slot.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.services.geocode_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PARAMS = {"format": "json", "limit": 5, "addressdetails": 1, "accept-language": "en"}
+
+SearchResult = Optional[List[Dict[str, Any]]]
+
+
+@dataclass
+class _Pending:
+    query: str
+    key: str
+    # One future per waiting client, resolved with None if that client moves on
+    waiters: Dict[str, "asyncio.Future[SearchResult]"] = field(default_factory=dict)
+    dispatched: bool = False
+
+
+class NominatimClient:
+    def __init__(
+        self,
+        base_url: str,
+        user_agent: str,
+        min_interval: float = 1.0,
+        timeout: float = 5.0,
+    ) -> None:
+        self.search_url = base_url.rstrip("/") + "/search"
+        self.user_agent = user_agent
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional["asyncio.Queue[_Pending]"] = None
+        self._worker: Optional["asyncio.Task[None]"] = None
+        self._pending: Dict[str, _Pending] = {}
+        self._latest_by_client: Dict[str, str] = {}
+        self._next_slot = 0.0
+        self.stats = {"sent": 0, "coalesced": 0, "superseded": 0, "dropped": 0}
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._pending.clear()
+        self._latest_by_client.clear()
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            headers={"User-Agent": self.user_agent, "Accept-Language": "en"},
+            limits=httpx.Limits(max_connections=2, max_keepalive_connections=2),
+        )
+        self._queue = asyncio.Queue()
+        self._worker = loop.create_task(self._dispatch(), name="nominatim-dispatcher")
+
+    async def search(self, query: str, client_key: str) -> SearchResult:
+        """Search Nominatim; returns None if this client sent a newer query meanwhile.
+
+        Raises httpx.HTTPError if the upstream request fails.
+        """
+        self._ensure_started()
+        assert self._loop is not None and self._queue is not None
+        key = normalize(query)
+
+        previous_key = self._latest_by_client.get(client_key)
+        if previous_key is not None and previous_key != key and key.startswith(previous_key):
+            self._supersede(previous_key, client_key)
+        self._latest_by_client[client_key] = key
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+        else:
+            pending = _Pending(query=query, key=key)
+            self._pending[key] = pending
+            self._queue.put_nowait(pending)
+        future = pending.waiters.get(client_key)
+        if future is None:
+            future = pending.waiters[client_key] = self._loop.create_future()
+
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if pending.waiters.get(client_key) is future:
+                del pending.waiters[client_key]
+            if self._latest_by_client.get(client_key) == key:
+                del self._latest_by_client[client_key]
+
+    def _supersede(self, previous_key: str, client_key: str) -> None:
+        old = self._pending.get(previous_key)
+        if old is None or old.dispatched:
+            return
+        future = old.waiters.pop(client_key, None)
+        if future is None:
+            return
+        self.stats["superseded"] += 1
+        if not future.done():
+            future.set_result(None)
+
+    def _resolve(self, pending: _Pending, result: SearchResult = None, error: Optional[Exception] = None) -> None:
+        if self._pending.get(pending.key) is pending:
+            del self._pending[pending.key]
+        for future in pending.waiters.values():
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _dispatch(self) -> None:
+        assert self._queue is not None and self._client is not None
+        while True:
+            pending = await self._queue.get()
+            if not pending.waiters:
+                self.stats["dropped"] += 1
+                self._resolve(pending)
+                continue
+
+            delay = self._next_slot - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not pending.waiters:
+                # Every caller moved on while this query waited for its slot
+                self.stats["dropped"] += 1
+                self._resolve(pending)
+                continue
+
+            pending.dispatched = True
+            self._next_slot = time.monotonic() + self.min_interval
+            self.stats["sent"] += 1
+            try:
+                resp = await self._client.get(self.search_url, params={"q": pending.query, **SEARCH_PARAMS})
+                resp.raise_for_status()
+                self._resolve(pending, result=resp.json())
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning("Nominatim search for %r failed: %s", pending.query, e)
+                self._resolve(pending, error=e)
+            except Exception as e:
+                # Fail this query's callers, not the dispatcher every later query depends on;
+                # only cancellation (a BaseException) ends the loop
+                logger.exception("Nominatim search for %r failed unexpectedly", pending.query)
+                self._resolve(pending, error=e)
+
+    async def aclose(self) -> None:
+        """Stop the dispatcher and close pooled connections."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for pending in list(self._pending.values()):
+            self._resolve(pending)
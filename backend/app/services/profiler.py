@@ -0,0 +1,90 @@
+"""Sampling profiler for individual generation jobs.
+
+A background thread periodically snapshots the stacks of the job's worker
+thread and of the fetch threads it spawns (matched by thread name prefix),
+aggregating them into collapsed-stack format — one ``frame;frame;... count``
+line per unique stack — which flamegraph.pl and speedscope read directly.
+
+Nothing is started unless a job explicitly asks to be profiled.
+"""
+
+import logging
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+_MAX_DEPTH = 128
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", Path(code.co_filename).stem)
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def _collapse(frame: Optional[FrameType]) -> list[str]:
+    labels: list[str] = []
+    while frame is not None and len(labels) < _MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """Sample one thread and its helper threads until stopped."""
+
+    def __init__(
+        self,
+        thread_ident: int,
+        thread_name_prefix: str = "",
+        interval: float = DEFAULT_INTERVAL,
+    ) -> None:
+        self.thread_ident = thread_ident
+        self.thread_name_prefix = thread_name_prefix
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _targets(self) -> dict[int, str]:
+        targets = {self.thread_ident: "worker"}
+        if self.thread_name_prefix:
+            for t in threading.enumerate():
+                if t.ident is not None and t.name.startswith(self.thread_name_prefix):
+                    targets[t.ident] = "fetch"
+        return targets
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, role in self._targets().items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                self._stacks[";".join([role, *_collapse(frame)])] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="job-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def write_collapsed(self, path: Path) -> Path:
+        """Write aggregated stacks in collapsed format, hottest first."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Wrote profile with %d samples to %s", self.samples, path)
+        return path
@@ -1,81 +1,203 @@
+"""Sliding-window-counter rate limiting with O(1) state per key.
+
+Each key keeps the start of its current fixed window and the request counts
+of the current and previous windows. The rolling count is estimated as
+
+    previous * (1 - elapsed / window) + current
+
+which tracks a true rolling window closely without storing timestamps.
+
+State lives in a backend shared by every limiter. ``RATE_LIMIT_BACKEND=sqlite``
+(the default) keeps it in a small SQLite database so limits hold across
+worker processes and restarts; ``memory`` keeps it per process. SQLite
+checks can wait on disk or on another process's lock, so async handlers
+use ``check``, which runs them in the threadpool.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
 import time
-from collections import defaultdict
-from typing import Dict, List
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.geocode_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "sqlite")
+RATE_LIMIT_DB = Path(os.environ.get("RATE_LIMIT_DB", CACHE_DIR / "rate_limits.sqlite3"))
 
 _CLEANUP_INTERVAL = 600  # purge stale keys every 10 minutes
 
+# (window_start, previous_count, current_count)
+WindowState = Tuple[float, int, int]
+# Given the stored state (or None) return the state to store and a result
+Transition = Callable[[Optional[WindowState]], Tuple[WindowState, int]]
 
-class RateLimiter:
-    """In-memory rate limiter: 3 requests per email per 24-hour rolling window."""
 
-    def __init__(self, max_requests: int = 3, window_seconds: int = 86400) -> None:
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self._requests: Dict[str, List[float]] = defaultdict(list)
-        self._last_cleanup: float = time.time()
-
-    def _maybe_cleanup(self, now: float) -> None:
-        if now - self._last_cleanup < _CLEANUP_INTERVAL:
-            return
-        self._last_cleanup = now
-        cutoff = now - self.window_seconds
-        empty_keys = [k for k, v in self._requests.items() if not v or v[-1] <= cutoff]
-        for k in empty_keys:
-            del self._requests[k]
-
-    def is_allowed(self, email: str) -> bool:
-        now = time.time()
-        self._maybe_cleanup(now)
-        cutoff = now - self.window_seconds
-        # Prune old entries
-        self._requests[email] = [
-            t for t in self._requests[email] if t > cutoff
-        ]
-        if len(self._requests[email]) >= self.max_requests:
-            return False
-        self._requests[email].append(now)
-        return True
-
-    def remaining(self, email: str) -> int:
-        now = time.time()
-        cutoff = now - self.window_seconds
-        self._requests[email] = [
-            t for t in self._requests[email] if t > cutoff
-        ]
-        return max(0, self.max_requests - len(self._requests[email]))
+class MemoryBackend:
+    """Per-process state, kept per scope in last-touched order so expiry is amortized O(1).
 
+    A scope always uses the same expiry, so within it the last-touched order
+    is also expiry order; scopes with different expiries never block each
+    other's sweep.
+    """
 
-rate_limiter = RateLimiter(max_requests=10)
+    def __init__(self) -> None:
+        self._scopes: Dict[str, "OrderedDict[str, Tuple[WindowState, float]]"] = {}
+        self._lock = threading.Lock()
 
+    def transact(self, scope: str, key: str, expires_after: float, fn: Transition) -> int:
+        now = time.time()
+        with self._lock:
+            states = self._scopes.setdefault(scope, OrderedDict())
+            entry = states.pop(key, None)
+            state, result = fn(entry[0] if entry else None)
+            states[key] = (state, now + expires_after)
+            # Oldest-touched entries are at the front; drop those that expired
+            while states:
+                oldest = next(iter(states))
+                if states[oldest][1] > now:
+                    break
+                del states[oldest]
+            return result
+
+
+class SQLiteBackend:
+    """State in a SQLite table, shared by every process using the same file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_cleanup = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    window_start REAL NOT NULL,
+                    previous_count INTEGER NOT NULL,
+                    current_count INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (scope, key)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limits_expiry ON rate_limits(expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def transact(self, scope: str, key: str, expires_after: float, fn: Transition) -> int:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            # IMMEDIATE takes the write lock up front so the read-modify-write is atomic across processes
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT window_start, previous_count, current_count FROM rate_limits WHERE scope = ? AND key = ?",
+                    (scope, key),
+                ).fetchone()
+                state, result = fn(tuple(row) if row else None)  # type: ignore[arg-type]
+                db.execute(
+                    "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, key, *state, now + expires_after),
+                )
+                if now - self._last_cleanup >= _CLEANUP_INTERVAL:
+                    self._last_cleanup = now
+                    db.execute("DELETE FROM rate_limits WHERE expires_at < ?", (now,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return result
+
+
+def _make_backend() -> "MemoryBackend | SQLiteBackend":
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryBackend()
+    if RATE_LIMIT_BACKEND != "sqlite":
+        logger.warning("Unknown RATE_LIMIT_BACKEND %r, using sqlite", RATE_LIMIT_BACKEND)
+    return SQLiteBackend(RATE_LIMIT_DB)
+
+
+_backend = _make_backend()
 
-class IPRateLimiter:
-    """In-memory rate limiter: 5 requests per IP per 1-hour rolling window."""
 
-    def __init__(self, max_requests: int = 5, window_seconds: int = 3600) -> None:
+class RateLimiter:
+    """At most `max_requests` per key in any rolling `window_seconds` (approximately)."""
+
+    def __init__(
+        self,
+        scope: str,
+        max_requests: int,
+        window_seconds: int,
+        backend: "MemoryBackend | SQLiteBackend | None" = None,
+    ) -> None:
+        self.scope = scope
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self._requests: Dict[str, List[float]] = defaultdict(list)
-        self._last_cleanup: float = time.time()
-
-    def _maybe_cleanup(self, now: float) -> None:
-        if now - self._last_cleanup < _CLEANUP_INTERVAL:
-            return
-        self._last_cleanup = now
-        cutoff = now - self.window_seconds
-        empty_keys = [k for k, v in self._requests.items() if not v or v[-1] <= cutoff]
-        for k in empty_keys:
-            del self._requests[k]
-
-    def is_allowed(self, ip: str) -> bool:
+        self.backend = backend or _backend
+
+    def _advance(self, state: Optional[WindowState], now: float) -> WindowState:
+        window = self.window_seconds
+        if state is None or now >= state[0] + 2 * window:
+            return (now - now % window, 0, 0)
+        if now >= state[0] + window:
+            return (state[0] + window, state[2], 0)
+        return state
+
+    def _estimate(self, state: WindowState, now: float) -> float:
+        elapsed = (now - state[0]) / self.window_seconds
+        return state[1] * (1 - elapsed) + state[2]
+
+    def _run(self, key: str, fn: Transition) -> Optional[int]:
+        try:
+            return self.backend.transact(self.scope, key, 2 * self.window_seconds, fn)
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter store should not take the API down
+            logger.warning("Rate limiter store failed: %s", e)
+            return None
+
+    def is_allowed(self, key: str) -> bool:
+        now = time.time()
+
+        def consume(state: Optional[WindowState]) -> Tuple[WindowState, int]:
+            start, previous, current = self._advance(state, now)
+            if self._estimate((start, previous, current), now) + 1 > self.max_requests:
+                return (start, previous, current), 0
+            return (start, previous, current + 1), 1
+
+        return self._run(key, consume) != 0
+
+    async def check(self, key: str) -> bool:
+        """is_allowed without blocking the event loop."""
+        return await run_in_threadpool(self.is_allowed, key)
+
+    def remaining(self, key: str) -> int:
         now = time.time()
-        self._maybe_cleanup(now)
-        cutoff = now - self.window_seconds
-        self._requests[ip] = [t for t in self._requests[ip] if t > cutoff]
-        if len(self._requests[ip]) >= self.max_requests:
-            return False
-        self._requests[ip].append(now)
-        return True
+
+        def peek(state: Optional[WindowState]) -> Tuple[WindowState, int]:
+            state = self._advance(state, now)
+            return state, max(0, int(self.max_requests - self._estimate(state, now)))
+
+        result = self._run(key, peek)
+        return self.max_requests if result is None else result
 
 
-ip_rate_limiter = IPRateLimiter(max_requests=10)
-geocode_rate_limiter = IPRateLimiter(max_requests=60, window_seconds=3600)
+rate_limiter = RateLimiter("email", max_requests=10, window_seconds=86400)
+ip_rate_limiter = RateLimiter("ip", max_requests=10, window_seconds=3600)
+geocode_rate_limiter = RateLimiter("geocode", max_requests=60, window_seconds=3600)
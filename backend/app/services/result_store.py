@@ -0,0 +1,206 @@
+"""Bounded in-memory store for finished posters, with spill to disk.
+
+A job's PNG, its WebP previews and the email variant are kept as encoded
+bytes under the path they would have on disk. Emails, the first downloads
+and preview requests are answered from memory; a background thread writes
+entries to their path and drops them from memory once they are older than
+``RESULT_MEMORY_TTL`` or the store exceeds ``RESULT_STORE_MB``. Readers
+fall back to the file, so callers never need to know where a result is.
+
+Results only live in the memory of the process that rendered them. When
+several worker processes share one output directory and email queue, set
+``RESULT_STORE_MB=0`` to write results straight to disk.
+"""
+
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, NamedTuple, Optional, Set
+
+from fastapi import Request, Response
+
+from app.services.http_cache import cached_bytes_response, cached_file_response, content_etag
+
+logger = logging.getLogger(__name__)
+
+RESULT_STORE_MB = int(os.environ.get("RESULT_STORE_MB", "256"))
+RESULT_MEMORY_TTL = int(os.environ.get("RESULT_MEMORY_TTL", str(15 * 60)))  # seconds
+_SWEEP_INTERVAL = 30.0
+
+
+class StoredResult(NamedTuple):
+    data: bytes
+    etag: str
+    stored_at: float
+
+
+class ResultStore:
+    def __init__(self, max_bytes: int, memory_ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.memory_ttl = memory_ttl
+        self._entries: "OrderedDict[Path, StoredResult]" = OrderedDict()
+        self._bytes = 0
+        # Paths being written by spill, and those discarded meanwhile, whose
+        # file the spill must delete again once written
+        self._spilling: Dict[Path, int] = {}
+        self._dropped: Set[Path] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, path: Path, data: bytes) -> None:
+        """Keep `data` as the content of `path` (written through if it cannot fit).
+
+        Raises OSError only when writing through fails.
+        """
+        if len(data) > self.max_bytes:
+            self._write(path, data)
+            return
+        entry = StoredResult(data, content_etag(data), time.time())
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old.data)
+            self._entries[path] = entry
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        self._ensure_spiller()
+        if over:
+            self._wake.set()
+
+    def get(self, path: Path) -> Optional[StoredResult]:
+        with self._lock:
+            return self._entries.get(path)
+
+    def exists(self, path: Path) -> bool:
+        return self.get(path) is not None or path.exists()
+
+    def size(self, path: Path) -> int:
+        entry = self.get(path)
+        return len(entry.data) if entry is not None else path.stat().st_size
+
+    def open(self, path: Path) -> BinaryIO:
+        """Binary reader for a result, from memory or disk (raises OSError if absent)."""
+        entry = self.get(path)
+        if entry is not None:
+            return io.BytesIO(entry.data)
+        return open(path, "rb")
+
+    def discard(self, path: Path, variants: bool = False) -> None:
+        """Forget a result held in memory (and with `variants`, every ``<stem>_*`` next to it).
+
+        A spill of a discarded result that is already writing deletes its file
+        when done, so callers can delete the files right after this.
+        """
+        with self._lock:
+            doomed = [path]
+            if variants:
+                doomed += [
+                    p for p in self._entries
+                    if p.parent == path.parent and p.name.startswith(f"{path.stem}_")
+                ]
+            for p in doomed:
+                entry = self._entries.pop(p, None)
+                if entry is not None:
+                    self._bytes -= len(entry.data)
+                if p in self._spilling:
+                    self._dropped.add(p)
+
+    async def response(
+        self,
+        request: Request,
+        path: Path,
+        media_type: str,
+        filename: str,
+        cache_control: str,
+        content_disposition_type: str = "attachment",
+    ) -> Optional[Response]:
+        """Serve a result with caching headers, or None if it does not exist."""
+        entry = self.get(path)
+        if entry is not None:
+            return cached_bytes_response(
+                request, entry.data, entry.etag, media_type, filename, cache_control, content_disposition_type
+            )
+        if not path.exists():
+            return None
+        return await cached_file_response(
+            request, path, media_type, filename, cache_control, content_disposition_type
+        )
+
+    def _write(self, path: Path, data: bytes) -> None:
+        tmp = path.with_name(f".{path.name}.tmp")
+        try:
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _due(self) -> Optional[Path]:
+        """The oldest entry if it is past its memory TTL or the store is over budget."""
+        with self._lock:
+            if not self._entries:
+                return None
+            path, entry = next(iter(self._entries.items()))
+            if self._bytes > self.max_bytes or time.time() - entry.stored_at > self.memory_ttl:
+                return path
+            return None
+
+    def spill(self, path: Path) -> bool:
+        """Write one entry to disk, then drop it from memory (readers see it throughout).
+
+        Returns False if the write failed; the entry then stays in memory.
+        If the entry is discarded while being written, the file is deleted.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return True
+            self._spilling[path] = self._spilling.get(path, 0) + 1
+        try:
+            self._write(path, entry.data)
+        except OSError as e:
+            logger.error("Could not spill result %s to disk: %s", path.name, e)
+            written = False
+        else:
+            written = True
+        with self._lock:
+            dropped = path in self._dropped
+            self._spilling[path] -= 1
+            if not self._spilling[path]:
+                del self._spilling[path]
+                self._dropped.discard(path)
+            if written and not dropped and self._entries.get(path) is entry:
+                del self._entries[path]
+                self._bytes -= len(entry.data)
+        if written and dropped:
+            path.unlink(missing_ok=True)
+        return written or dropped
+
+    def spill_all(self) -> None:
+        with self._lock:
+            paths = list(self._entries)
+        for path in paths:
+            self.spill(path)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(_SWEEP_INTERVAL)
+            self._wake.clear()
+            # A failed write leaves the entry in memory until the next sweep
+            while (path := self._due()) is not None and self.spill(path):
+                pass
+
+    def _ensure_spiller(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="result-spill", daemon=True)
+                    self._thread.start()
+
+
+result_store = ResultStore(RESULT_STORE_MB * 1024 * 1024, memory_ttl=RESULT_MEMORY_TTL)
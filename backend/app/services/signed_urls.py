@@ -0,0 +1,99 @@
+"""HMAC-signed, expiring download links for poster files.
+
+Used where a poster must be reachable without a job id, e.g. from an email
+that is too large to carry the poster as an attachment. The key comes from
+``DOWNLOAD_SIGNING_KEY`` or, if unset, from a random key persisted in the
+cache directory so links stay valid across restarts and worker processes.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.services.geocode_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+_KEY_PATH = CACHE_DIR / "download_signing.key"
+_KEY_BYTES = 32
+
+_key: Optional[bytes] = None
+
+
+def _signing_key() -> bytes:
+    global _key
+    if _key is None:
+        env_key = os.environ.get("DOWNLOAD_SIGNING_KEY", "")
+        if env_key:
+            _key = env_key.encode("utf-8")
+        else:
+            _key = _load_or_create_key(_KEY_PATH)
+    return _key
+
+
+def _read_key(path: Path) -> Optional[bytes]:
+    """The key stored at `path`, or None if the file is missing or malformed."""
+    try:
+        key = bytes.fromhex(path.read_text().strip())
+    except (OSError, ValueError):
+        return None
+    return key if len(key) == _KEY_BYTES else None
+
+
+def _load_or_create_key(path: Path) -> bytes:
+    key = _read_key(path)
+    if key is not None:
+        return key
+    key = secrets.token_bytes(_KEY_BYTES)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write the whole key to a temp file, then link it into place: the key
+        # file never exists half-written, and os.link fails if another worker
+        # got there first, so all workers agree on the first key linked
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(key.hex())
+                f.flush()
+                os.fsync(f.fileno())
+            os.link(tmp, path)
+        finally:
+            os.unlink(tmp)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning("Could not persist download signing key (%s); links will not survive restarts", e)
+        return key
+    else:
+        return key
+    # Another worker's key: it is complete once linked, but a file left by an
+    # older version may still be being written, so allow it a moment
+    for _ in range(10):
+        existing = _read_key(path)
+        if existing is not None:
+            return existing
+        time.sleep(0.1)
+    raise RuntimeError(f"Download signing key {path} is malformed; delete it to generate a new one")
+
+
+def _signature(name: str, expires: int) -> str:
+    message = f"{name}:{expires}".encode("utf-8")
+    return hmac.new(_signing_key(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def signed_download_path(name: str, ttl: int) -> str:
+    """Relative URL for downloading the output file `name` for the next `ttl` seconds."""
+    expires = int(time.time()) + ttl
+    return f"/api/download/{name}?expires={expires}&sig={_signature(name, expires)}"
+
+
+def verify_download(name: str, expires: int, sig: str) -> bool:
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sig, _signature(name, expires))
@@ -0,0 +1,4 @@
+"""Offline benchmarks and test harnesses for the poster engine and API.
+
+Run from the backend directory, e.g. ``python -m bench.engine --help``.
+"""
@@ -0,0 +1,181 @@
+"""Offline benchmark for the poster render pipeline.
+
+Renders every fixture in every single-figure RESOLUTION_PRESETS format
+through ``render_poster`` and records per-stage timings reported by the
+pipeline itself (projection, classification, plotting, gradient,
+typography, savefig, encode; tiles for the tiled print formats, which are
+only run when named with --formats). No network access is needed.
+
+    python -m bench.engine --fixtures small medium --repeat 3 --output results.json
+    python -m bench.engine --baseline bench/baseline.json      # compare
+    python -m bench.engine --save-baseline bench/baseline.json  # store
+
+Results are JSON; comparison matches (fixture, format, stage) medians and
+exits non-zero when any stage regressed beyond the threshold.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bench.fixtures import SYNTHETIC_SPECS, load_fixture
+
+# Absolute differences below this are treated as noise when comparing
+_MIN_DELTA_SECONDS = 0.02
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    fixture_names: List[str],
+    formats: List[str],
+    repeat: int,
+    theme: str = "midnight",
+) -> dict:
+    from app.engine.generator import fetch_distance, render_poster
+    from app.engine.streets import CompactStreets, compact_streets
+
+    results: List[dict] = []
+    with tempfile.TemporaryDirectory(prefix="cartographix-bench-") as tmp:
+        for name in fixture_names:
+            fixture = load_fixture(name)
+            # Production converts the graph right after fetching, outside the render
+            streets = fixture["graph"]
+            if not isinstance(streets, CompactStreets):
+                streets = compact_streets(streets)
+            print(
+                f"{name}: {len(streets)} streets, {len(streets.coords)} points, "
+                f"distance={fixture['distance']}m ({fixture['source']})",
+                file=sys.stderr,
+            )
+            for fmt in formats:
+                samples: Dict[str, List[float]] = defaultdict(list)
+                for run in range(repeat):
+                    timings: Dict[str, float] = {}
+
+                    def _observe(stage: str, seconds: float) -> None:
+                        timings[stage] = timings.get(stage, 0.0) + seconds
+
+                    output_path = Path(tmp) / f"{name}_{fmt}_{run}.png"
+                    start = time.perf_counter()
+                    render_poster(
+                        streets,
+                        fixture["water"],
+                        fixture["parks"],
+                        fixture["center"],
+                        output_path,
+                        city="Benchmark",
+                        country="Offline",
+                        theme=theme,
+                        output_format=fmt,
+                        fetch_dist=fetch_distance(fixture["distance"], fmt),
+                        observe=_observe,
+                    )
+                    timings["total"] = time.perf_counter() - start
+                    output_path.unlink(missing_ok=True)
+                    for stage, seconds in timings.items():
+                        samples[stage].append(seconds)
+
+                for stage, values in samples.items():
+                    results.append({
+                        "fixture": name,
+                        "format": fmt,
+                        "stage": stage,
+                        "median": statistics.median(values),
+                        "min": min(values),
+                        "runs": values,
+                    })
+                total = statistics.median(samples["total"])
+                print(f"  {fmt:<18} {total:8.3f}s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "theme": theme,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Print a comparison table and return descriptions of regressed stages."""
+    base = {(r["fixture"], r["format"], r["stage"]): r["median"] for r in baseline["results"]}
+    regressions: List[str] = []
+    print(f"{'fixture':<10} {'format':<18} {'stage':<15} {'baseline':>9} {'current':>9} {'change':>8}")
+    for r in current["results"]:
+        key = (r["fixture"], r["format"], r["stage"])
+        if key not in base:
+            continue
+        before, after = base[key], r["median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > _MIN_DELTA_SECONDS:
+            flag = "  REGRESSION"
+            regressions.append(f"{'/'.join(key)}: {before:.3f}s -> {after:.3f}s ({change:+.0%})")
+        print(f"{key[0]:<10} {key[1]:<18} {key[2]:<15} {before:9.3f} {after:9.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    from app.engine.config import RESOLUTION_PRESETS
+
+    parser = argparse.ArgumentParser(description="Offline poster engine benchmark")
+    parser.add_argument("--fixtures", nargs="+", default=list(SYNTHETIC_SPECS))
+    parser.add_argument("--formats", nargs="+",
+                        default=[f for f, preset in RESOLUTION_PRESETS.items() if not preset.get("tiled")],
+                        choices=list(RESOLUTION_PRESETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--theme", default="midnight")
+    parser.add_argument("--output", type=Path, help="Write results JSON here")
+    parser.add_argument("--baseline", type=Path, help="Compare against a stored results JSON")
+    parser.add_argument("--save-baseline", type=Path, help="Store results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Relative slowdown counted as a regression (default 0.15)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    import osmnx as ox
+
+    ox.settings.log_console = False
+    results = run_benchmarks(args.fixtures, args.formats, args.repeat, theme=args.theme)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            path.write_text(json.dumps(results, indent=2))
+            print(f"Wrote {path}", file=sys.stderr)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Serialized map datasets for offline benchmarking.
+
+Each fixture is a gzipped pickle holding unprojected streets plus water and
+parks GeoDataFrames, along with the center point and requested distance.
+Synthetic fixtures store an OSMnx-style graph; recorded ones store exactly
+what ``fetch_map_data`` returns (CompactStreets).
+
+Built-in fixtures are synthetic and deterministic (seeded), shaped like OSM
+data: a road hierarchy on a jittered grid, curved edges with geometries,
+two-way streets stored in both directions, rivers, lakes with islands and
+multipart parks. They are generated on first use and cached under
+``bench/fixtures/``. Real cities can be recorded with network access:
+
+    python -m bench.fixtures record paris --city Paris --country France --distance 10000
+"""
+
+import argparse
+import gzip
+import math
+import pickle
+import random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# name -> (grid size, distance in metres, water polygons, park polygons)
+SYNTHETIC_SPECS: Dict[str, Tuple[int, int, int, int]] = {
+    "small": (60, 3000, 12, 40),
+    "medium": (150, 8000, 40, 250),
+    "megacity": (260, 15000, 120, 900),
+}
+
+_CENTER = (48.8566, 2.3522)
+_METRES_PER_DEG = 111_320.0
+
+
+def _max_fetch_distance(distance: int) -> int:
+    from app.engine.generator import RESOLUTION_PRESETS, fetch_distance
+
+    return max(fetch_distance(distance, fmt) for fmt in RESOLUTION_PRESETS)
+
+
+def _to_lonlat(center: Tuple[float, float], dx: float, dy: float) -> Tuple[float, float]:
+    lat, lng = center
+    return (
+        lng + dx / (_METRES_PER_DEG * math.cos(math.radians(lat))),
+        lat + dy / _METRES_PER_DEG,
+    )
+
+
+def _road_class(i: int, j: int, horizontal: bool, rnd: random.Random) -> str:
+    line = i if horizontal else j
+    if line % 40 == 0:
+        return "motorway"
+    if line % 20 == 0:
+        return rnd.choice(["primary", "trunk"])
+    if line % 10 == 0:
+        return "secondary"
+    if line % 5 == 0:
+        return "tertiary"
+    return rnd.choice(["residential", "residential", "residential", "service", "footway", "unclassified"])
+
+
+def _synthetic_graph(center: Tuple[float, float], n: int, half_extent: float, rnd: random.Random):
+    import networkx as nx
+    from shapely.geometry import LineString
+
+    step = 2 * half_extent / (n - 1)
+    g = nx.MultiDiGraph(crs="EPSG:4326")
+    for i in range(n):
+        for j in range(n):
+            dx = -half_extent + j * step + rnd.uniform(-0.2, 0.2) * step
+            dy = -half_extent + i * step + rnd.uniform(-0.2, 0.2) * step
+            x, y = _to_lonlat(center, dx, dy)
+            g.add_node(i * n + j, x=x, y=y, street_count=4)
+
+    osmid = 1
+    for i in range(n):
+        for j in range(n):
+            u = i * n + j
+            neighbours: List[Tuple[int, bool]] = []
+            if j < n - 1:
+                neighbours.append((u + 1, True))
+            if i < n - 1:
+                neighbours.append((u + n, False))
+            for v, horizontal in neighbours:
+                if rnd.random() < 0.08:
+                    continue  # gaps make the network irregular
+                highway = _road_class(i, j, horizontal, rnd)
+                pu = (g.nodes[u]["x"], g.nodes[u]["y"])
+                pv = (g.nodes[v]["x"], g.nodes[v]["y"])
+                attrs = {"osmid": osmid, "highway": highway, "length": step, "oneway": False}
+                osmid += 1
+                geometry = None
+                if rnd.random() < 0.3:
+                    bend = rnd.uniform(-0.15, 0.15) * step / _METRES_PER_DEG
+                    mid = ((pu[0] + pv[0]) / 2 + bend, (pu[1] + pv[1]) / 2 + bend)
+                    geometry = [pu, mid, pv]
+                if geometry:
+                    g.add_edge(u, v, **attrs, reversed=False, geometry=LineString(geometry))
+                else:
+                    g.add_edge(u, v, **attrs, reversed=False)
+                if highway != "motorway" and rnd.random() < 0.85:
+                    # Two-way street: OSMnx stores both directions
+                    if geometry:
+                        g.add_edge(v, u, **attrs, reversed=True, geometry=LineString(geometry[::-1]))
+                    else:
+                        g.add_edge(v, u, **attrs, reversed=True)
+                else:
+                    g.edges[u, v, 0]["oneway"] = True
+    return g
+
+
+def _blob(center, cx, cy, radius, rnd, points=24):
+    return [
+        _to_lonlat(
+            center,
+            cx + radius * rnd.uniform(0.7, 1.0) * math.cos(2 * math.pi * k / points),
+            cy + radius * rnd.uniform(0.7, 1.0) * math.sin(2 * math.pi * k / points),
+        )
+        for k in range(points)
+    ]
+
+
+def _synthetic_polygons(center, half_extent, count, min_r, max_r, rnd, river=False):
+    import geopandas as gpd
+    from shapely.geometry import MultiPolygon, Polygon
+
+    geoms = []
+    if river:
+        # A meandering river band across the whole area
+        width = half_extent * 0.03
+        xs = [-half_extent * 1.1 + k * half_extent * 2.2 / 80 for k in range(81)]
+        top = [(x, half_extent * 0.2 * math.sin(x / half_extent * 4) + width) for x in xs]
+        bottom = [(x, y - 2 * width) for x, y in reversed(top)]
+        geoms.append(Polygon([_to_lonlat(center, x, y) for x, y in top + bottom]))
+    for _ in range(count):
+        cx = rnd.uniform(-half_extent, half_extent)
+        cy = rnd.uniform(-half_extent, half_extent)
+        r = rnd.uniform(min_r, max_r)
+        shell = _blob(center, cx, cy, r, rnd)
+        roll = rnd.random()
+        if roll < 0.15:
+            # Lake with an island / park with a pond
+            geoms.append(Polygon(shell, [_blob(center, cx, cy, r * 0.3, rnd, points=12)]))
+        elif roll < 0.3:
+            second = _blob(center, cx + 3 * r, cy, r * 0.6, rnd)
+            geoms.append(MultiPolygon([Polygon(shell), Polygon(second)]))
+        else:
+            geoms.append(Polygon(shell))
+    return gpd.GeoDataFrame(geometry=geoms, crs="EPSG:4326")
+
+
+def build_synthetic(name: str) -> dict:
+    """Build a deterministic synthetic fixture by name."""
+    n, distance, water_count, park_count = SYNTHETIC_SPECS[name]
+    rnd = random.Random(f"cartographix-{name}")
+    half_extent = _max_fetch_distance(distance) * 1.05
+    return {
+        "name": name,
+        "source": "synthetic",
+        "center": _CENTER,
+        "distance": distance,
+        "graph": _synthetic_graph(_CENTER, n, half_extent, rnd),
+        "water": _synthetic_polygons(_CENTER, half_extent, water_count, 80, 600, rnd, river=True),
+        "parks": _synthetic_polygons(_CENTER, half_extent, park_count, 40, 250, rnd),
+    }
+
+
+def fixture_path(name: str) -> Path:
+    return FIXTURES_DIR / f"{name}.pkl.gz"
+
+
+def save_fixture(fixture: dict) -> Path:
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    path = fixture_path(fixture["name"])
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        pickle.dump(fixture, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def load_fixture(name: str) -> dict:
+    """Load a serialized fixture, building built-in synthetic ones on first use."""
+    path = fixture_path(name)
+    if not path.exists():
+        if name not in SYNTHETIC_SPECS:
+            raise FileNotFoundError(f"No fixture {name!r} at {path} — record it first")
+        save_fixture(build_synthetic(name))
+    with gzip.open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def available_fixtures() -> List[str]:
+    recorded = sorted(p.name.removesuffix(".pkl.gz") for p in FIXTURES_DIR.glob("*.pkl.gz"))
+    return list(dict.fromkeys([*SYNTHETIC_SPECS, *recorded]))
+
+
+def record_fixture(name: str, city: str, country: str, distance: int) -> Path:
+    """Fetch a real city through the engine (needs network) and serialize it."""
+    import osmnx as ox
+
+    from app.engine.generator import fetch_map_data
+
+    query = f"{city}, {country}" if country else city
+    center = ox.geocode(query)
+    # A square as wide as the widest format's crop covers every format
+    half_extent = _max_fetch_distance(distance)
+    graph, water, parks = fetch_map_data(center, (half_extent, half_extent))
+    return save_fixture({
+        "name": name,
+        "source": f"recorded:{query}",
+        "center": center,
+        "distance": distance,
+        "graph": graph,
+        "water": water,
+        "parks": parks,
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or record benchmark fixtures")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="(Re)build synthetic fixtures")
+    build.add_argument("names", nargs="*", default=list(SYNTHETIC_SPECS))
+
+    record = sub.add_parser("record", help="Record a real city (requires network)")
+    record.add_argument("name")
+    record.add_argument("--city", required=True)
+    record.add_argument("--country", default="")
+    record.add_argument("--distance", type=int, default=10000)
+
+    sub.add_parser("list", help="List available fixtures")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        for name in args.names:
+            print(f"{name}: {save_fixture(build_synthetic(name))}")
+    elif args.command == "record":
+        print(record_fixture(args.name, args.city, args.country, args.distance))
+    else:
+        for name in available_fixtures():
+            print(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Load-test harness for the API layer with a stub poster engine.
+
+Drives the real FastAPI app — routing, rate limiters, job store and the
+semaphore scheduler — with ``generate_poster`` replaced by a stub that
+sleeps for a configurable time while holding a configurable amount of
+memory. Each virtual user submits a job and follows it via /api/status
+until it finishes.
+
+    python -m bench.load --jobs 2000 --concurrency 200 --stub-latency 2 --stub-memory-mb 20
+    python -m bench.load --mode local --slots 6 --poll long --output load.json
+    python -m bench.load --mode url --url http://127.0.0.1:8000   # external server, real engine
+
+Modes: ``asgi`` calls the app in-process through httpx's ASGI transport,
+``local`` serves it with uvicorn on localhost in this process, ``url``
+targets an already-running server (no stub; thread/memory figures are not
+available). Reports throughput, latency percentiles per endpoint, status
+codes, peak thread count and memory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+# Smallest valid PNG (1×1 transparent pixel) written for stub results
+_PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+class StubEngine:
+    """Stand-in for ``generate_poster`` with configurable latency and memory."""
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        jitter: float = 0.0,
+        memory_mb: float = 0.0,
+        failure_rate: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.memory_mb = memory_mb
+        self.failure_rate = failure_rate
+
+    def __call__(
+        self,
+        city: str,
+        country: str,
+        theme: str = "default",
+        on_stage: Optional[Callable[[str], None]] = None,
+        **_kwargs: object,
+    ) -> str:
+        from app.engine.config import OUTPUT_DIR
+
+        stages = ["geocoding", "fetching_streets", "rendering"]
+        # Touch every page so the allocation is really resident
+        ballast = bytearray(int(self.memory_mb * 1024 * 1024))
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+        duration = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        for stage in stages:
+            if on_stage:
+                on_stage(stage)
+            time.sleep(duration / len(stages))
+        del ballast
+        if random.random() < self.failure_rate:
+            raise ValueError("Stub engine failure")
+        path = OUTPUT_DIR / f"loadtest_{threading.get_ident()}_{time.monotonic_ns()}.png"
+        path.write_bytes(_PNG_1X1)
+        return str(path)
+
+
+def _rss_mb() -> float:
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pct(50),
+        "p90": pct(90),
+        "p95": pct(95),
+        "p99": pct(99),
+        "max": ordered[-1],
+    }
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace) -> None:
+        self.client = client
+        self.args = args
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Counter[str] = Counter()
+        self.job_outcomes: Counter[str] = Counter()
+        self.job_latencies: List[float] = []
+        self.peak_threads = threading.active_count()
+        self.peak_rss = _rss_mb()
+        self._sampling = True
+
+    async def _request(self, name: str, method: str, url: str, **kwargs: object) -> httpx.Response:
+        start = time.perf_counter()
+        resp = await self.client.request(method, url, **kwargs)  # type: ignore[arg-type]
+        self.latencies[name].append(time.perf_counter() - start)
+        self.statuses[f"{name} {resp.status_code}"] += 1
+        return resp
+
+    async def _user_job(self, n: int) -> None:
+        ip = f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}" if not self.args.same_ip else "10.0.0.1"
+        headers = {"X-Forwarded-For": ip}
+        started = time.perf_counter()
+        resp = await self._request(
+            "generate", "POST", "/api/generate",
+            json={"city": f"Loadtest {n % 50}", "distance": 3000}, headers=headers,
+        )
+        if resp.status_code != 200:
+            self.job_outcomes[f"rejected_{resp.status_code}"] += 1
+            return
+        job_id = resp.json()["job_id"]
+        etag = ""
+        deadline = started + self.args.job_timeout
+        while time.perf_counter() < deadline:
+            if self.args.poll == "long":
+                poll_headers = {"If-None-Match": etag} if etag else {}
+                resp = await self._request(
+                    "status", "GET", f"/api/status/{job_id}",
+                    params={"wait": 25}, headers=poll_headers,
+                )
+            else:
+                await asyncio.sleep(self.args.poll_interval)
+                resp = await self._request("status", "GET", f"/api/status/{job_id}")
+            if resp.status_code == 304:
+                continue
+            if resp.status_code != 200:
+                self.job_outcomes[f"status_{resp.status_code}"] += 1
+                return
+            etag = resp.headers.get("etag", "")
+            status = resp.json()["status"]
+            if status in ("completed", "failed"):
+                self.job_outcomes[status] += 1
+                self.job_latencies.append(time.perf_counter() - started)
+                return
+        self.job_outcomes["harness_timeout"] += 1
+
+    async def _sample(self) -> None:
+        while self._sampling:
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss = max(self.peak_rss, _rss_mb())
+            await asyncio.sleep(0.1)
+
+    async def run(self) -> dict:
+        sampler = asyncio.create_task(self._sample())
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for n in range(self.args.jobs):
+            queue.put_nowait(n)
+
+        async def worker() -> None:
+            while True:
+                try:
+                    n = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self._user_job(n)
+                except httpx.HTTPError as e:
+                    self.job_outcomes[f"error_{type(e).__name__}"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - start
+        self._sampling = False
+        await sampler
+
+        total_requests = sum(len(v) for v in self.latencies.values())
+        in_process = self.args.mode != "url"
+        return {
+            "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(self.args).items()},
+            "elapsed_seconds": elapsed,
+            "jobs_per_second": self.job_outcomes["completed"] / elapsed if elapsed else 0.0,
+            "requests_per_second": total_requests / elapsed if elapsed else 0.0,
+            "job_outcomes": dict(self.job_outcomes),
+            "status_codes": dict(self.statuses),
+            "latency_seconds": {name: _percentiles(v) for name, v in self.latencies.items()},
+            "job_latency_seconds": _percentiles(self.job_latencies),
+            "peak_threads": self.peak_threads if in_process else None,
+            "peak_rss_mb": max(self.peak_rss, _peak_rss_mb()) if in_process else None,
+            "final_threads": threading.active_count() if in_process else None,
+        }
+
+
+def _install_stub(args: argparse.Namespace):
+    """Configure the app for load testing and swap in the stub engine."""
+    os.environ["MAX_CONCURRENT_JOBS"] = str(args.slots)
+    # Keep limiter state out of the shared on-disk store so runs do not affect each other
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+    from app.main import app
+    from app.routes import api
+
+    api.generate_poster = StubEngine(
+        latency=args.stub_latency,
+        jitter=args.stub_jitter,
+        memory_mb=args.stub_memory_mb,
+        failure_rate=args.stub_failure_rate,
+    )
+    return app
+
+
+def _cleanup_outputs() -> None:
+    from app.engine.config import OUTPUT_DIR
+
+    for path in OUTPUT_DIR.glob("loadtest_*.png"):
+        path.unlink(missing_ok=True)
+
+
+async def _main(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(60.0)
+    if args.mode == "url":
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+            return await LoadRun(client, args).run()
+
+    app = _install_stub(args)
+    if args.mode == "asgi":
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+            return await LoadRun(client, args).run()
+
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning")
+    server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+            return await LoadRun(client, args).run()
+    finally:
+        server.should_exit = True
+        await serve_task
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="API load test with a stub poster engine")
+    parser.add_argument("--mode", choices=["asgi", "local", "url"], default="asgi")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Target for --mode url")
+    parser.add_argument("--port", type=int, default=8099, help="Port for --mode local")
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent virtual users")
+    parser.add_argument("--poll", choices=["interval", "long"], default="interval")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--job-timeout", type=float, default=900.0)
+    parser.add_argument("--same-ip", action="store_true", help="Send every request from one client IP")
+    parser.add_argument("--slots", type=int, default=3, help="MAX_CONCURRENT_JOBS for the app")
+    parser.add_argument("--stub-latency", type=float, default=1.0)
+    parser.add_argument("--stub-jitter", type=float, default=0.0)
+    parser.add_argument("--stub-memory-mb", type=float, default=0.0)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(_main(args))
+    finally:
+        if args.mode != "url":
+            _cleanup_outputs()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Local record/replay stand-in for Overpass and Nominatim.
+
+Serves recorded upstream responses over HTTP so the engine, load tests and
+benchmarks can run reproducibly without the public services. Each Overpass
+mirror gets its own path prefix and fault profile, so mirror fallback can be
+exercised against a degraded mirror list:
+
+    python -m bench.upstream --port 8765 \\
+        --mirror primary:error_rate=1.0 \\
+        --mirror secondary:latency=2,bandwidth=200000 \\
+        --nominatim latency=0.3
+
+    OVERPASS_ENDPOINTS=http://127.0.0.1:8765/primary/api,http://127.0.0.1:8765/secondary/api \\
+    NOMINATIM_URL=http://127.0.0.1:8765/nominatim  uvicorn app.main:app
+
+Fault profile keys: latency and jitter (seconds), error_rate (0-1) answered
+with error_status (default 504), timeout_rate (0-1) requests that hang for
+`hang` seconds and then drop the connection, and bandwidth (bytes/second).
+
+Responses are looked up by a hash of the normalized request. With
+``--record`` a miss is forwarded to the real service and stored under
+``--recordings`` (default bench/recordings/); otherwise it is answered
+with ``--miss-status`` (default 404).
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+logger = logging.getLogger(__name__)
+
+RECORDINGS_DIR = Path(__file__).resolve().parent / "recordings"
+
+UPSTREAM_OVERPASS = "https://overpass-api.de/api"
+UPSTREAM_NOMINATIM = "https://nominatim.openstreetmap.org"
+USER_AGENT = "Cartographix/1.0 (upstream recorder)"
+
+_CHUNK_INTERVAL = 0.05  # seconds between writes when bandwidth-limited
+
+
+@dataclass
+class FaultProfile:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 504
+    timeout_rate: float = 0.0
+    hang: float = 200.0
+    bandwidth: int = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "FaultProfile":
+        """Parse "key=value,key=value" into a profile."""
+        types = {f.name: f.type for f in fields(cls)}
+        values: Dict[str, object] = {}
+        for item in filter(None, spec.split(",")):
+            key, _, raw = item.partition("=")
+            key = key.strip()
+            if key not in types:
+                raise ValueError(f"Unknown fault option {key!r}; expected one of {sorted(types)}")
+            values[key] = int(raw) if types[key] in (int, "int") else float(raw)
+        return cls(**values)  # type: ignore[arg-type]
+
+
+def _request_key(service: str, path: str, params: List[Tuple[str, str]]) -> str:
+    if service == "overpass":
+        query = dict(params).get("data", "")
+        material = "overpass\n" + re.sub(r"\s+", " ", query).strip()
+    else:
+        material = f"nominatim\n{path}\n{urlencode(sorted(params))}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class RecordingStore:
+    """Recorded responses on disk, one gzipped JSON file per request key."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, service: str, key: str) -> Path:
+        return self.directory / service / f"{key}.json.gz"
+
+    def get(self, service: str, key: str) -> Optional[dict]:
+        path = self._path(service, key)
+        if not path.exists():
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            record = json.load(f)
+        record["body"] = base64.b64decode(record.pop("body_b64"))
+        return record
+
+    def put(self, service: str, key: str, request: dict, status: int, content_type: str, body: bytes) -> None:
+        path = self._path(service, key)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                json.dump({
+                    "request": request,
+                    "status": status,
+                    "content_type": content_type,
+                    "body_b64": base64.b64encode(body).decode("ascii"),
+                }, f)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "UpstreamStubServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _route(self) -> Tuple[Optional[str], Optional[FaultProfile], str]:
+        """Return (service, fault profile, upstream path) for the request path."""
+        path = urlsplit(self.path).path
+        parts = [p for p in path.split("/") if p]
+        if parts and parts[0] == "nominatim":
+            return "nominatim", self.server.nominatim_profile, "/" + "/".join(parts[1:])
+        if len(parts) >= 3 and parts[1] == "api" and parts[2] == "interpreter":
+            profile = self.server.mirrors.get(parts[0])
+            if profile is not None:
+                return "overpass", profile, "/interpreter"
+        return None, None, path
+
+    def _params(self) -> List[Tuple[str, str]]:
+        params = parse_qsl(urlsplit(self.path).query, keep_blank_values=True)
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8") if length else ""
+            params += parse_qsl(body, keep_blank_values=True)
+        return params
+
+    def _send(self, status: int, content_type: str, body: bytes, bandwidth: int = 0) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        chunk = max(1, int(bandwidth * _CHUNK_INTERVAL))
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            self.wfile.flush()
+            time.sleep(_CHUNK_INTERVAL)
+
+    def _handle(self) -> None:
+        service, profile, upstream_path = self._route()
+        params = self._params()
+        if service is None or profile is None:
+            self._send(404, "text/plain", b"unknown endpoint")
+            return
+        mirror = urlsplit(self.path).path.strip("/").split("/")[0]
+        self.server.count(f"{mirror}:requests")
+
+        delay = profile.latency + random.uniform(-profile.jitter, profile.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < profile.timeout_rate:
+            self.server.count(f"{mirror}:timeouts")
+            time.sleep(profile.hang)
+            self.close_connection = True
+            return
+        if roll < profile.timeout_rate + profile.error_rate:
+            self.server.count(f"{mirror}:errors")
+            self._send(profile.error_status, "text/plain", b"simulated upstream error")
+            return
+
+        key = _request_key(service, upstream_path, params)
+        record = self.server.store.get(service, key)
+        if record is None and self.server.record:
+            record = self.server.fetch_upstream(service, upstream_path, params, key)
+        if record is None:
+            self.server.count(f"{mirror}:misses")
+            logger.warning("No recording for %s %s (key %s)", service, upstream_path, key[:12])
+            self._send(self.server.miss_status, "text/plain", b"no recording for this request")
+            return
+        self.server.count(f"{mirror}:hits")
+        self._send(record["status"], record["content_type"], record["body"], profile.bandwidth)
+
+    def do_GET(self) -> None:  # noqa: N802
+        if urlsplit(self.path).path == "/_stats":
+            body = json.dumps(self.server.stats()).encode("utf-8")
+            self._send(200, "application/json", body)
+            return
+        self._handle()
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._handle()
+
+
+class UpstreamStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        mirrors: Dict[str, FaultProfile],
+        nominatim_profile: Optional[FaultProfile] = None,
+        recordings: Path = RECORDINGS_DIR,
+        record: bool = False,
+        miss_status: int = 404,
+        upstream_overpass: str = UPSTREAM_OVERPASS,
+        upstream_nominatim: str = UPSTREAM_NOMINATIM,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.mirrors = mirrors
+        self.nominatim_profile = nominatim_profile or FaultProfile()
+        self.store = RecordingStore(recordings)
+        self.record = record
+        self.miss_status = miss_status
+        self.upstream_overpass = upstream_overpass.rstrip("/")
+        self.upstream_nominatim = upstream_nominatim.rstrip("/")
+        self._counts: Counter[str] = Counter()
+        self._counts_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def overpass_endpoints(self) -> List[str]:
+        """Mirror base URLs in the form expected by OVERPASS_ENDPOINTS."""
+        return [f"{self.base_url}/{name}/api" for name in self.mirrors]
+
+    @property
+    def nominatim_url(self) -> str:
+        return f"{self.base_url}/nominatim"
+
+    def count(self, name: str) -> None:
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def fetch_upstream(self, service: str, path: str, params: List[Tuple[str, str]], key: str) -> dict:
+        """Forward a request to the real service and store the response."""
+        import httpx
+
+        headers = {"User-Agent": USER_AGENT}
+        if service == "overpass":
+            resp = httpx.post(self.upstream_overpass + path, data=dict(params), headers=headers, timeout=300)
+        else:
+            resp = httpx.get(self.upstream_nominatim + path, params=params, headers=headers, timeout=30)
+        content_type = resp.headers.get("content-type", "application/json")
+        request = {"path": path, "params": params}
+        self.store.put(service, key, request, resp.status_code, content_type, resp.content)
+        logger.info("Recorded %s %s -> %d (%d bytes)", service, path, resp.status_code, len(resp.content))
+        return {"status": resp.status_code, "content_type": content_type, "body": resp.content}
+
+    def start(self) -> "UpstreamStubServer":
+        """Serve in a background thread (for use from harnesses)."""
+        self._thread = threading.Thread(target=self.serve_forever, name="upstream-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def _parse_mirror(spec: str) -> Tuple[str, FaultProfile]:
+    name, _, options = spec.partition(":")
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", name) or name == "nominatim":
+        raise argparse.ArgumentTypeError(f"Invalid mirror name {name!r}")
+    return name, FaultProfile.parse(options)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Record/replay stand-in for Overpass and Nominatim")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mirror", action="append", type=_parse_mirror, default=[],
+                        help="NAME[:key=value,...] — an Overpass mirror and its fault profile (repeatable)")
+    parser.add_argument("--nominatim", default="", help="Fault profile for Nominatim (key=value,...)")
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR)
+    parser.add_argument("--record", action="store_true", help="Forward misses upstream and record them")
+    parser.add_argument("--miss-status", type=int, default=404)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    mirrors = dict(args.mirror) or {"primary": FaultProfile()}
+    server = UpstreamStubServer(
+        (args.host, args.port),
+        mirrors,
+        nominatim_profile=FaultProfile.parse(args.nominatim),
+        recordings=args.recordings,
+        record=args.record,
+        miss_status=args.miss_status,
+    )
+    print(f"OVERPASS_ENDPOINTS={','.join(server.overpass_endpoints)}")
+    print(f"NOMINATIM_URL={server.nominatim_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats(), indent=2, sort_keys=True))
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -40,8 +40,9 @@ export default function PosterReady({
             <Section style={bodySection}>
               <Text style={paragraph}>
                 Your custom map poster of{" "}
-                <span style={bold}>{city}</span> has been generated
-                and is attached to this email as a high-resolution PNG.
+                <span style={bold}>{city}</span> has been generated{" "}
+                {/* Attachment or download-link sentence, injected by Python */}
+                <span dangerouslySetInnerHTML={{ __html: "{{delivery}}" }} />
               </Text>
 
               {/* Details card — rows injected by Python via placeholder */}
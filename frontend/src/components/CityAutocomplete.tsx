@@ -6,7 +6,7 @@ import type { GeocodeSuggestion } from '@/lib/api';
 interface CityAutocompleteProps {
   value: string;
   onChange: (city: string) => void;
-  onSelectSuggestion: (city: string, country: string) => void;
+  onSelectSuggestion: (city: string, country: string, lat: number, lon: number) => void;
   id?: string;
   className?: string;
 }
@@ -56,7 +56,7 @@ export default function CityAutocomplete({
   }, []);
 
   const handleSelect = (suggestion: GeocodeSuggestion) => {
-    onSelectSuggestion(suggestion.city, suggestion.country);
+    onSelectSuggestion(suggestion.city, suggestion.country, suggestion.lat, suggestion.lon);
     setIsOpen(false);
     setSuggestions([]);
   };
@@ -14,6 +14,9 @@ const FORMATS: FormatOption[] = [
   { id: 'hd_wallpaper', name: 'HD Wallpaper', width: 16, height: 9, pixels: '1920×1080' },
   { id: '4k_wallpaper', name: '4K Wallpaper', width: 16, height: 9, pixels: '3840×2160' },
   { id: 'a4_print', name: 'A4 Print', width: 8.3, height: 11.7, pixels: '2480×3508' },
+  { id: 'a2_print', name: 'A2 Print', width: 16.5, height: 23.4, pixels: '4962×7017' },
+  { id: 'a1_print', name: 'A1 Print', width: 23.4, height: 33.1, pixels: '7017×9933' },
+  { id: 'a0_print', name: 'A0 Print', width: 33.1, height: 46.8, pixels: '9933×14043' },
 ];
 
 interface FormatSelectorProps {
@@ -23,7 +26,7 @@ interface FormatSelectorProps {
 
 export default function FormatSelector({ selected, onSelect }: FormatSelectorProps) {
   return (
-    <div className="grid grid-cols-5 gap-3">
+    <div className="grid grid-cols-4 gap-3">
       {FORMATS.map((fmt) => {
         const isSelected = fmt.id === selected;
         const maxDim = 40;
@@ -46,6 +46,8 @@ export default function Generator() {
   const [themes, setThemes] = useState<Theme[]>(FALLBACK_THEMES);
   const [city, setCity] = useState('');
   const [country, setCountry] = useState('');
+  // Coordinates of the picked suggestion; cleared when the location is edited by hand
+  const [coords, setCoords] = useState<{ lat: number; lon: number } | null>(null);
   const [theme, setTheme] = useState('default');
   const [distance, setDistance] = useState(10000);
   const [email, setEmail] = useState('');
@@ -131,7 +133,7 @@ export default function Generator() {
     if (!city.trim()) return;
     setIsSubmitting(true);
     try {
-      const result = await generatePoster({ city, country, theme, distance, email, output_format: outputFormat, custom_title: customTitle, landmarks });
+      const result = await generatePoster({ city, country, theme, distance, email, output_format: outputFormat, custom_title: customTitle, landmarks, ...(coords ?? {}) });
       setJobId(result.job_id);
       setEstimatedSeconds(result.estimated_seconds);
       pollCountRef.current = 0;
@@ -153,6 +155,7 @@ export default function Generator() {
     setAppState('default');
     setCity('');
     setCountry('');
+    setCoords(null);
     setEmail('');
     setOutputFormat('instagram');
     setLandmarks([]);
@@ -204,10 +207,14 @@ export default function Generator() {
                   <CityAutocomplete
                     id="city"
                     value={city}
-                    onChange={setCity}
-                    onSelectSuggestion={(c, co) => {
+                    onChange={(c) => {
+                      setCity(c);
+                      setCoords(null);
+                    }}
+                    onSelectSuggestion={(c, co, lat, lon) => {
                       setCity(c);
                       setCountry(co);
+                      setCoords({ lat, lon });
                     }}
                     className="border-[#E5E7EB] dark:border-[#2A2A2A] dark:bg-[#1A1A1A] dark:text-white rounded-lg px-4 py-3 focus:border-[#0A0A0A] dark:focus:border-[#555] focus:ring-[#0A0A0A]/10"
                   />
@@ -220,7 +227,10 @@ export default function Generator() {
                   <Input
                     id="country"
                     value={country}
-                    onChange={(e) => setCountry(e.target.value)}
+                    onChange={(e) => {
+                      setCountry(e.target.value);
+                      setCoords(null);
+                    }}
                     className="border-[#E5E7EB] dark:border-[#2A2A2A] dark:bg-[#1A1A1A] dark:text-white rounded-lg px-4 py-3 focus:border-[#0A0A0A] dark:focus:border-[#555] focus:ring-[#0A0A0A]/10"
                   />
                 </div>
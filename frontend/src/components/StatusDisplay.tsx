@@ -398,7 +398,9 @@ export default function StatusDisplay({ state, city, stage, email, posterUrl, er
             >
               <div className="rounded-lg overflow-hidden shadow-xl border border-[#E5E7EB] dark:border-[#2A2A2A]">
                 <img
-                  src={posterUrl}
+                  src={`${posterUrl}?w=1024`}
+                  srcSet={`${posterUrl}?w=512 512w, ${posterUrl}?w=1024 1024w`}
+                  sizes="(max-width: 448px) 100vw, 448px"
                   alt={`Map poster of ${city}`}
                   className="w-full h-auto"
                 />
@@ -19,6 +19,8 @@ export interface GenerateRequest {
   output_format: string;
   custom_title: string;
   landmarks: Landmark[];
+  lat?: number;
+  lon?: number;
 }
 
 export interface GenerateResponse {
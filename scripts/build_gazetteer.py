@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Build the offline city gazetteer used by /api/geocode autocomplete.
+
+Downloads the GeoNames cities dump (cities with population >= 15000 by
+default) and country names, and writes the memory-mappable index to
+backend/data/gazetteer.bin.
+
+Usage:
+    python scripts/build_gazetteer.py [--source cities15000.zip] [--countries countryInfo.txt] [--output PATH]
+        [--source-sha256 HEX] [--countries-sha256 HEX]
+
+--source and --countries accept URLs or local files (.zip or .txt).
+GeoNames regenerates its dumps daily, so reproducible builds should point
+them at a dated copy and pass its sha256; the build fails on a mismatch.
+GeoNames data is licensed CC BY 4.0.
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import sys
+import time
+import urllib.request
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.gazetteer import GAZETTEER_PATH, write_index  # noqa: E402
+
+GEONAMES_URL = "https://download.geonames.org/export/dump"
+DEFAULT_SOURCE = f"{GEONAMES_URL}/cities15000.zip"
+DEFAULT_COUNTRIES = f"{GEONAMES_URL}/countryInfo.txt"
+
+
+def read_text(source: str, sha256: Optional[str] = None, timeout: int = 120) -> str:
+    """Read a URL or local file, unpacking the first .txt member of a zip.
+
+    With sha256, exits unless the downloaded or read bytes have that digest.
+    """
+    if source.startswith(("http://", "https://")):
+        buf = io.BytesIO()
+        with urllib.request.urlopen(source, timeout=timeout) as resp:
+            shutil.copyfileobj(resp, buf)
+        data = buf.getvalue()
+    else:
+        data = Path(source).read_bytes()
+    if sha256:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != sha256.lower():
+            sys.exit(f"Checksum mismatch for {source}: expected sha256 {sha256}, got {digest}")
+    if data[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            member = next(n for n in zf.namelist() if n.endswith(".txt"))
+            data = zf.read(member)
+    return data.decode("utf-8")
+
+
+def parse_countries(text: str) -> Dict[str, str]:
+    countries = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        cols = line.split("\t")
+        if len(cols) > 4:
+            countries[cols[0]] = cols[4]
+    return countries
+
+
+def _useful_alt_name(name: str) -> bool:
+    # Keep Latin-script spellings; skip codes like "NYC" and other scripts
+    if not name or not name.isascii():
+        return False
+    return not (len(name) <= 4 and name.isupper())
+
+
+def parse_cities(text: str, countries: Dict[str, str]) -> Iterator[Tuple[str, str, float, float, int, List[str]]]:
+    """Yield (name, country, lat, lon, population, alt_names) from a GeoNames dump."""
+    for line in text.splitlines():
+        cols = line.split("\t")
+        if len(cols) < 15:
+            continue
+        name, ascii_name, alt_names = cols[1], cols[2], cols[3]
+        country = countries.get(cols[8], cols[8])
+        aliases = [ascii_name] + [a for a in alt_names.split(",") if _useful_alt_name(a)]
+        yield name, country, float(cols[4]), float(cols[5]), int(cols[14] or 0), aliases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline city gazetteer")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="GeoNames cities dump (URL or file)")
+    parser.add_argument("--countries", default=DEFAULT_COUNTRIES, help="GeoNames countryInfo.txt (URL or file)")
+    parser.add_argument("--output", type=Path, default=GAZETTEER_PATH)
+    parser.add_argument("--source-sha256", help="Expected sha256 of --source")
+    parser.add_argument("--countries-sha256", help="Expected sha256 of --countries")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    print(f"Reading countries from {args.countries}", flush=True)
+    countries = parse_countries(read_text(args.countries, args.countries_sha256))
+    print(f"Reading cities from {args.source}", flush=True)
+    cities = read_text(args.source, args.source_sha256)
+
+    count = write_index(parse_cities(cities, countries), args.output)
+    size_mb = args.output.stat().st_size / 1024 / 1024
+    print(f"Wrote {count} places to {args.output} ({size_mb:.1f} MB) in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,32 @@
 #!/usr/bin/env python3
 """Generate theme preview posters for all cities × all themes.
 
-Submits jobs to the running backend API, polls for completion,
-and downloads the resulting PNGs to frontend/public/previews/{city_slug}/{theme}.png
+Runs the poster engine in-process: each city is geocoded, fetched and
+projected once, then every theme is rendered from that shared data across a
+process pool. The next city is fetched while the previous one renders.
+Previews are written as they finish to
+frontend/public/previews/{city_slug}/{theme}.jpg, and existing files are
+skipped, so an interrupted run can simply be restarted.
 
 Usage:
-    python scripts/generate_previews.py [--concurrency 2] [--base-url http://localhost:8000]
+    python scripts/generate_previews.py [--workers 4] [--cities Paris Tokyo] [--themes midnight ocean] [--force]
 """
 
 import argparse
-import json
-import shutil
+import os
+import pickle
+import sys
+import tempfile
+import threading
 import time
-import urllib.request
-import urllib.error
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.models.themes import THEMES  # noqa: E402
 
 CITIES = [
     ("New York", "United States"),
@@ -31,11 +42,10 @@ CITIES = [
     ("Beijing", "China"),
 ]
 
-THEMES = [
-    "default", "classic", "midnight", "ocean", "forest", "sunset", "neon",
-    "pastel", "monochrome", "vintage", "arctic", "desert", "cyberpunk",
-    "watercolor", "blueprint", "autumn", "minimal",
-]
+DISTANCE = 10000
+OUTPUT_FORMAT = "instagram"
+PREVIEW_SIZE = 800  # px, longest side
+JPEG_QUALITY = 85
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_DIR = SCRIPT_DIR.parent
@@ -46,137 +56,125 @@ def city_slug(city: str) -> str:
     return city.lower().replace(" ", "_")
 
 
-def api_post(url: str, data: dict, timeout: int = 30) -> dict:
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(data).encode(),
-        headers={"Content-Type": "application/json"},
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        return json.loads(resp.read())
-
-
-def api_get(url: str, timeout: int = 10) -> dict:
-    with urllib.request.urlopen(url, timeout=timeout) as resp:
-        return json.loads(resp.read())
-
-
-def download_file(url: str, dest: Path, timeout: int = 60) -> None:
-    with urllib.request.urlopen(url, timeout=timeout) as resp:
-        with open(dest, "wb") as f:
-            shutil.copyfileobj(resp, f)
-
-
-def generate_and_download(
-    base_url: str, city: str, country: str, theme: str, out_dir: Path
-) -> str:
-    """Submit a job, poll until done, download the poster. Returns status message."""
-    slug = city_slug(city)
-    dest = out_dir / slug / f"{theme}.png"
-
-    if dest.exists():
-        return f"SKIP  {city} / {theme} (already exists)"
-
-    # Submit job
-    try:
-        result = api_post(
-            f"{base_url}/api/generate",
-            {
-                "city": city,
-                "country": country,
-                "theme": theme,
-                "distance": 10000,
-                "email": "",
-                "output_format": "instagram",
-                "custom_title": "",
-                "landmarks": [],
-            },
-        )
-    except Exception as e:
-        return f"FAIL  {city} / {theme} — submit error: {e}"
-
-    job_id = result["job_id"]
-
-    # Poll for completion (up to 3 minutes)
-    for _ in range(180):
-        time.sleep(1)
-        try:
-            data = api_get(f"{base_url}/api/status/{job_id}")
-        except Exception:
-            continue
+def prepare_city(city: str, country: str, work_dir: Path) -> Path:
+    """Geocode, fetch and project a city once; returns a pickle the workers load."""
+    from app.engine.generator import fetch_distance, fetch_extent, fetch_map_data, geocode_city, project_map_data
 
-        status = data["status"]
+    center = geocode_city(city, country)
+    fetch_dist = fetch_distance(DISTANCE, OUTPUT_FORMAT)
+    layers = project_map_data(*fetch_map_data(center, fetch_extent(DISTANCE, OUTPUT_FORMAT)))
+    path = work_dir / f"{city_slug(city)}.pickle"
+    with open(path, "wb") as f:
+        pickle.dump((layers, center, fetch_dist), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
 
-        if status == "completed":
-            poster_url = data.get("poster_url")
-            if not poster_url:
-                return f"FAIL  {city} / {theme} — completed but no poster URL"
 
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            try:
-                download_file(f"{base_url}{poster_url}", dest)
-            except Exception as e:
-                return f"FAIL  {city} / {theme} — download error: {e}"
+# Per worker process: the most recently loaded city (tasks arrive city by city)
+_loaded: Dict[Path, tuple] = {}
+
 
-            size_kb = dest.stat().st_size / 1024
-            return f"OK    {city} / {theme} ({size_kb:.0f} KB)"
+def _load_city(path: Path) -> tuple:
+    if path not in _loaded:
+        _loaded.clear()
+        with open(path, "rb") as f:
+            _loaded[path] = pickle.load(f)
+    return _loaded[path]
 
-        if status == "failed":
-            err = data.get("error_message", "unknown error")
-            return f"FAIL  {city} / {theme} — {err}"
 
-    return f"TIMEOUT {city} / {theme}"
+def render_preview(data_path: Path, city: str, country: str, theme: str, dest: Path) -> str:
+    """Render one theme for a prepared city and write it as a JPEG preview."""
+    from PIL import Image
+
+    from app.engine.generator import render_poster_image
+
+    start = time.monotonic()
+    (streets, water, parks), center, fetch_dist = _load_city(data_path)
+    rgba = render_poster_image(
+        streets, water, parks, center,
+        city=city,
+        country=country,
+        theme=theme,
+        output_format=OUTPUT_FORMAT,
+        fetch_dist=fetch_dist,
+        projected=True,
+    )
+    image = Image.fromarray(rgba[..., :3])
+    image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_suffix(".tmp")
+    image.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    tmp.replace(dest)
+    size_kb = dest.stat().st_size / 1024
+    return f"OK    {city} / {theme} ({size_kb:.0f} KB, {time.monotonic() - start:.1f}s)"
 
 
 def main():
     parser = argparse.ArgumentParser(description="Generate theme preview posters")
-    parser.add_argument("--concurrency", type=int, default=2, help="Max concurrent jobs")
-    parser.add_argument("--base-url", default="http://localhost:8000", help="Backend URL")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Render processes")
+    parser.add_argument("--cities", nargs="*", help="Only these cities (default: all)")
+    parser.add_argument("--themes", nargs="*", help="Only these themes (default: all)")
+    parser.add_argument("--force", action="store_true", help="Re-render existing previews")
     args = parser.parse_args()
 
-    total = len(CITIES) * len(THEMES)
-    print(f"Generating {total} previews ({len(CITIES)} cities × {len(THEMES)} themes)")
-    print(f"Concurrency: {args.concurrency}")
+    cities = [(c, n) for c, n in CITIES if not args.cities or c in args.cities]
+    themes = [t for t in THEMES if not args.themes or t in args.themes]
+
+    total = len(cities) * len(themes)
+    print(f"Generating {total} previews ({len(cities)} cities × {len(themes)} themes)")
+    print(f"Workers: {args.workers}")
     print(f"Output: {OUTPUT_DIR}")
     print(flush=True)
 
-    # Check backend is up
-    try:
-        api_get(f"{args.base_url}/api/health", timeout=5)
-    except Exception as e:
-        print(f"ERROR: Backend not reachable at {args.base_url} — {e}")
-        return
-
-    completed = 0
-    failed = 0
-    skipped = 0
+    counts: Counter = Counter()
+    lock = threading.Lock()
     start = time.monotonic()
 
-    # Process city by city so OSMnx caching helps within each city
-    for city, country in CITIES:
-        print(f"\n--- {city}, {country} ---", flush=True)
-        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
-            futures = {
-                pool.submit(
-                    generate_and_download, args.base_url, city, country, theme, OUTPUT_DIR
-                ): theme
-                for theme in THEMES
-            }
-            for future in as_completed(futures):
-                result = future.result()
-                print(f"  {result}", flush=True)
-                if result.startswith("OK"):
-                    completed += 1
-                elif result.startswith("SKIP"):
-                    skipped += 1
+    def _report(label: str, future: Future) -> None:
+        try:
+            line = future.result()
+        except Exception as e:
+            line = f"FAIL  {label} — {e}"
+        with lock:
+            counts["completed" if line.startswith("OK") else "failed"] += 1
+            print(f"  {line}", flush=True)
+
+    with tempfile.TemporaryDirectory(prefix="cartographix-previews-") as tmp, \
+            ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for city, country in cities:
+            pending: List[Tuple[str, Path]] = []
+            for theme in themes:
+                dest = OUTPUT_DIR / city_slug(city) / f"{theme}.jpg"
+                if dest.exists() and not args.force:
+                    with lock:
+                        counts["skipped"] += 1
                 else:
-                    failed += 1
+                    pending.append((theme, dest))
+            if not pending:
+                print(f"--- {city}, {country}: all previews exist", flush=True)
+                continue
+
+            print(f"--- {city}, {country}: fetching", flush=True)
+            t = time.monotonic()
+            try:
+                data_path = prepare_city(city, country, Path(tmp))
+            except ValueError as e:
+                print(f"  FAIL  {city} — {e}", flush=True)
+                with lock:
+                    counts["failed"] += len(pending)
+                continue
+            print(f"--- {city}, {country}: fetched in {time.monotonic() - t:.1f}s, rendering {len(pending)} themes",
+                  flush=True)
+
+            for theme, dest in pending:
+                future = pool.submit(render_preview, data_path, city, country, theme, dest)
+                future.add_done_callback(lambda f, label=f"{city} / {theme}": _report(label, f))
 
     elapsed = time.monotonic() - start
     print(f"\nDone in {elapsed / 60:.1f} minutes")
-    print(f"  Completed: {completed}")
-    print(f"  Skipped:   {skipped}")
-    print(f"  Failed:    {failed}")
+    print(f"  Completed: {counts['completed']}")
+    print(f"  Skipped:   {counts['skipped']}")
+    print(f"  Failed:    {counts['failed']}")
 
 
 if __name__ == "__main__":